@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Ticket:
+    """一个等待或正在执行的规划请求"""
+    client_id: str
+    future: asyncio.Future
+    enqueued: float = field(default_factory=time.monotonic)
+    admitted: Optional[float] = None
+    released: bool = False
+
+class AdmissionRejected(Exception):
+    """等待队列已满，请求被拒绝"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """规划请求的准入控制
+
+    同时执行的请求数不超过 max_active，其余请求进入有界等待队列；队列已满或同一客户端排队过多时
+    立即拒绝并给出建议的重试时间。空出执行名额时按客户端轮转放行，单个客户端的大量请求
+    不会让其他客户端一直排在后面。
+    """
+
+    def __init__(self, max_active: int, max_queue: int, max_queue_per_client: int, default_retry_after: float):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.default_retry_after = default_retry_after
+        self.active = 0
+        # 客户端 -> 该客户端的等待队列，按轮转顺序排列
+        self._queues: OrderedDict[str, deque] = OrderedDict()
+        self._avg_duration: Optional[float] = None
+        self.counters = {"admitted": 0, "rejected": 0, "completed": 0}
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def reserve(self, client_id: str) -> Ticket:
+        """登记一个请求，有空闲名额时立即放行，否则排队；无法排队时抛出 AdmissionRejected"""
+        ticket = Ticket(client_id, asyncio.get_running_loop().create_future())
+        if self.active < self.max_active and not self._queues:
+            self._admit(ticket)
+            return ticket
+        if self.queued >= self.max_queue:
+            self.counters["rejected"] += 1
+            raise AdmissionRejected(f"当前规划请求过多（{self.queued} 个排队中），请稍后重试", self.retry_after())
+        if len(self._queues.get(client_id, ())) >= self.max_queue_per_client:
+            self.counters["rejected"] += 1
+            raise AdmissionRejected(f"您已有 {self.max_queue_per_client} 个规划请求在排队，请等待完成后再提交", self.retry_after())
+        self._queues.setdefault(client_id, deque()).append(ticket)
+        return ticket
+
+    async def wait(self, ticket: Ticket, on_position: Optional[Callable[[int], None]] = None, interval: float = 1.0):
+        """等待请求被放行，排队期间排队位置变化时调用 on_position"""
+        last_position = None
+        while not ticket.future.done():
+            position = self.position(ticket)
+            if on_position and position != last_position:
+                on_position(position)
+                last_position = position
+            await asyncio.wait({ticket.future}, timeout=interval)
+
+    def release(self, ticket: Ticket):
+        """请求结束（完成、失败或取消）时调用，释放执行名额或退出等待队列"""
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.admitted is None:
+            queue = self._queues.get(ticket.client_id)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self._queues[ticket.client_id]
+            ticket.future.cancel()
+            return
+        self.active -= 1
+        self.counters["completed"] += 1
+        duration = time.monotonic() - ticket.admitted
+        self._avg_duration = duration if self._avg_duration is None else 0.8 * self._avg_duration + 0.2 * duration
+        self._dispatch()
+
+    def position(self, ticket: Ticket) -> int:
+        """请求前面还有多少个排队的请求，已放行时为 0"""
+        if ticket.admitted is not None:
+            return 0
+        # 按轮转放行的顺序模拟：每轮从每个客户端各取一个请求
+        queues = [list(queue) for queue in self._queues.values()]
+        ahead = 0
+        for depth in range(max((len(queue) for queue in queues), default=0)):
+            for queue in queues:
+                if depth < len(queue):
+                    if queue[depth] is ticket:
+                        return ahead
+                    ahead += 1
+        return ahead
+
+    def retry_after(self) -> int:
+        """按平均执行时长估算排队请求全部放行所需的秒数"""
+        if self._avg_duration is None:
+            return math.ceil(self.default_retry_after)
+        return max(1, math.ceil(self._avg_duration * (self.queued + 1) / self.max_active))
+
+    def _admit(self, ticket: Ticket):
+        self.active += 1
+        self.counters["admitted"] += 1
+        ticket.admitted = time.monotonic()
+        ticket.future.set_result(None)
+
+    def _dispatch(self):
+        while self.active < self.max_active and self._queues:
+            client_id, queue = self._queues.popitem(last=False)
+            ticket = queue.popleft()
+            if queue:
+                # 该客户端还有请求，排到轮转顺序的末尾
+                self._queues[client_id] = queue
+            if ticket.future.cancelled():
+                continue
+            self._admit(ticket)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "active": self.active,
+            "queued": self.queued,
+            "queued_clients": len(self._queues),
+            "max_active": self.max_active,
+            "max_queue": self.max_queue,
+            "avg_duration": round(self._avg_duration, 3) if self._avg_duration is not None else None,
+        }
@@ -9,10 +9,13 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import random
 import time
+import uuid
+import tracing
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+tracing.set_service_name("travel-frontend")
 
 # 设置页面配置
 st.set_page_config(page_icon="🐶", layout="wide")
@@ -95,34 +98,228 @@ def create_session():
     session = requests.Session()
     retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
     session.mount("http://", HTTPAdapter(max_retries=retries))
+    # 后端按客户端轮流放行排队的规划请求，每个浏览器会话使用固定的客户端 ID
+    if "client_id" not in st.session_state:
+        st.session_state.client_id = uuid.uuid4().hex
+    session.headers["X-Client-Id"] = st.session_state.client_id
     return session
 
+def show_busy(retry_after):
+    """后端排队已满（429）时提示稍后重试"""
+    wait = f"，建议约 {retry_after} 秒后重试" if retry_after else "，请稍后重试"
+    st.warning(f"🐶 当前使用人数较多，小金毛忙不过来啦{wait}")
+
+def queue_message(position):
+    """排队位置提示文本"""
+    if position == 0:
+        return "🐶 排队中，马上就轮到您了..."
+    return f"🐶 排队中，您前面还有 {position} 个规划请求..."
+
+BACKEND_URL = "http://localhost:8001"
+
+# 总结方式及其显示名称
+SUMMARY_MODES = {
+    "agent": "总结 Agent（完整）",
+    "budget": "总结 Agent（精简输入）",
+    "fast": "直接拼接（最快，不调用总结 Agent）",
+}
+SUMMARY_SOURCES = {
+    "agent": "总结 Agent",
+    "budget": "总结 Agent（精简输入）",
+    "fast": "字符串拼接（快速模式）",
+    "fallback": "字符串拼接（回退）",
+}
+
+# 流式事件中各分项对应的显示名称
+SECTION_LABELS = {
+    "weather": "天气信息",
+    "view": "景区安排",
+    "food": "餐饮安排",
+    "accommodation": "住宿安排",
+    "traffic": "出行安排",
+    "summary": "详细行程规划",
+}
+
+def stream_plan(payload, timeout):
+    """调用流式规划接口，逐个返回后端推送的事件
+
+    timeout 为两次事件之间的最长等待时间，而不是整个规划的总时长。
+    """
+    session = create_session()
+    # 不在追踪中时 traceparent 为 None，requests 会忽略值为 None 的请求头
+    headers = {"traceparent": tracing.traceparent()}
+    with session.post(f"{BACKEND_URL}/plan/stream", json=payload, headers=headers, stream=True, timeout=(10, timeout)) as response:
+        if response.status_code != 200:
+            yield {"event": "error", "status": response.status_code, "detail": response.text,
+                   "retry_after": response.headers.get("Retry-After")}
+            return
+        response.encoding = "utf-8"
+        for line in response.iter_lines(decode_unicode=True):
+            if line:
+                st.session_state.last_response = line
+                yield json.loads(line)
+
+def render_event(event):
+    """在当前容器中渲染一个已完成的阶段"""
+    if event["event"] == "section":
+        label = SECTION_LABELS.get(event["section"], event["section"])
+        prefix = f"{event['city']} · " if st.session_state.mode == "多城市" else ""
+        st.markdown(f"**{prefix}{label}**：\n{event['content']}")
+    elif event["event"] == "cities":
+        st.markdown("**城市分配**：" + "，".join(f"{c['name']} {c['days']}天" for c in event["cities"]))
+    elif event["event"] == "city":
+        st.markdown(f"✅ {event['city']} 规划完成")
+    elif event["event"] == "transport":
+        st.markdown(f"**{event['transport']}**：\n{event.get('details') or event.get('error')}")
+
+def live_key(event):
+    """返回可逐 token 显示的事件对应的占位区键，其他事件返回 None"""
+    if event["event"] == "draft" or event.get("stream") == "draft":
+        return f"draft-{event['index']}"
+    if (event["event"] == "section" and event["section"] == "summary") or event.get("stream") == "summary":
+        return f"summary-{event['city']}"
+    return None
+
+def render_live(placeholder, key, text):
+    """渲染逐 token 更新中的草稿卡片或总结"""
+    if key.startswith("draft-"):
+        placeholder.markdown(
+            f'<div class="card">'
+            f'<div class="card-title">方案 {key.split("-", 1)[1]}</div>'
+            f'<div class="card-content">{text}</div></div>',
+            unsafe_allow_html=True
+        )
+    else:
+        placeholder.markdown(f"**{SECTION_LABELS['summary']}**：\n{text}")
+
+def run_plan(payload, timeout):
+    """流式执行规划并逐步渲染各阶段，返回最终响应体；后端返回错误时显示错误并返回 None
+
+    每次规划开始一条新的追踪，追踪 ID 通过 traceparent 请求头传给后端。
+    """
+    with tracing.span("streamlit plan", kind="client", mode=payload["mode"], city=payload.get("city")):
+        logger.info(f"发送请求：mode={payload['mode']}, city={payload.get('city')}, days={payload.get('days')}, user_input={payload['user_input'][:50]}..., trace_id={tracing.trace_id()}")
+        return render_plan_stream(payload, timeout)
+
+def render_plan_stream(payload, timeout):
+    """读取流式规划事件并逐步渲染
+
+    草稿和总结按 token 实时填充到各自的占位区，其他阶段完成后整段显示。
+    """
+    live = {}  # 占位区键 -> [占位区, 当前回复的 message_id, 已收到的文本]
+    draft_cols = None
+    queue_placeholder = st.empty()
+    for event in stream_plan(payload, timeout):
+        if event["event"] == "queued":
+            queue_placeholder.info(queue_message(event["position"]))
+            continue
+        queue_placeholder.empty()
+        if event["event"] == "result":
+            logger.info(f"收到响应：{st.session_state.last_response}")
+            return event["data"]
+        if event["event"] == "error" and event["status"] == 429:
+            show_busy(event["retry_after"])
+            return None
+        if event["event"] == "error":
+            st.error(f"后端返回错误：状态码 {event['status']}, 详情：{event['detail']}")
+            return None
+        key = live_key(event)
+        if key is None:
+            render_event(event)
+            continue
+        if key not in live:
+            if key.startswith("draft-"):
+                draft_cols = draft_cols or st.columns(3)
+                placeholder = draft_cols[(event["index"] - 1) % 3].empty()
+            else:
+                placeholder = st.empty()
+            live[key] = [placeholder, None, ""]
+        entry = live[key]
+        if event["event"] == "token":
+            # message_id 变化说明 Agent 调用工具后开始了新的一轮回复，丢弃之前的中间文本
+            if entry[1] != event["message_id"]:
+                entry[1], entry[2] = event["message_id"], ""
+            entry[2] += event["delta"]
+        else:
+            entry[2] = event["content"]
+        render_live(entry[0], key, entry[2])
+    st.error("后端连接中断：未收到完整的规划结果")
+    return None
+
+def clear_job_param():
+    """从页面地址中移除规划任务 ID"""
+    if "job" in st.query_params:
+        del st.query_params["job"]
+
+def run_plan_job(payload, poll_interval=2):
+    """以异步任务方式执行规划并轮询进度，返回最终响应体；失败时显示错误并返回 None
+
+    任务 ID 记录在页面地址中，请求超时或刷新页面后可继续查询同一个任务。
+    """
+    session = create_session()
+    job_id = st.query_params.get("job")
+    if not job_id:
+        with tracing.span("streamlit plan job", kind="client", mode=payload["mode"]):
+            logger.info(f"提交规划任务：mode={payload['mode']}, user_input={payload['user_input'][:50]}..., trace_id={tracing.trace_id()}")
+            response = session.post(
+                f"{BACKEND_URL}/plan/jobs", json=payload, headers={"traceparent": tracing.traceparent()}, timeout=10
+            )
+        st.session_state.last_response = response.text
+        if response.status_code == 429:
+            show_busy(response.headers.get("Retry-After"))
+            return None
+        if response.status_code != 202:
+            st.error(f"后端返回错误：状态码 {response.status_code}, 详情：{response.json().get('detail', response.text)}")
+            return None
+        job_id = response.json()["job_id"]
+        st.query_params["job"] = job_id
+    shown = 0
+    queue_placeholder = st.empty()
+    while True:
+        response = session.get(f"{BACKEND_URL}/plan/jobs/{job_id}", timeout=10)
+        st.session_state.last_response = response.text
+        if response.status_code == 404:
+            clear_job_param()
+            st.error("规划任务不存在或已过期，请重新提交")
+            return None
+        job = response.json()
+        if job["status"] == "queued" and job.get("queue_position") is not None:
+            queue_placeholder.info(queue_message(job["queue_position"]))
+        else:
+            queue_placeholder.empty()
+        for event in job["sections"][shown:]:
+            render_event(event)
+        shown = len(job["sections"])
+        if job["status"] == "succeeded":
+            clear_job_param()
+            return job["result"]
+        if job["status"] == "failed":
+            clear_job_param()
+            st.error(f"后端返回错误：状态码 {job['error']['status']}, 详情：{job['error']['detail']}")
+            return None
+        time.sleep(poll_interval)
+
 def select_draft(draft):
     """处理草稿选择并生成详细规划"""
     with st.status("🐶 **小金毛生成详细规划中...**", state="running", expanded=True) as status:
         with st.container(height=500, border=False):
             try:
-                session = create_session()
                 logger.info(f"发送草稿选择请求：draft={draft[:50]}...")
-                response = session.post(
-                    "http://localhost:8001/plan",
-                    json={
+                response_data = run_plan(
+                    {
                         "mode": "单城市",
                         "city": st.session_state.city,
                         "days": st.session_state.days,
                         "user_input": st.session_state.user_input,
-                        "selected_draft": draft
+                        "selected_draft": draft,
+                        "context_token": st.session_state.context_token,
+                        "summary_mode": st.session_state.summary_mode
                     },
                     timeout=300
                 )
-                logger.info(f"收到响应：{response.status_code}, {response.text}")
-                st.session_state.last_response = response.text
-                response_data = response.json()
-                if response.status_code != 200:
-                    st.error(f"后端返回错误：状态码 {response.status_code}, 详情：{response_data.get('detail', response.text)}")
-                elif response_data.get("error"):
+                if response_data and response_data.get("error"):
                     st.error(f"后端处理失败：{response_data['error']}")
-                elif response_data.get("final_plan"):
+                elif response_data and response_data.get("final_plan"):
                     st.session_state.final_plan = response_data["final_plan"]
                     st.session_state.stage = "final"
             except requests.Timeout:
@@ -156,6 +353,9 @@ if __name__ == "__main__":
         st.session_state.city = None
         st.session_state.days = None
         st.session_state.last_response = None
+        st.session_state.context_token = None
+        st.session_state.mode = None
+        st.session_state.summary_mode = "agent"
 
     # 侧边栏
     with st.sidebar:
@@ -192,6 +392,12 @@ if __name__ == "__main__":
                 height=200,
                 help="请尽量详细描述您的偏好（如景点类型、餐饮口味、住宿要求、交通方式），以获得更精准的规划！"
             )
+            summary_mode = st.selectbox(
+                "行程总结方式",
+                list(SUMMARY_MODES),
+                format_func=SUMMARY_MODES.get,
+                help="直接拼接不调用总结 Agent，速度最快；精简输入会限制发送给总结 Agent 的内容长度"
+            )
             submitted = st.form_submit_button("提交")
 
         st.markdown("<hr style='border: 2px dotted #d4a017;'>", unsafe_allow_html=True)
@@ -202,35 +408,41 @@ if __name__ == "__main__":
             unsafe_allow_html=True
         )
 
+    # 刷新页面后继续查询尚未完成的多城市规划任务
+    resuming = not submitted and st.session_state.stage == "input" and "job" in st.query_params
+
     # 提交需求
-    if submitted and user_input and (mode == "多城市" or (mode == "单城市" and city and days)):
-        st.session_state.stage = "drafts" if mode == "单城市" else "cities"
-        st.session_state.user_input = user_input
-        st.session_state.city = city
-        st.session_state.days = days
+    if resuming or (submitted and user_input and (mode == "多城市" or (mode == "单城市" and city and days))):
+        if resuming:
+            st.session_state.stage = "cities"
+            st.session_state.mode = "多城市"
+        else:
+            clear_job_param()
+            st.session_state.stage = "drafts" if mode == "单城市" else "cities"
+            st.session_state.mode = mode
+            st.session_state.user_input = user_input
+            st.session_state.city = city
+            st.session_state.days = days
+            st.session_state.summary_mode = summary_mode
         with st.status("🐶 **小金毛正在为您规划...**", state="running", expanded=True) as status:
             with st.container(height=500, border=False):
-                st.markdown("正在生成行程规划，请稍候...")
+                st.markdown("正在生成行程规划，各部分完成后将依次显示...")
                 st.spinner("小金毛努力思考中 🐾")
                 try:
-                    session = create_session()
-                    logger.info(f"发送请求：mode={mode}, city={city}, days={days}, user_input={user_input[:50]}...")
-                    response = session.post(
-                        "http://localhost:8001/plan",
-                        json={"mode": mode, "city": city, "days": days, "user_input": user_input},
-                        timeout=180
-                    )
-                    logger.info(f"收到响应：{response.status_code}, {response.text}")
-                    st.session_state.last_response = response.text
-                    response_data = response.json()
-                    if response.status_code != 200:
-                        st.error(f"后端返回错误：状态码 {response.status_code}, 详情：{response_data.get('detail', response.text)}")
+                    payload = {"mode": mode, "city": city, "days": days, "user_input": user_input, "summary_mode": summary_mode}
+                    # 多城市规划耗时较长，使用异步任务避免请求超时或刷新页面导致结果丢失
+                    if st.session_state.mode == "多城市":
+                        response_data = run_plan_job(payload)
+                    else:
+                        response_data = run_plan(payload, timeout=180)
+                    if response_data is None:
                         st.session_state.stage = "input"
                     elif response_data.get("error"):
                         st.error(f"后端处理失败：{response_data['error']}")
                         st.session_state.stage = "input"
                     elif response_data.get("drafts"):
                         st.session_state.drafts = response_data["drafts"]
+                        st.session_state.context_token = response_data.get("context_token")
                         st.session_state.stage = "drafts"
                     elif response_data.get("cities"):
                         st.session_state.cities = response_data["cities"]
@@ -307,7 +519,7 @@ if __name__ == "__main__":
         st.subheader("小金毛的详细行程规划", anchor=False, divider="rainbow")
         with st.container():
             # 显示 summary_source
-            source_text = "总结 Agent" if st.session_state.final_plan['summary_source'] == "agent" else "字符串拼接（回退）"
+            source_text = SUMMARY_SOURCES.get(st.session_state.final_plan['summary_source'], "字符串拼接（回退）")
             st.markdown(f"**规划生成方式**：{source_text}")
             st.markdown(f"**详细行程规划**：\n{st.session_state.final_plan['summary']}")
             with st.expander("单独查看各项安排"):
@@ -0,0 +1,363 @@
+"""高德 MCP 服务的工具调用开销基准
+
+对 gaode_mcp_server.py 中的每个工具，在逐级增加的并发下分三层测量单次调用的开销：
+    httpx      直接请求本地假高德服务，即上游往返的下限
+    inprocess  在本进程内通过 FastMCP.call_tool 调用工具（参数校验、缓存/调度、结果 JSON 序列化）
+    sse        通过真实的 MCP 客户端经 SSE 传输调用，每个并发对应一条独立的 MCP 连接
+相邻两层的差值即该层的开销。每级并发记录吞吐（调用/秒）、延迟分位数（毫秒），
+sse 层额外记录服务进程的 RSS 与每条连接的内存占用，并给出吞吐不再增长时的饱和并发。
+
+默认自动启动 fake_amap_server.py 和 gaode_mcp_server.py（放开 key 限流），
+每次调用使用不同的参数，避开响应缓存和 single-flight 合并；--hot 时所有调用参数相同，测量缓存命中路径。
+
+示例：
+    python benchmarks/mcp_benchmark.py --concurrency 1 4 16 64 --calls 1000 --output mcp_bench.json
+    python benchmarks/mcp_benchmark.py --layers sse --amap-latency 0.05 --hot
+    python benchmarks/mcp_benchmark.py --url http://localhost:8000/sse --server-pid 12345 --layers sse
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from contextlib import AsyncExitStack
+from typing import Callable, Optional
+
+import httpx
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+
+from plan_benchmark import git_commit, summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYERS = ["httpx", "inprocess", "sse"]
+
+# 吞吐增幅低于该比例时认为已经饱和
+SATURATION_GAIN = 0.1
+
+def coordinate(i: int, lng: float = 120.130396, lat: float = 30.259242) -> str:
+    """按序号微调经度，生成互不相同的坐标"""
+    return f"{lng + i * 1e-6:.6f},{lat:.6f}"
+
+# 工具 -> (高德接口路径, 第 i 次调用的参数)；每个工具调用对应一次上游请求
+TOOL_CASES: dict[str, tuple[str, Callable[[int], dict]]] = {
+    "geocode": ("/v3/geocode/geo", lambda i: {"address": f"西湖{i}号", "city": "杭州"}),
+    "geocode_batch": ("/v3/geocode/geo", lambda i: {"addresses": [f"西湖{i}号", f"灵隐寺{i}号"], "city": "杭州"}),
+    "reverse_geocode": ("/v3/geocode/regeo", lambda i: {"location": coordinate(i)}),
+    "walking_direction": ("/v3/direction/walking", lambda i: {"origin": coordinate(i), "destination": "120.164838,30.255997"}),
+    "transit_direction": ("/v3/direction/transit/integrated", lambda i: {"origin": coordinate(i), "destination": "120.164838,30.255997", "city": "杭州"}),
+    "distance_matrix": ("/v3/distance", lambda i: {"origins": [coordinate(i), "120.101105,30.240993"], "destinations": ["120.164838,30.255997"]}),
+    "bicycling_direction": ("/v3/direction/bicycling", lambda i: {"origin": coordinate(i), "destination": "120.164838,30.255997"}),
+    "electrobike_direction": ("/v3/direction/electrobike", lambda i: {"origin": coordinate(i), "destination": "120.164838,30.255997"}),
+    "driving_direction": ("/v3/direction/driving", lambda i: {"origin": coordinate(i), "destination": "120.101105,30.240993"}),
+    "district_query": ("/v3/config/district", lambda i: {"keywords": "杭州", "page": str(i + 1)}),
+    "keyword_search": ("/v3/place/text", lambda i: {"keywords": f"景点{i}", "types": "110000", "city": "杭州"}),
+    "around_search": ("/v3/place/around", lambda i: {"location": coordinate(i), "types": "050000"}),
+    "polygon_search": ("/v3/place/polygon", lambda i: {"polygon": f"{coordinate(i)}|120.164838,30.255997", "types": "110000"}),
+    "id_query": ("/v3/place/detail", lambda i: {"id": f"B023B{i:05d}"}),
+    "traffic_event_query": ("/v3/event/queryByAdcode", lambda i: {
+        "adcode": "330100", "client_key": f"bench{i}", "timestamp": str(i), "digest": "0", "event_type": "0", "is_expressway": "0",
+    }),
+    "ip_location": ("/v3/ip", lambda i: {"ip": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"}),
+    "weather_query": ("/v3/weather/weatherInfo", lambda i: {"city": str(330100 + i), "extensions": "all"}),
+    "input_tips": ("/v3/assistant/inputtips", lambda i: {"keywords": f"西湖{i}", "city": "杭州"}),
+}
+
+def rss_bytes(pid: Optional[int]) -> Optional[int]:
+    """读取进程的常驻内存（仅 Linux），无法读取时返回 None"""
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+class CallPlan:
+    """按工具轮转分配调用，并为每次调用生成参数
+
+    整个基准共用一个序号，预热和各级并发的调用参数都不重复，不会命中前面调用写入的缓存。
+    """
+
+    def __init__(self, tools: list, hot: bool):
+        self.tools = tools
+        self.hot = hot
+        self.sequence = 0
+
+    def next(self) -> tuple[str, dict]:
+        i = self.sequence
+        self.sequence += 1
+        tool = self.tools[i % len(self.tools)]
+        _, make_args = TOOL_CASES[tool]
+        return tool, make_args(0 if self.hot else i // len(self.tools) + 1)
+
+async def drive(workers: list[Callable], plan: CallPlan, calls: int) -> dict:
+    """每个 worker 循环取下一次调用直到总数用完，返回该级并发的统计"""
+    records = []
+    remaining = [calls]
+
+    async def loop(call):
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            tool, args = plan.next()
+            start = time.perf_counter()
+            try:
+                await call(tool, args)
+                ok = True
+            except Exception:
+                ok = False
+            records.append((tool, (time.perf_counter() - start) * 1000, ok))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(loop(call) for call in workers))
+    elapsed = time.perf_counter() - start
+    ok_latencies = [latency for _, latency, ok in records if ok]
+    by_tool = {}
+    for tool in plan.tools:
+        tool_latencies = [latency for name, latency, ok in records if name == tool and ok]
+        by_tool[tool] = {
+            **summarize(tool_latencies),
+            "errors": sum(1 for name, _, ok in records if name == tool and not ok),
+        }
+    return {
+        "concurrency": len(workers),
+        "calls": len(records),
+        "errors": len(records) - len(ok_latencies),
+        "elapsed": round(elapsed, 3),
+        "calls_per_second": round(len(ok_latencies) / elapsed, 1) if elapsed else None,
+        "latency_ms": summarize(ok_latencies),
+        "by_tool": by_tool,
+    }
+
+async def run_httpx_layer(args, plan: CallPlan, concurrency: int) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=args.amap_url, limits=limits, timeout=args.timeout) as client:
+
+        async def call(tool: str, params: dict):
+            path, _ = TOOL_CASES[tool]
+            query = {key: "|".join(value) if isinstance(value, list) else value for key, value in params.items()}
+            response = await client.get(path, params=query)
+            response.raise_for_status()
+            response.json()
+
+        await drive([call] * concurrency, plan, args.warmup)
+        return await drive([call] * concurrency, plan, args.calls)
+
+async def run_inprocess_layer(args, plan: CallPlan, concurrency: int) -> dict:
+    # 环境变量需在导入前设置，与独立启动的 MCP 服务使用相同的配置
+    os.environ.update(server_env(args))
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    gaode = importlib.import_module("gaode_mcp_server")
+    # 导入时 FastMCP 把日志设为 INFO，每个 httpx 请求都会输出到终端；独立运行的服务输出被丢弃，这里也关掉
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    async def call(tool: str, arguments: dict):
+        await gaode.app.call_tool(tool, arguments)
+
+    try:
+        await drive([call] * concurrency, plan, args.warmup)
+        return await drive([call] * concurrency, plan, args.calls)
+    finally:
+        if gaode._http_client is not None:
+            await gaode._http_client.aclose()
+            gaode._http_client = None
+
+async def run_sse_layer(args, plan: CallPlan, concurrency: int) -> dict:
+    rss_idle = rss_bytes(args.server_pid)
+    async with AsyncExitStack() as stack:
+        sessions = []
+        for _ in range(concurrency):
+            read, write = await stack.enter_async_context(sse_client(args.url, timeout=args.timeout))
+            session = await stack.enter_async_context(ClientSession(read, write))
+            await session.initialize()
+            sessions.append(session)
+        rss_connected = rss_bytes(args.server_pid)
+
+        def caller(session: ClientSession):
+            async def call(tool: str, arguments: dict):
+                result = await session.call_tool(tool, arguments)
+                if result.isError:
+                    raise RuntimeError(result.content[0].text if result.content else "tool error")
+            return call
+
+        workers = [caller(session) for session in sessions]
+        await drive(workers, plan, args.warmup)
+        result = await drive(workers, plan, args.calls)
+        rss_loaded = rss_bytes(args.server_pid)
+    result["memory"] = {
+        "rss_idle": rss_idle,
+        "rss_connected": rss_connected,
+        "rss_after_calls": rss_loaded,
+        "bytes_per_connection": (rss_connected - rss_idle) // concurrency if rss_idle and rss_connected else None,
+    }
+    return result
+
+LAYER_RUNNERS = {"httpx": run_httpx_layer, "inprocess": run_inprocess_layer, "sse": run_sse_layer}
+
+def server_env(args) -> dict:
+    """MCP 服务的环境变量：指向假高德服务并放开 key 限流，避免测到的是调度器的等待"""
+    return {
+        "AMAP_BASE_URL": f"{args.amap_url}/v3",
+        "AMAP_ADVANCE_URL": f"{args.amap_url}/v5",
+        "AMAP_KEY_QPS": "1000000",
+    }
+
+async def wait_until_up(url: str, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise SystemExit(f"服务未能在 {timeout}s 内启动: {url}")
+                await asyncio.sleep(0.2)
+
+async def spawn_servers(args) -> list:
+    """启动假高德服务和 MCP 服务，返回子进程列表"""
+    processes = [subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "fake_amap_server.py"), "--port", str(args.amap_port),
+         "--latency", str(args.amap_latency)],
+        cwd=ROOT,
+    )]
+    await wait_until_up(f"{args.amap_url}/_fake/stats")
+    # 与 gaode_mcp_server.py 的入口相同，经 create_sse_app 启动，另外指定端口
+    processes.append(subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "gaode_mcp_server:create_sse_app", "--factory",
+         "--host", "127.0.0.1", "--port", str(args.mcp_port), "--log-level", "warning"],
+        cwd=ROOT, env={**os.environ, **server_env(args)}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    ))
+    await wait_until_up(args.url.rsplit("/", 1)[0] + "/stats")
+    return processes
+
+async def list_server_tools(url: str) -> list:
+    async with sse_client(url) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            return [tool.name for tool in (await session.list_tools()).tools]
+
+def saturation_point(levels: list) -> Optional[int]:
+    """吞吐相对上一级增长不足 SATURATION_GAIN 时，上一级的并发即饱和点；始终在增长时返回 None"""
+    for previous, current in zip(levels, levels[1:]):
+        if (current["calls_per_second"] or 0) < (previous["calls_per_second"] or 0) * (1 + SATURATION_GAIN):
+            return previous["concurrency"]
+    return None
+
+async def run_benchmark(args) -> dict:
+    processes = await spawn_servers(args) if args.spawn else []
+    if args.spawn:
+        args.server_pid = processes[1].pid
+    try:
+        server_tools = await list_server_tools(args.url)
+        missing = sorted(set(server_tools) - set(TOOL_CASES))
+        if missing:
+            print(f"以下工具没有基准参数，已跳过: {missing}")
+        tools = [tool for tool in TOOL_CASES if tool in server_tools and (not args.tools or tool in args.tools)]
+        if not tools:
+            raise SystemExit("没有可测的工具")
+
+        plan = CallPlan(tools, args.hot)
+        layers = {}
+        for layer in args.layers:
+            layers[layer] = {"levels": []}
+            for concurrency in args.concurrency:
+                level = await LAYER_RUNNERS[layer](args, plan, concurrency)
+                layers[layer]["levels"].append(level)
+                latency = level["latency_ms"]
+                print(f"{layer:<9} c={concurrency:<4} {level['calls_per_second']} 调用/秒 "
+                      f"p50={latency.get('p50')}ms p99={latency.get('p99')}ms 失败={level['errors']}", flush=True)
+            layers[layer]["saturation_concurrency"] = saturation_point(layers[layer]["levels"])
+
+        async with httpx.AsyncClient(timeout=10) as client:
+            try:
+                server_stats = (await client.get(args.url.rsplit("/", 1)[0] + "/stats")).json()
+            except Exception:
+                server_stats = None
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "url": args.url,
+            "amap_url": args.amap_url,
+            "amap_latency": args.amap_latency if args.spawn else None,
+            "calls_per_level": args.calls,
+            "hot": args.hot,
+            "tools": tools,
+        },
+        "layers": layers,
+        "overhead_ms": layer_overheads(layers),
+        "server_stats": server_stats,
+    }
+
+def layer_overheads(layers: dict) -> list:
+    """各级并发下相邻两层 p50 的差值，即该层单次调用的开销"""
+    present = [layer for layer in LAYERS if layer in layers]
+    rows = []
+    for index, concurrency in enumerate(level["concurrency"] for level in layers[present[0]]["levels"]):
+        row = {"concurrency": concurrency}
+        for lower, upper in zip(present, present[1:]):
+            low = layers[lower]["levels"][index]["latency_ms"].get("p50")
+            high = layers[upper]["levels"][index]["latency_ms"].get("p50")
+            row[f"{upper}-{lower}"] = round(high - low, 3) if low is not None and high is not None else None
+        rows.append(row)
+    return rows
+
+def print_report(report: dict):
+    for layer, item in report["layers"].items():
+        print(f"\n[{layer}] 饱和并发: {item['saturation_concurrency'] or '未饱和'}")
+        for level in item["levels"]:
+            latency = level["latency_ms"]
+            line = (f"  c={level['concurrency']:<4} {level['calls_per_second']:>8} 调用/秒  "
+                    f"p50={latency.get('p50')}ms p95={latency.get('p95')}ms p99={latency.get('p99')}ms")
+            memory = level.get("memory")
+            if memory and memory["bytes_per_connection"] is not None:
+                line += f"  每连接 {memory['bytes_per_connection'] / 1024:.0f}KiB RSS {memory['rss_after_calls'] / 1024 / 1024:.1f}MiB"
+            print(line)
+    if len(report["layers"]) > 1:
+        print("\n各层开销（p50 差值，毫秒）：")
+        for row in report["overhead_ms"]:
+            print("  " + "  ".join(f"{key}={value}" for key, value in row.items()))
+
+def main():
+    parser = argparse.ArgumentParser(description="高德 MCP 服务工具调用开销基准")
+    parser.add_argument("--url", default="http://127.0.0.1:8950/sse", help="MCP 服务的 SSE 地址")
+    parser.add_argument("--amap-url", default="http://127.0.0.1:8951", help="假高德服务地址")
+    parser.add_argument("--no-spawn", dest="spawn", action="store_false",
+                        help="不自动启动服务，使用 --url/--amap-url 指向已运行的服务")
+    parser.add_argument("--server-pid", type=int, help="不自动启动时，用于读取内存占用的 MCP 服务进程号")
+    parser.add_argument("--amap-latency", type=float, default=0.0, help="自动启动的假高德服务的固定延迟（秒）")
+    parser.add_argument("--layers", nargs="*", choices=LAYERS, default=LAYERS)
+    parser.add_argument("--tools", nargs="*", help="只测指定的工具（默认全部）")
+    parser.add_argument("--concurrency", nargs="*", type=int, default=[1, 2, 4, 8, 16, 32, 64], help="逐级测试的并发数")
+    parser.add_argument("--calls", type=int, default=500, help="每级并发的调用次数")
+    parser.add_argument("--warmup", type=int, default=50, help="每级并发正式计时前的预热调用次数")
+    parser.add_argument("--hot", action="store_true", help="所有调用使用相同参数，测量缓存命中路径")
+    parser.add_argument("--timeout", type=float, default=30, help="单次调用超时（秒）")
+    parser.add_argument("--output", default="mcp_benchmark.json", help="结果 JSON 文件")
+    args = parser.parse_args()
+    if args.spawn:
+        args.mcp_port = int(args.url.split("://", 1)[1].split("/", 1)[0].rsplit(":", 1)[1])
+        args.amap_port = int(args.amap_url.rsplit(":", 1)[1])
+
+    report = asyncio.run(run_benchmark(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_report(report)
+    print(f"\n结果已写入 {args.output}")
+
+if __name__ == "__main__":
+    main()
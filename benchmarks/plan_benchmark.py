@@ -0,0 +1,285 @@
+"""/plan 负载测试与延迟基准
+
+按给定并发回放请求语料（单城市草稿、选定草稿后的详细规划、多城市），统计整体与分类的延迟分位数、
+吞吐量以及各阶段耗时分布，结果写入 JSON 文件，便于在不同提交之间对比。
+
+示例：
+    python benchmarks/plan_benchmark.py --concurrency 4 --repeat 3 --output bench.json
+    python benchmarks/plan_benchmark.py --endpoint stream --kinds draft final
+    python benchmarks/plan_benchmark.py --compare old.json bench.json
+
+离线基准（不调用 Azure 和高德，结果可复现）：先启动 fake_amap_server.py，再以
+LLM_BACKEND=fake AMAP_BASE_URL=http://localhost:8900/v3 AMAP_ADVANCE_URL=http://localhost:8900/v5
+启动两个服务，模型延迟由 FAKE_LLM_LATENCY/FAKE_LLM_TOKEN_LATENCY 控制。
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import statistics
+import subprocess
+import time
+import uuid
+from collections import Counter
+from typing import Optional
+
+import httpx
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus.jsonl")
+
+def load_corpus(path: str, kinds: Optional[list]) -> list:
+    """读取语料，每行包含 name、kind（draft/final/multi）和发送给 /plan 的 request"""
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                if not kinds or entry["kind"] in kinds:
+                    entries.append(entry)
+    if not entries:
+        raise SystemExit(f"语料为空: {path}")
+    return entries
+
+def percentile(values: list, q: float) -> Optional[float]:
+    """最近秩法分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+def summarize(values: list) -> dict:
+    """延迟分布摘要（秒）"""
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(statistics.fmean(values), 3),
+        "p50": round(percentile(values, 50), 3),
+        "p90": round(percentile(values, 90), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(max(values), 3),
+    }
+
+def stage_timings(endpoint_result: dict) -> list:
+    """从响应体中取出各阶段耗时记录：单城市详细规划的 final_plan，多城市每个城市的 plan"""
+    plans = []
+    if "final_plan" in endpoint_result:
+        plans.append(endpoint_result["final_plan"])
+    for item in endpoint_result.get("cities") or []:
+        if isinstance(item, dict) and isinstance(item.get("plan"), dict):
+            plans.append(item["plan"])
+    return [(stage, timing) for plan in plans for stage, timing in (plan.get("timings") or {}).items()]
+
+async def send_plan(client: httpx.AsyncClient, payload: dict, headers: dict) -> tuple:
+    """调用 /plan，返回 (状态码, 响应体, 事件到达时间)"""
+    response = await client.post("/plan", json=payload, headers=headers)
+    body = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
+    return response.status_code, body, {}
+
+async def send_stream(client: httpx.AsyncClient, payload: dict, headers: dict, start: float) -> tuple:
+    """调用 /plan/stream，返回 (状态码, 最终响应体, 各事件首次到达的相对时间)"""
+    events = {}
+    async with client.stream("POST", "/plan/stream", json=payload, headers=headers) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return response.status_code, {}, events
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            name = event["event"]
+            if name == "section":
+                name = f"section:{event['section']}"
+            elif name == "draft":
+                name = f"draft:{event['index']}"
+            events.setdefault("first_event", time.monotonic() - start)
+            events.setdefault(name, time.monotonic() - start)
+            if event["event"] == "result":
+                return 200, event["data"], events
+            if event["event"] == "error":
+                return event["status"], {"detail": event["detail"]}, events
+    return 0, {}, events
+
+async def run_one(client: httpx.AsyncClient, entry: dict, args, worker: int) -> dict:
+    payload = {**entry["request"], "bypass_llm_cache": args.bypass_cache}
+    headers = {"X-Client-Id": "bench" if args.single_client else f"bench-{worker}"}
+    start = time.monotonic()
+    record = {"name": entry["name"], "kind": entry["kind"], "worker": worker, "started": round(start - args.t0, 3)}
+    try:
+        if args.endpoint == "stream":
+            status, body, events = await send_stream(client, payload, headers, start)
+        else:
+            status, body, events = await send_plan(client, payload, headers)
+        record["status"] = status
+        if status != 200:
+            record["error"] = str(body.get("detail", ""))[:200]
+        record["stages"] = [
+            {"stage": stage, "duration": timing["duration"], "status": timing["status"]}
+            for stage, timing in stage_timings(body)
+        ]
+        if events:
+            record["events"] = {name: round(offset, 3) for name, offset in events.items()}
+    except Exception as e:
+        record["status"] = 0
+        record["error"] = f"{type(e).__name__}: {e}"[:200]
+    record["latency"] = round(time.monotonic() - start, 3)
+    return record
+
+async def run_benchmark(args) -> dict:
+    corpus = load_corpus(args.corpus, args.kinds)
+    work = [entry for _ in range(args.repeat) for entry in corpus]
+    queue: asyncio.Queue = asyncio.Queue()
+    for entry in work:
+        queue.put_nowait(entry)
+    records = []
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+
+        async def worker(index: int):
+            while not queue.empty():
+                records.append(await run_one(client, queue.get_nowait(), args, index))
+                print(f"[{len(records)}/{len(work)}] {records[-1]['name']} {records[-1]['status']} {records[-1]['latency']}s", flush=True)
+
+        args.t0 = time.monotonic()
+        await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+        elapsed = time.monotonic() - args.t0
+        metrics = await fetch_server_stats(client)
+    return build_report(records, elapsed, args, metrics)
+
+async def fetch_server_stats(client: httpx.AsyncClient) -> Optional[dict]:
+    """基准结束后读取后端 /stats，失败时忽略"""
+    try:
+        response = await client.get("/stats", timeout=10)
+        return response.json() if response.status_code == 200 else None
+    except Exception:
+        return None
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def build_report(records: list, elapsed: float, args, server_stats: Optional[dict]) -> dict:
+    ok = [r for r in records if r["status"] == 200]
+    by_kind = {}
+    for kind in sorted({r["kind"] for r in records}):
+        kind_records = [r for r in records if r["kind"] == kind]
+        by_kind[kind] = {
+            "requests": len(kind_records),
+            "errors": sum(1 for r in kind_records if r["status"] != 200),
+            "latency": summarize([r["latency"] for r in kind_records if r["status"] == 200]),
+        }
+    stage_durations, stage_statuses = {}, {}
+    for record in ok:
+        for item in record["stages"]:
+            stage_durations.setdefault(item["stage"], []).append(item["duration"])
+            stage_statuses.setdefault(item["stage"], Counter())[item["status"]] += 1
+    stages = {
+        stage: {**summarize(durations), "statuses": dict(stage_statuses[stage])}
+        for stage, durations in sorted(stage_durations.items())
+    }
+    event_offsets = {}
+    for record in ok:
+        for name, offset in (record.get("events") or {}).items():
+            event_offsets.setdefault(name, []).append(offset)
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "url": args.url,
+            "endpoint": args.endpoint,
+            "corpus": os.path.basename(args.corpus),
+            "concurrency": args.concurrency,
+            "repeat": args.repeat,
+            "bypass_llm_cache": args.bypass_cache,
+            "run_id": uuid.uuid4().hex[:8],
+        },
+        "overall": {
+            "requests": len(records),
+            "succeeded": len(ok),
+            "errors": len(records) - len(ok),
+            "status_counts": dict(Counter(str(r["status"]) for r in records)),
+            "elapsed": round(elapsed, 3),
+            "throughput_rps": round(len(ok) / elapsed, 4) if elapsed else None,
+            "latency": summarize([r["latency"] for r in ok]),
+        },
+        "by_kind": by_kind,
+        "stages": stages,
+        "events": {name: summarize(offsets) for name, offsets in sorted(event_offsets.items())},
+        "server_stats": server_stats,
+        "requests": records,
+    }
+
+def print_report(report: dict):
+    overall = report["overall"]
+    latency = overall["latency"]
+    print(f"\n请求 {overall['requests']}，成功 {overall['succeeded']}，状态码 {overall['status_counts']}")
+    print(f"耗时 {overall['elapsed']}s，吞吐 {overall['throughput_rps']} 请求/秒")
+    if latency["count"]:
+        print(f"延迟 p50={latency['p50']}s p90={latency['p90']}s p99={latency['p99']}s max={latency['max']}s")
+    for kind, item in report["by_kind"].items():
+        kind_latency = item["latency"]
+        if kind_latency["count"]:
+            print(f"  {kind:<6} n={kind_latency['count']:<4} p50={kind_latency['p50']}s p99={kind_latency['p99']}s 失败={item['errors']}")
+    if report["stages"]:
+        print("各阶段耗时：")
+        for stage, item in report["stages"].items():
+            print(f"  {stage:<14} n={item['count']:<4} p50={item['p50']}s p95={item['p95']}s p99={item['p99']}s {item['statuses']}")
+
+def compare(old_path: str, new_path: str):
+    """对比两次基准结果的整体、分类与各阶段 p50/p99"""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+
+    def row(label, old_summary, new_summary):
+        for q in ("p50", "p99"):
+            before, after = old_summary.get(q), new_summary.get(q)
+            if before is None or after is None:
+                continue
+            change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+            print(f"  {label:<20} {q}: {before:>8}s -> {after:>8}s ({change})")
+
+    print(f"{old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    print(f"  吞吐: {old['overall']['throughput_rps']} -> {new['overall']['throughput_rps']} 请求/秒")
+    row("overall", old["overall"]["latency"], new["overall"]["latency"])
+    for kind in sorted(set(old["by_kind"]) & set(new["by_kind"])):
+        row(kind, old["by_kind"][kind]["latency"], new["by_kind"][kind]["latency"])
+    for stage in sorted(set(old["stages"]) & set(new["stages"])):
+        row(f"stage:{stage}", old["stages"][stage], new["stages"][stage])
+
+def main():
+    parser = argparse.ArgumentParser(description="/plan 负载测试与延迟基准")
+    parser.add_argument("--url", default=os.getenv("BACKEND_URL", "http://localhost:8001"), help="后端地址")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="请求语料（JSONL）")
+    parser.add_argument("--kinds", nargs="*", choices=["draft", "final", "multi"], help="只回放指定类型的请求")
+    parser.add_argument("--endpoint", choices=["plan", "stream"], default="plan",
+                        help="plan 调用 /plan；stream 调用 /plan/stream 并额外记录各事件的到达时间")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发请求数")
+    parser.add_argument("--repeat", type=int, default=1, help="语料回放轮数")
+    parser.add_argument("--timeout", type=float, default=900, help="单个请求超时（秒）")
+    parser.add_argument("--bypass-cache", action="store_true", help="请求时绕过 LLM 响应缓存")
+    parser.add_argument("--single-client", action="store_true",
+                        help="所有 worker 使用同一个 X-Client-Id（默认每个 worker 视为不同客户端），用于测试单客户端限流")
+    parser.add_argument("--output", default="plan_benchmark.json", help="结果 JSON 文件")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="对比两次结果后退出")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    report = asyncio.run(run_benchmark(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_report(report)
+    print(f"\n结果已写入 {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""本地假高德服务，用于离线基准测试和回归测试
+
+按请求路径返回 fixtures 目录下的 JSON（例如 /v3/geocode/geo -> v3/geocode/geo.json），
+可注入固定延迟、随机抖动、HTTP 错误、QPS 超限和超时。把高德 MCP 服务指向它：
+
+    python fake_amap_server.py --port 8900 --latency 0.05 --error-rate 0.01
+    AMAP_BASE_URL=http://localhost:8900/v3 AMAP_ADVANCE_URL=http://localhost:8900/v5 python gaode_mcp_server.py
+
+指定 --record-from https://restapi.amap.com 时，缺少 fixture 的路径会转发到真实接口并保存响应，
+之后的请求直接回放。运行期间可通过 GET/POST /_fake/config 查看或修改注入参数，GET /_fake/stats 查看计数。
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+from collections import Counter
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "fixtures", "amap")
+
+# 注入 QPS 超限时返回的高德错误
+QPS_LIMIT_RESPONSE = {"status": "0", "info": "CUQPS_HAS_EXCEEDED_THE_LIMIT", "infocode": "10020"}
+
+class FakeAmap:
+    """假高德服务的状态：fixture 缓存、注入参数和计数"""
+
+    def __init__(self, fixtures_dir: str, config: dict, record_from: str = "", record_key: str = "", seed: int = 0):
+        self.fixtures_dir = fixtures_dir
+        self.config = config
+        self.record_from = record_from.rstrip("/")
+        self.record_key = record_key
+        self.random = random.Random(seed)
+        self.fixtures: dict[str, dict] = {}
+        self.counters = Counter()
+
+    def fixture_path(self, path: str) -> str:
+        return os.path.join(self.fixtures_dir, *path.strip("/").split("/")) + ".json"
+
+    async def load_fixture(self, path: str, params: dict) -> dict:
+        if path in self.fixtures:
+            return self.fixtures[path]
+        file_path = self.fixture_path(path)
+        if not os.path.exists(file_path):
+            if not self.record_from:
+                return {"status": "0", "info": "FAKE_FIXTURE_NOT_FOUND", "infocode": "20003"}
+            await self.record(path, params, file_path)
+        with open(file_path, encoding="utf-8") as f:
+            self.fixtures[path] = json.load(f)
+        return self.fixtures[path]
+
+    async def record(self, path: str, params: dict, file_path: str):
+        """请求真实接口并把响应保存为 fixture"""
+        params = {**params, "key": self.record_key or params.get("key", "")}
+        async with httpx.AsyncClient(timeout=15) as client:
+            response = await client.get(f"{self.record_from}{path}", params=params)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(response.json(), f, ensure_ascii=False, indent=2)
+        self.counters["recorded"] += 1
+        logger.info(f"已录制 fixture: {path}")
+
+    def delay(self, path: str) -> float:
+        latency = self.config["path_latency"].get(path, self.config["latency"])
+        return max(0.0, latency + self.random.uniform(-self.config["jitter"], self.config["jitter"]))
+
+    async def handle(self, request: Request):
+        path = "/" + request.path_params["path"]
+        params = dict(request.query_params)
+        self.counters["requests"] += 1
+        await asyncio.sleep(self.delay(path))
+        roll = self.random.random()
+        if roll < self.config["timeout_rate"]:
+            self.counters["timeouts"] += 1
+            await asyncio.sleep(self.config["timeout_seconds"])
+        roll -= self.config["timeout_rate"]
+        if 0 <= roll < self.config["error_rate"]:
+            self.counters["errors"] += 1
+            return JSONResponse({"status": "0", "info": "FAKE_INJECTED_ERROR"}, status_code=500)
+        roll -= self.config["error_rate"]
+        if 0 <= roll < self.config["qps_limit_rate"]:
+            self.counters["qps_limited"] += 1
+            return JSONResponse(QPS_LIMIT_RESPONSE)
+        data = await self.load_fixture(path, params)
+        self.counters["ok"] += 1
+        return JSONResponse(expand_batch(path, params, data))
+
+def expand_batch(path: str, params: dict, data: dict) -> dict:
+    """批量地理编码和距离测量按请求中的地址/起点数量复制 fixture 中的第一条结果，与真实接口的返回条数一致"""
+    if path.endswith("/geocode/geo") and params.get("batch") == "true" and data.get("geocodes"):
+        addresses = params.get("address", "").split("|")
+        geocodes = [{**data["geocodes"][0], "formatted_address": address} for address in addresses]
+        return {**data, "count": str(len(geocodes)), "geocodes": geocodes}
+    if path.endswith("/distance") and data.get("results"):
+        origins = params.get("origins", "").split("|")
+        results = [{**data["results"][0], "origin_id": str(i + 1)} for i in range(len(origins))]
+        return {**data, "count": str(len(results)), "results": results}
+    return data
+
+def create_app(fake: FakeAmap) -> Starlette:
+    async def get_config(request: Request):
+        return JSONResponse(fake.config)
+
+    async def update_config(request: Request):
+        updates = await request.json()
+        unknown = [key for key in updates if key not in fake.config]
+        if unknown:
+            return JSONResponse({"error": f"未知的配置项: {unknown}"}, status_code=400)
+        fake.config.update(updates)
+        logger.info(f"注入参数已更新: {updates}")
+        return JSONResponse(fake.config)
+
+    async def stats(request: Request):
+        return JSONResponse(dict(fake.counters))
+
+    return Starlette(routes=[
+        Route("/_fake/config", get_config, methods=["GET"]),
+        Route("/_fake/config", update_config, methods=["POST"]),
+        Route("/_fake/stats", stats, methods=["GET"]),
+        Route("/{path:path}", fake.handle, methods=["GET"]),
+    ])
+
+def main():
+    parser = argparse.ArgumentParser(description="本地假高德服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("FAKE_AMAP_PORT", "8900")))
+    parser.add_argument("--fixtures", default=os.getenv("FAKE_AMAP_FIXTURES", DEFAULT_FIXTURES), help="fixture 目录")
+    parser.add_argument("--latency", type=float, default=0.05, help="每个请求的固定延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的随机抖动范围（秒）")
+    parser.add_argument("--path-latency", default="{}", help='按路径覆盖延迟，JSON，例如 \'{"/v3/direction/driving": 0.3}\'')
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 HTTP 500 的比例")
+    parser.add_argument("--qps-limit-rate", type=float, default=0.0, help="返回 QPS 超限（infocode 10020）的比例")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="挂起 --timeout-seconds 秒后才响应的比例")
+    parser.add_argument("--timeout-seconds", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0, help="随机种子，保证注入结果可复现")
+    parser.add_argument("--record-from", default="", help="缺少 fixture 时转发并录制的真实接口地址")
+    parser.add_argument("--record-key", default=os.getenv("AMAP_KEY", ""), help="录制时使用的高德 key")
+    args = parser.parse_args()
+
+    config = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "path_latency": json.loads(args.path_latency),
+        "error_rate": args.error_rate,
+        "qps_limit_rate": args.qps_limit_rate,
+        "timeout_rate": args.timeout_rate,
+        "timeout_seconds": args.timeout_seconds,
+    }
+    fake = FakeAmap(args.fixtures, config, args.record_from, args.record_key, args.seed)
+    uvicorn.run(create_app(fake), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
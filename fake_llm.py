@@ -0,0 +1,171 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from token_estimate import estimate_tokens
+
+DEFAULT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "fixtures", "fake_llm_script.json")
+
+def message_text(message: BaseMessage) -> str:
+    return message.content if isinstance(message.content, str) else json.dumps(message.content, ensure_ascii=False)
+
+class FakeChatModel(BaseChatModel):
+    """按脚本返回回复和工具调用的假聊天模型，用于离线基准测试和回归测试
+
+    script 为规则列表，按顺序取第一条 match 中所有关键词都出现在系统/用户消息里的规则：
+        {"name": "view", "match": ["门票价格"], "steps": [
+            {"tool_calls": [{"name": "keyword_search", "args": {"keywords": "景点", "types": "110000"}}]},
+            {"content": "景点安排：..."}]}
+    第 n 次调用（最后一条用户消息之后已有 n 条模型回复）返回第 n 个步骤；绑定的工具中没有
+    步骤所需工具时跳过该步骤，步骤用完后返回最后一个文本步骤。没有匹配的规则时返回 default_content。
+    latency 为每次调用的固定延迟，token_latency 为流式输出时每个 token 的间隔；
+    completion_tokens 为空时按回复文本估算 token 用量。
+    """
+
+    script: list = []
+    default_content: str = "（模拟回复）"
+    latency: float = 0.0
+    token_latency: float = 0.0
+    completion_tokens: Optional[int] = None
+    bound_tools: list = []
+
+    @classmethod
+    def from_env(cls) -> "FakeChatModel":
+        """从环境变量创建：FAKE_LLM_SCRIPT、FAKE_LLM_LATENCY、FAKE_LLM_TOKEN_LATENCY、FAKE_LLM_COMPLETION_TOKENS"""
+        with open(os.getenv("FAKE_LLM_SCRIPT", DEFAULT_SCRIPT), encoding="utf-8") as f:
+            script = json.load(f)
+        completion_tokens = os.getenv("FAKE_LLM_COMPLETION_TOKENS")
+        return cls(
+            script=script,
+            latency=float(os.getenv("FAKE_LLM_LATENCY", "0.5")),
+            token_latency=float(os.getenv("FAKE_LLM_TOKEN_LATENCY", "0.01")),
+            completion_tokens=int(completion_tokens) if completion_tokens else None,
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"bound_tools": self.bound_tools}
+
+    def bind_tools(self, tools, **kwargs: Any) -> "FakeChatModel":
+        return self.model_copy(update={"bound_tools": [convert_to_openai_tool(tool)["function"]["name"] for tool in tools]})
+
+    def _select_step(self, messages: list[BaseMessage]) -> dict:
+        prompt = "\n".join(message_text(m) for m in messages if m.type in ("system", "human"))
+        last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1)
+        step_index = sum(1 for m in messages[last_human + 1:] if m.type == "ai")
+        for rule in self.script:
+            if all(keyword in prompt for keyword in rule.get("match", [])):
+                steps = [
+                    step for step in rule["steps"]
+                    if all(call["name"] in self.bound_tools for call in step.get("tool_calls", []))
+                ]
+                if step_index < len(steps):
+                    return steps[step_index]
+                text_steps = [step for step in steps if "content" in step]
+                return text_steps[-1] if text_steps else {"content": self.default_content}
+        return {"content": self.default_content}
+
+    def _build_message(self, messages: list[BaseMessage]) -> AIMessage:
+        step = self._select_step(messages)
+        content = step.get("content", "")
+        tool_calls = [
+            {"name": call["name"], "args": call.get("args", {}), "id": f"call_{len(messages)}_{i}", "type": "tool_call"}
+            for i, call in enumerate(step.get("tool_calls", []))
+        ]
+        input_tokens = sum(estimate_tokens(message_text(m)) for m in messages)
+        output_tokens = self.completion_tokens if self.completion_tokens is not None else (
+            estimate_tokens(content) + 20 * len(tool_calls)
+        )
+        return AIMessage(
+            content=content,
+            tool_calls=tool_calls,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        )
+
+    def _pieces(self, content: str) -> list[str]:
+        """流式输出时的 token 切分：每两个字符一段"""
+        return [content[i:i + 2] for i in range(0, len(content), 2)]
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = self._build_message(messages)
+        time.sleep(self.latency + self.token_latency * len(self._pieces(message.content)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = self._build_message(messages)
+        await asyncio.sleep(self.latency + self.token_latency * len(self._pieces(message.content)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        message = self._build_message(messages)
+        time.sleep(self.latency)
+        for piece in self._pieces(message.content):
+            time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=self._final_chunk(message))
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        message = self._build_message(messages)
+        await asyncio.sleep(self.latency)
+        for piece in self._pieces(message.content):
+            await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=self._final_chunk(message))
+
+    @staticmethod
+    def _final_chunk(message: AIMessage) -> AIMessageChunk:
+        """最后一个分块携带工具调用和 token 用量"""
+        return AIMessageChunk(
+            content="",
+            tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"], ensure_ascii=False), "id": call["id"], "index": i}
+                for i, call in enumerate(message.tool_calls)
+            ],
+            usage_metadata=message.usage_metadata,
+        )
@@ -1,13 +1,618 @@
 # from fastapi import FastAPI, HTTPException
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional
 from mcp.server.fastmcp import FastMCP
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
 import httpx
+import tracing
 
-app = FastMCP('gaode')
+logger = logging.getLogger(__name__)
+tracing.set_service_name("gaode-mcp")
 
 # 高德API配置
 AMAP_KEY = "d9aaf03856e11f50e121a504a55f6efd"
-AMAP_BASE_URL = "https://restapi.amap.com/v3"
-AMAP_ADVANCE_URL = "https://restapi.amap.com/v5"
+# 接口地址可通过环境变量覆盖，例如指向本地的 fake_amap_server.py 做离线测试
+AMAP_BASE_URL = os.getenv("AMAP_BASE_URL", "https://restapi.amap.com/v3")
+AMAP_ADVANCE_URL = os.getenv("AMAP_ADVANCE_URL", "https://restapi.amap.com/v5")
+
+# key 池与限流配置：AMAP_KEYS 格式为 "key1:qps1,key2:qps2"，未写 qps 的 key 使用 AMAP_KEY_QPS
+def parse_qps(value: str) -> Optional[float]:
+    """解析 QPS 配置，不是有限正数时返回 None"""
+    try:
+        qps = float(value)
+    except ValueError:
+        return None
+    return qps if math.isfinite(qps) and qps > 0 else None
+
+AMAP_KEY_QPS = parse_qps(os.getenv("AMAP_KEY_QPS", "3"))
+if AMAP_KEY_QPS is None:
+    logger.error(f"AMAP_KEY_QPS 配置无效: {os.getenv('AMAP_KEY_QPS')!r}，使用默认值 3")
+    AMAP_KEY_QPS = 3.0
+AMAP_KEYS = [item.strip() for item in os.getenv("AMAP_KEYS", AMAP_KEY).split(",") if item.strip()]
+AMAP_RATE_LIMIT_RETRIES = int(os.getenv("AMAP_RATE_LIMIT_RETRIES", "3"))
+
+# 高德返回的超限 infocode：QPS 超限时短暂冷却该 key，日配额用尽时长时间停用该 key
+QPS_LIMIT_INFOCODES = {"10004", "10014", "10019", "10020", "10021"}
+DAILY_LIMIT_INFOCODES = {"10003", "10044"}
+QPS_COOLDOWN = 1.0
+DAILY_COOLDOWN = 3600.0
+
+# 工具优先级，数值越小越先获得配额；交互阶段（天气）优先于批量搜索
+TOOL_PRIORITIES = {
+    "weather_query": 0,
+    "ip_location": 0,
+    "district_query": 1,
+    "geocode": 1,
+    "geocode_batch": 1,
+    "reverse_geocode": 1,
+    "keyword_search": 2,
+    "around_search": 2,
+    "polygon_search": 2,
+    "input_tips": 2,
+}
+DEFAULT_TOOL_PRIORITY = 1
+
+# 连接池配置，可通过环境变量按并发量调整
+AMAP_MAX_CONNECTIONS = int(os.getenv("AMAP_MAX_CONNECTIONS", "100"))
+AMAP_MAX_KEEPALIVE = int(os.getenv("AMAP_MAX_KEEPALIVE", "20"))
+AMAP_KEEPALIVE_EXPIRY = float(os.getenv("AMAP_KEEPALIVE_EXPIRY", "30"))
+AMAP_HTTP2 = os.getenv("AMAP_HTTP2", "0") == "1"
+
+# 各接口超时时间（秒），未列出的接口使用 "default"
+AMAP_TIMEOUTS = {
+    "default": httpx.Timeout(10.0, connect=3.0),
+    "/weather/weatherInfo": httpx.Timeout(5.0, connect=3.0),
+    "/assistant/inputtips": httpx.Timeout(5.0, connect=3.0),
+    "/direction/driving": httpx.Timeout(15.0, connect=3.0),
+    "/direction/transit/integrated": httpx.Timeout(15.0, connect=3.0),
+}
+
+# 响应缓存配置：内存 LRU 层 + 可选的 SQLite 磁盘层（设置 AMAP_CACHE_DB 启用）
+AMAP_CACHE_MAX_ENTRIES = int(os.getenv("AMAP_CACHE_MAX_ENTRIES", "5000"))
+AMAP_CACHE_MAX_BYTES = int(os.getenv("AMAP_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+AMAP_CACHE_DB = os.getenv("AMAP_CACHE_DB", "")
+# 磁盘层最大条目数与清理过期条目的间隔（秒）
+AMAP_CACHE_DB_MAX_ENTRIES = int(os.getenv("AMAP_CACHE_DB_MAX_ENTRIES", "200000"))
+AMAP_CACHE_DB_PURGE_INTERVAL = float(os.getenv("AMAP_CACHE_DB_PURGE_INTERVAL", "60"))
+
+# 各工具的缓存时间（秒），0 表示不缓存
+DAY = 24 * 3600
+CACHE_TTLS = {
+    "geocode": 30 * DAY,
+    "geocode_batch": 30 * DAY,
+    "reverse_geocode": 30 * DAY,
+    "district_query": 30 * DAY,
+    "id_query": 7 * DAY,
+    "ip_location": DAY,
+    "keyword_search": DAY,
+    "around_search": DAY,
+    "polygon_search": DAY,
+    "input_tips": DAY,
+    "walking_direction": DAY,
+    "bicycling_direction": DAY,
+    "electrobike_direction": DAY,
+    "transit_direction": 3600,
+    "driving_direction": 600,
+    "distance_matrix": 600,
+    "weather_query": 600,
+    "traffic_event_query": 120,
+}
+
+# 不参与缓存键计算的参数（密钥和每次请求都会变化的签名字段）
+CACHE_IGNORED_PARAMS = {"key", "sig", "timestamp", "digest"}
+
+# 共享 HTTP 客户端及其使用统计
+_http_client: Optional[httpx.AsyncClient] = None
+_pool_counters = {"requests": 0, "errors": 0, "in_flight": 0, "peak_in_flight": 0}
+
+# 在途请求表：相同缓存键的并发请求共享同一个上游任务
+_inflight: "dict[str, asyncio.Task]" = {}
+_singleflight_counters = {"leaders": 0, "coalesced": 0}
+
+# Prometheus 指标，由 /metrics 暴露
+AMAP_UPSTREAM_DURATION = Histogram(
+    "amap_upstream_duration_seconds", "高德上游请求耗时，outcome 为 ok/api_error/rate_limited/error",
+    ["path", "outcome"], buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+AMAP_TOOL_REQUESTS = Counter(
+    "amap_tool_requests_total", "工具发起的高德请求，source 为 cache/coalesced/upstream", ["tool", "source"]
+)
+AMAP_KEY_WAIT = Histogram(
+    "amap_key_wait_seconds", "等待调度器分配高德 key 的时间", buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+)
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享的 HTTP 客户端，首次调用时创建"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        http2 = AMAP_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("未安装 h2，回退到 HTTP/1.1")
+                http2 = False
+        _http_client = httpx.AsyncClient(
+            http2=http2,
+            timeout=AMAP_TIMEOUTS["default"],
+            limits=httpx.Limits(
+                max_connections=AMAP_MAX_CONNECTIONS,
+                max_keepalive_connections=AMAP_MAX_KEEPALIVE,
+                keepalive_expiry=AMAP_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _http_client
+
+@asynccontextmanager
+async def http_client_lifespan(starlette_app):
+    """在服务进程的生命周期内创建并关闭共享 HTTP 客户端"""
+    global _http_client
+    get_http_client()
+    try:
+        yield
+    finally:
+        if _http_client is not None:
+            await _http_client.aclose()
+            _http_client = None
+
+app = FastMCP('gaode')
+
+def create_sse_app():
+    """创建挂载共享客户端生命周期的 SSE 应用
+
+    /stats 和 /metrics 直接加到 Starlette 路由上，而不是用 FastMCP.custom_route
+    （mcp>=1.7 才有，langchain-mcp-adapters 0.0.x 要求 mcp<1.7）。
+    """
+    sse_app = app.sse_app()
+    sse_app.router.lifespan_context = http_client_lifespan
+    sse_app.router.routes.extend([
+        Route("/stats", stats_endpoint, methods=["GET"]),
+        Route("/metrics", metrics_endpoint, methods=["GET"]),
+    ])
+    return sse_app
+
+class AmapResponseCache:
+    """高德接口响应缓存
+
+    内存层为按条目数和字节数限制的 LRU，磁盘层为可选的 SQLite 表，
+    内存未命中时回查磁盘并回填内存。磁盘层在线程中访问，共用一个连接，由锁串行化；
+    写入时定期清理过期条目并限制条目数。磁盘层出错只记录日志，不影响工具调用。
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int,
+        db_path: str = "",
+        db_max_entries: int = AMAP_CACHE_DB_MAX_ENTRIES,
+        db_purge_interval: float = AMAP_CACHE_DB_PURGE_INTERVAL,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self.db_max_entries = db_max_entries
+        self.db_purge_interval = db_purge_interval
+        self._memory: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._db_purged = time.monotonic()
+        self.counters = {
+            "memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "writes": 0,
+            "disk_evictions": 0, "disk_errors": 0,
+        }
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS amap_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS amap_cache_expires ON amap_cache (expires)")
+            self._db.execute("DELETE FROM amap_cache WHERE expires < ?", (time.time(),))
+            self._db.commit()
+
+    @staticmethod
+    def make_key(path: str, params: dict) -> str:
+        """根据接口路径和规范化后的参数生成缓存键"""
+        normalized = sorted(
+            (k, str(v).strip()) for k, v in params.items() if k not in CACHE_IGNORED_PARAMS
+        )
+        raw = json.dumps([path, normalized], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > now:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return json.loads(value)
+            self._drop(key)
+        if self._db is not None:
+            try:
+                row = await asyncio.to_thread(self._db_get, key)
+            except sqlite3.Error as e:
+                self.counters["disk_errors"] += 1
+                logger.warning(f"高德缓存磁盘层读取失败: {e}")
+                row = None
+            if row is not None and row[1] > now:
+                self.counters["disk_hits"] += 1
+                self._put_memory(key, row[0], row[1])
+                return json.loads(row[0])
+        self.counters["misses"] += 1
+        return None
+
+    async def set(self, key: str, data: dict, ttl: float):
+        value = json.dumps(data, ensure_ascii=False)
+        expires = time.time() + ttl
+        self._put_memory(key, value, expires)
+        self.counters["writes"] += 1
+        if self._db is not None:
+            try:
+                await asyncio.to_thread(self._db_set, key, value, expires)
+            except sqlite3.Error as e:
+                self.counters["disk_errors"] += 1
+                logger.warning(f"高德缓存磁盘层写入失败: {e}")
+
+    def _put_memory(self, key: str, value: str, expires: float):
+        if key in self._memory:
+            self._drop(key)
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        self._memory[key] = (expires, value)
+        self._memory_bytes += size
+        while len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes:
+            oldest = next(iter(self._memory))
+            self._drop(oldest)
+            self.counters["evictions"] += 1
+
+    def _drop(self, key: str):
+        _, value = self._memory.pop(key)
+        self._memory_bytes -= len(value.encode("utf-8"))
+
+    def _db_get(self, key: str):
+        with self._db_lock:
+            return self._db.execute("SELECT value, expires FROM amap_cache WHERE key = ?", (key,)).fetchone()
+
+    def _db_set(self, key: str, value: str, expires: float):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO amap_cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, value, expires),
+            )
+            if time.monotonic() - self._db_purged >= self.db_purge_interval:
+                self._db_purge()
+            self._db.commit()
+
+    def _db_purge(self):
+        """删除过期条目，超过条目数上限时先淘汰最早过期的条目；调用方需持有锁"""
+        self._db_purged = time.monotonic()
+        self._db.execute("DELETE FROM amap_cache WHERE expires < ?", (time.time(),))
+        count = self._db.execute("SELECT COUNT(*) FROM amap_cache").fetchone()[0]
+        if count > self.db_max_entries:
+            evicted = count - self.db_max_entries
+            self._db.execute(
+                "DELETE FROM amap_cache WHERE key IN (SELECT key FROM amap_cache ORDER BY expires LIMIT ?)",
+                (evicted,),
+            )
+            self.counters["disk_evictions"] += evicted
+
+    def stats(self) -> dict:
+        lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        return {
+            **self.counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._memory),
+            "bytes": self._memory_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "disk_enabled": self._db is not None,
+        }
+
+response_cache = AmapResponseCache(AMAP_CACHE_MAX_ENTRIES, AMAP_CACHE_MAX_BYTES, AMAP_CACHE_DB)
+
+def is_success(data: dict) -> bool:
+    """判断高德接口返回是否成功（不同接口的状态字段不一致）"""
+    return data.get("status") == "1" or data.get("errcode") == 0 or data.get("code") == 1
+
+class KeyBucket:
+    """单个高德 key 的令牌桶"""
+
+    def __init__(self, key: str, qps: float):
+        self.key = key
+        self.qps = qps
+        self.capacity = max(qps, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.granted = 0
+        self.throttled = 0
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.qps)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """距离该 key 可发出下一个请求的秒数"""
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        return max(0.0, (1 - self.tokens) / self.qps)
+
+class AmapQuotaExhausted(Exception):
+    """所有 key 都因日配额用尽被停用"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"高德 key 日配额已用尽，约 {math.ceil(retry_after / 60)} 分钟后恢复")
+        self.retry_after = retry_after
+
+class AmapKeyScheduler:
+    """高德请求调度器
+
+    所有上游请求先排队申请配额，调度器按优先级依次分配给当前有令牌的 key，
+    暂时没有令牌时等待而不是直接失败；所有 key 都被日配额停用时立即抛出 AmapQuotaExhausted，
+    不让请求排队等上一个小时。
+    """
+
+    def __init__(self, keys: list[str], default_qps: float):
+        self.buckets = []
+        for item in keys:
+            key, _, qps_text = item.partition(":")
+            qps = parse_qps(qps_text) if qps_text else default_qps
+            if not key or qps is None:
+                # qps 为 0 或无效时令牌永远不会补充，计算等待时间会除以 0，跳过该 key
+                logger.error(f"高德 key 配置无效，已跳过: {key[:4]}***:{qps_text}")
+                continue
+            self.buckets.append(KeyBucket(key, qps))
+        if not self.buckets:
+            raise ValueError("没有可用的高德 key，请检查 AMAP_KEYS 和 AMAP_KEY_QPS 配置")
+        self._waiters: list = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    async def acquire(self, priority: int = DEFAULT_TOOL_PRIORITY) -> str:
+        """排队申请一个请求配额，返回应使用的 key；所有 key 都被日配额停用时抛出 AmapQuotaExhausted"""
+        if not self.has_available_key():
+            raise AmapQuotaExhausted(self.recovery_time())
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._ensure_dispatcher()
+        self._wakeup.set()
+        return await future
+
+    def penalize(self, key: str, cooldown: float):
+        """上游返回超限时暂停该 key 一段时间"""
+        for bucket in self.buckets:
+            if bucket.key == key:
+                bucket.tokens = 0
+                bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + cooldown)
+                bucket.throttled += 1
+
+    def has_available_key(self) -> bool:
+        """是否还有未被日配额停用的 key"""
+        now = time.monotonic()
+        return any(bucket.blocked_until - now <= QPS_COOLDOWN for bucket in self.buckets)
+
+    def recovery_time(self) -> float:
+        """最早恢复可用的 key 还需等待的秒数"""
+        now = time.monotonic()
+        return max(0.0, min(bucket.blocked_until for bucket in self.buckets) - now)
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    async def _dispatch(self):
+        while True:
+            while self._waiters and self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            for bucket in self.buckets:
+                bucket.refill(now)
+            if not self.has_available_key():
+                # 排队期间所有 key 都被日配额停用，已排队的请求一并失败
+                error = AmapQuotaExhausted(self.recovery_time())
+                while self._waiters:
+                    _, _, future = heapq.heappop(self._waiters)
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            ready = [b for b in self.buckets if b.blocked_until <= now and b.tokens >= 1]
+            if ready:
+                bucket = max(ready, key=lambda b: b.tokens)
+                bucket.tokens -= 1
+                bucket.granted += 1
+                _, _, future = heapq.heappop(self._waiters)
+                future.set_result(bucket.key)
+                continue
+            delay = min(bucket.wait_time(now) for bucket in self.buckets)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "queued": sum(1 for _, _, future in self._waiters if not future.done()),
+            "keys": [
+                {
+                    "key": f"{bucket.key[:4]}***",
+                    "qps": bucket.qps,
+                    "tokens": round(bucket.tokens, 2),
+                    "blocked_for": round(max(0.0, bucket.blocked_until - now), 2),
+                    "granted": bucket.granted,
+                    "throttled": bucket.throttled,
+                }
+                for bucket in self.buckets
+            ],
+        }
+
+key_scheduler = AmapKeyScheduler(AMAP_KEYS, AMAP_KEY_QPS)
+
+async def amap_get(path: str, params: dict, base_url: str = AMAP_BASE_URL, tool: str = "") -> dict:
+    """请求高德接口
+
+    优先读取缓存；未命中时，相同的并发请求共享同一次上游调用（single-flight），
+    成功的响应按工具对应的 TTL 写入缓存。
+    """
+    with tracing.span(f"amap_get {tool}", incoming_trace_parent(), kind="server", tool=tool, path=path) as span_attributes:
+        ttl = CACHE_TTLS.get(tool, 0)
+        priority = TOOL_PRIORITIES.get(tool, DEFAULT_TOOL_PRIORITY)
+        key = response_cache.make_key(f"{base_url}{path}", params)
+        if ttl:
+            cached = await response_cache.get(key)
+            if cached is not None:
+                AMAP_TOOL_REQUESTS.labels(tool, "cache").inc()
+                span_attributes["source"] = "cache"
+                return cached
+        task = _inflight.get(key)
+        if task is None:
+            AMAP_TOOL_REQUESTS.labels(tool, "upstream").inc()
+            span_attributes["source"] = "upstream"
+            task = asyncio.ensure_future(_load(key, path, params, base_url, ttl, priority))
+            _inflight[key] = task
+            task.add_done_callback(lambda t: _finish_inflight(key, t))
+        else:
+            AMAP_TOOL_REQUESTS.labels(tool, "coalesced").inc()
+            span_attributes["source"] = "coalesced"
+            _singleflight_counters["coalesced"] += 1
+        # shield 保证某个调用方被取消时，共享的上游请求仍为其他调用方继续执行
+        return await asyncio.shield(task)
+
+def incoming_trace_parent() -> Optional[tracing.SpanContext]:
+    """当前已在某个 span 中时返回 None（沿用当前 span）；否则读取 MCP 请求 _meta 中的 traceparent"""
+    if tracing.current_span.get() is not None:
+        return None
+    try:
+        meta = app.get_context().request_context.meta
+    except (LookupError, ValueError):
+        return None
+    return tracing.parse_traceparent(getattr(meta, "traceparent", None)) if meta else None
+
+async def _load(key: str, path: str, params: dict, base_url: str, ttl: float, priority: int) -> dict:
+    """执行一次上游请求并写入缓存，由 single-flight 的所有调用方共享"""
+    _singleflight_counters["leaders"] += 1
+    data = await _fetch(path, params, base_url, priority)
+    if ttl and is_success(data):
+        await response_cache.set(key, data, ttl)
+    return data
+
+def _finish_inflight(key: str, task: asyncio.Task):
+    """请求完成后移出在途表；若所有调用方都已取消，读取异常以免产生未处理告警"""
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug(f"高德请求失败: {task.exception()!r}")
+
+async def _fetch(path: str, params: dict, base_url: str, priority: int = DEFAULT_TOOL_PRIORITY) -> dict:
+    """经调度器取得 key 后请求高德接口；遇到超限时冷却该 key 并换 key 重试"""
+    for attempt in range(AMAP_RATE_LIMIT_RETRIES + 1):
+        wait_start = time.monotonic()
+        with tracing.span("amap key wait", priority=priority):
+            amap_key = await key_scheduler.acquire(priority)
+        AMAP_KEY_WAIT.observe(time.monotonic() - wait_start)
+        data = await _request(path, {"key": amap_key, **params}, base_url)
+        infocode = str(data.get("infocode", ""))
+        if infocode in QPS_LIMIT_INFOCODES:
+            key_scheduler.penalize(amap_key, QPS_COOLDOWN)
+        elif infocode in DAILY_LIMIT_INFOCODES:
+            key_scheduler.penalize(amap_key, DAILY_COOLDOWN)
+            if not key_scheduler.has_available_key():
+                return data
+        else:
+            return data
+        logger.warning(f"高德 key 超限 ({infocode})，第 {attempt + 1} 次重新排队")
+    return data
+
+async def _request(path: str, params: dict, base_url: str) -> dict:
+    """通过共享客户端请求高德接口，并按接口选择超时"""
+    client = get_http_client()
+    timeout = AMAP_TIMEOUTS.get(path, AMAP_TIMEOUTS["default"])
+    _pool_counters["requests"] += 1
+    _pool_counters["in_flight"] += 1
+    _pool_counters["peak_in_flight"] = max(_pool_counters["peak_in_flight"], _pool_counters["in_flight"])
+    start = time.monotonic()
+    outcome = "error"
+    with tracing.span(f"GET {path}", kind="client", path=path) as span_attributes:
+        try:
+            response = await client.get(
+                f"{base_url}{path}",
+                params=params,
+                timeout=timeout,
+            )
+            data = response.json()
+            if is_success(data):
+                outcome = "ok"
+            elif str(data.get("infocode", "")) in QPS_LIMIT_INFOCODES | DAILY_LIMIT_INFOCODES:
+                outcome = "rate_limited"
+            else:
+                outcome = "api_error"
+            span_attributes["infocode"] = data.get("infocode")
+            return data
+        except Exception:
+            _pool_counters["errors"] += 1
+            raise
+        finally:
+            _pool_counters["in_flight"] -= 1
+            span_attributes["outcome"] = outcome
+            AMAP_UPSTREAM_DURATION.labels(path, outcome).observe(time.monotonic() - start)
+
+def pool_stats() -> dict:
+    """返回连接池统计信息，用于根据并发量调整连接池大小"""
+    stats = {
+        "max_connections": AMAP_MAX_CONNECTIONS,
+        "max_keepalive_connections": AMAP_MAX_KEEPALIVE,
+        "keepalive_expiry": AMAP_KEEPALIVE_EXPIRY,
+        "http2": AMAP_HTTP2,
+        **_pool_counters,
+        "connections": 0,
+        "idle_connections": 0,
+    }
+    # httpx 未公开连接池状态，这里尽力从底层 httpcore 连接池读取
+    pool = getattr(getattr(_http_client, "_transport", None), "_pool", None)
+    for connection in getattr(pool, "connections", []):
+        stats["connections"] += 1
+        if connection.is_idle():
+            stats["idle_connections"] += 1
+    return stats
+
+async def stats_endpoint(request: Request) -> JSONResponse:
+    """HTTP 统计接口"""
+    return JSONResponse({
+        "pool": pool_stats(),
+        "cache": response_cache.stats(),
+        "singleflight": {**_singleflight_counters, "in_flight": len(_inflight)},
+        "scheduler": key_scheduler.stats(),
+    })
+
+async def metrics_endpoint(request: Request) -> Response:
+    """Prometheus 指标"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.tool()
 async def geocode(address: str, city: str = "") -> dict:
@@ -21,21 +626,72 @@ async def geocode(address: str, city: str = "") -> dict:
     Returns:
         地理编码结果，包括经纬度和其他详细信息
     """
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{AMAP_BASE_URL}/geocode/geo",
-            params={
-                "key": AMAP_KEY,
-                "address": address,
-                "city": city,
-                "output": "json"
-            }
-        )
-        data = response.json()
-        if data["status"] == "1":
-            return data["geocodes"][0]
-        else:
-            raise Exception(f"Geocode failed: {data['info']}")
+    data = await amap_get(
+        "/geocode/geo",
+        {
+            "address": address,
+            "city": city,
+            "output": "json"
+        },
+        tool="geocode",
+    )
+    if data["status"] == "1":
+        return data["geocodes"][0]
+    else:
+        raise Exception(f"Geocode failed: {data['info']}")
+
+# 高德地理编码批量模式单次最多支持的地址数
+GEOCODE_BATCH_SIZE = 10
+
+@app.tool()
+async def geocode_batch(addresses: list[str], city: str = "") -> list:
+    """
+    批量地理编码API
+
+    Args:
+        addresses: 结构化地址列表 (例如 ["故宫", "天坛公园", "北京南站"])
+        city: 指定查询的城市 (例如 "北京")
+
+    Returns:
+        与输入顺序一致的结果列表，每项包含 address 以及 geocode（成功）或 error（失败）
+    """
+    async def geocode_chunk(chunk: list[str]) -> list:
+        try:
+            data = await amap_get(
+                "/geocode/geo",
+                {
+                    "address": "|".join(chunk),
+                    "city": city,
+                    "batch": "true",
+                    "output": "json"
+                },
+                tool="geocode_batch",
+            )
+        except Exception as e:
+            return [{"address": address, "error": f"Geocode failed: {str(e)}"} for address in chunk]
+        if data["status"] != "1":
+            return [{"address": address, "error": f"Geocode failed: {data['info']}"} for address in chunk]
+        geocodes = data.get("geocodes", [])
+        results = []
+        for i, address in enumerate(chunk):
+            geocode_result = geocodes[i] if i < len(geocodes) else None
+            # 批量模式下未匹配的地址会返回空字段而不是报错
+            if not geocode_result or not geocode_result.get("location"):
+                results.append({"address": address, "error": "Geocode failed: no match"})
+            else:
+                results.append({"address": address, "geocode": geocode_result})
+        return results
+
+    # 地址中的 "|" 是批量分隔符，需要去除
+    cleaned = [address.replace("|", " ").strip() for address in addresses]
+    valid = [address for address in cleaned if address]
+    chunks = [valid[i:i + GEOCODE_BATCH_SIZE] for i in range(0, len(valid), GEOCODE_BATCH_SIZE)]
+    chunk_results = await asyncio.gather(*(geocode_chunk(chunk) for chunk in chunks))
+    resolved = iter(item for chunk in chunk_results for item in chunk)
+    return [
+        {**next(resolved), "address": original} if address else {"address": original, "error": "Geocode failed: empty address"}
+        for original, address in zip(addresses, cleaned)
+    ]
 
 @app.tool()
 async def reverse_geocode(location: str, output: str = "json") -> dict:
@@ -49,20 +705,18 @@ async def reverse_geocode(location: str, output: str = "json") -> dict:
     Returns:
         逆地理编码结果，包括详细地址和其他信息
     """
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{AMAP_BASE_URL}/geocode/regeo",
-            params={
-                "key": AMAP_KEY,
-                "location": location,
-                "output": output
-            }
-        )
-        data = response.json()
-        if data["status"] == "1":
-            return data["regeocode"]
-        else:
-            raise Exception(f"Reverse geocode failed: {data['info']}")
+    data = await amap_get(
+        "/geocode/regeo",
+        {
+            "location": location,
+            "output": output
+        },
+        tool="reverse_geocode",
+    )
+    if data["status"] == "1":
+        return data["regeocode"]
+    else:
+        raise Exception(f"Reverse geocode failed: {data['info']}")
 
 @app.tool()
 async def walking_direction(origin: str, destination: str, output: str = "json") -> dict:
@@ -77,21 +731,19 @@ async def walking_direction(origin: str, destination: str, output: str = "json")
     Returns:
         步行路径规划结果，包括距离、时长和详细步骤
     """
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{AMAP_BASE_URL}/direction/walking",
-            params={
-                "key": AMAP_KEY,
-                "origin": origin,
-                "destination": destination,
-                "output": output
-            }
-        )
-        data = response.json()
-        if data["status"] == "1":
-            return data["route"]
-        else:
-            raise Exception(f"Walking direction failed: {data['info']}")
+    data = await amap_get(
+        "/direction/walking",
+        {
+            "origin": origin,
+            "destination": destination,
+            "output": output
+        },
+        tool="walking_direction",
+    )
+    if data["status"] == "1":
+        return data["route"]
+    else:
+        raise Exception(f"Walking direction failed: {data['info']}")
 
 @app.tool()
 async def transit_direction(origin: str, destination: str, city: str, extensions: str = "base", strategy: str = "0", nightflag: str = "0", date: str = "", time: str = "", output: str = "json") -> dict:
@@ -112,31 +764,91 @@ async def transit_direction(origin: str, destination: str, city: str, extensions
     Returns:
         公交路径规划结果，包括换乘方案、距离、时长和详细步骤
     """
-    async with httpx.AsyncClient() as client:
-        params = {
-            "key": AMAP_KEY,
-            "origin": origin,
-            "destination": destination,
-            "city": city,
-            "extensions": extensions,
-            "strategy": strategy,
-            "nightflag": nightflag,
-            "output": output
-        }
-        if date:
-            params["date"] = date
-        if time:
-            params["time"] = time
-
-        response = await client.get(
-            f"{AMAP_BASE_URL}/direction/transit/integrated",
-            params=params
-        )
-        data = response.json()
-        if data["status"] == "1":
-            return data["route"]
-        else:
-            raise Exception(f"Transit direction failed: {data['info']}")
+    params = {
+        "origin": origin,
+        "destination": destination,
+        "city": city,
+        "extensions": extensions,
+        "strategy": strategy,
+        "nightflag": nightflag,
+        "output": output
+    }
+    if date:
+        params["date"] = date
+    if time:
+        params["time"] = time
+
+    data = await amap_get("/direction/transit/integrated", params, tool="transit_direction")
+    if data["status"] == "1":
+        return data["route"]
+    else:
+        raise Exception(f"Transit direction failed: {data['info']}")
+
+# 距离测量接口单次最多支持的起点数，以及出行方式对应的 type 参数
+DISTANCE_MAX_ORIGINS = 100
+DISTANCE_TYPES = {"straight": "0", "driving": "1", "walking": "3"}
+
+@app.tool()
+async def distance_matrix(origins: list[str], destinations: list[str], mode: str = "driving") -> dict:
+    """
+    距离矩阵API，一次性计算多个起点到多个终点的距离和时长
+
+    Args:
+        origins: 起点经纬度列表 (例如 ["116.481028,39.989643", "116.434446,39.90816"])
+        destinations: 终点经纬度列表 (例如 ["116.397477,39.908692"])
+        mode: 出行方式 ("driving" 驾车；"walking" 步行，仅支持5公里以内；"straight" 直线距离，默认 "driving")
+
+    Returns:
+        距离矩阵结果，distances[i][j] 为第 i 个起点到第 j 个终点的距离（米），
+        durations[i][j] 为对应时长（秒），无法计算时为 null；
+        errors 列出请求失败的批次（终点与对应的起点），这些单元格为 null
+    """
+    if mode not in DISTANCE_TYPES:
+        raise Exception(f"Distance matrix failed: unsupported mode {mode}, use one of {list(DISTANCE_TYPES)}")
+    distances = [[None] * len(destinations) for _ in origins]
+    durations = [[None] * len(destinations) for _ in origins]
+    errors = []
+
+    async def measure(destination_index: int, start: int):
+        chunk = origins[start:start + DISTANCE_MAX_ORIGINS]
+        try:
+            data = await amap_get(
+                "/distance",
+                {
+                    "origins": "|".join(chunk),
+                    "destination": destinations[destination_index],
+                    "type": DISTANCE_TYPES[mode],
+                    "output": "json"
+                },
+                tool="distance_matrix",
+            )
+        except Exception as e:
+            errors.append({"destination": destinations[destination_index], "origins": chunk, "error": f"Distance matrix failed: {str(e)}"})
+            return
+        if data["status"] != "1":
+            errors.append({"destination": destinations[destination_index], "origins": chunk, "error": f"Distance matrix failed: {data['info']}"})
+            return
+        for result in data.get("results", []):
+            # origin_id 从 1 开始，对应本批次内的起点序号
+            if "code" in result:
+                continue
+            i = start + int(result["origin_id"]) - 1
+            distances[i][destination_index] = int(result["distance"]) if result.get("distance") else None
+            durations[i][destination_index] = int(result["duration"]) if result.get("duration") else None
+
+    await asyncio.gather(*(
+        measure(j, start)
+        for j in range(len(destinations))
+        for start in range(0, len(origins), DISTANCE_MAX_ORIGINS)
+    ))
+    return {
+        "mode": mode,
+        "origins": origins,
+        "destinations": destinations,
+        "distances": distances,
+        "durations": durations,
+        "errors": errors,
+    }
 
 @app.tool()
 async def bicycling_direction(origin: str, destination: str, output: str = "json") -> dict:
@@ -151,21 +863,19 @@ async def bicycling_direction(origin: str, destination: str, output: str = "json
     Returns:
         骑行路径规划结果，包括距离、时长和详细步骤
     """
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{AMAP_BASE_URL}/direction/bicycling",
-            params={
-                "key": AMAP_KEY,
-                "origin": origin,
-                "destination": destination,
-                "output": output
-            }
-        )
-        data = response.json()
-        if data["errcode"] == 0:
-            return data["data"]
-        else:
-            raise Exception(f"Bicycling direction failed: {data['errmsg']}")
+    data = await amap_get(
+        "/direction/bicycling",
+        {
+            "origin": origin,
+            "destination": destination,
+            "output": output
+        },
+        tool="bicycling_direction",
+    )
+    if data["errcode"] == 0:
+        return data["data"]
+    else:
+        raise Exception(f"Bicycling direction failed: {data['errmsg']}")
 
 @app.tool()
 async def electrobike_direction(origin: str, destination: str, show_fields: str = "", output: str = "json") -> dict:
@@ -181,25 +891,19 @@ async def electrobike_direction(origin: str, destination: str, show_fields: str
     Returns:
         电动车路径规划结果，包括距离、时长和详细步骤
     """
-    async with httpx.AsyncClient() as client:
-        params = {
-            "key": AMAP_KEY,
-            "origin": origin,
-            "destination": destination,
-            "output": output
-        }
-        if show_fields:
-            params["show_fields"] = show_fields
+    params = {
+        "origin": origin,
+        "destination": destination,
+        "output": output
+    }
+    if show_fields:
+        params["show_fields"] = show_fields
 
-        response = await client.get(
-            f"{AMAP_BASE_URL}/direction/electrobike",
-            params=params
-        )
-        data = response.json()
-        if data["status"] == "1":
-            return data["route"]
-        else:
-            raise Exception(f"Electrobike direction failed: {data['info']}")
+    data = await amap_get("/direction/electrobike", params, tool="electrobike_direction")
+    if data["status"] == "1":
+        return data["route"]
+    else:
+        raise Exception(f"Electrobike direction failed: {data['info']}")
 
 @app.tool()
 async def driving_direction(origin: str, destination: str, extensions: str = "base", strategy: str = "", waypoints: str = "", avoidpolygons: str = "", avoidroad: str = "", output: str = "json") -> dict:
@@ -219,32 +923,26 @@ async def driving_direction(origin: str, destination: str, extensions: str = "ba
     Returns:
         驾车路径规划结果，包括距离、时长和详细步骤
     """
-    async with httpx.AsyncClient() as client:
-        params = {
-            "key": AMAP_KEY,
-            "origin": origin,
-            "destination": destination,
-            "extensions": extensions,
-            "output": output
-        }
-        if strategy:
-            params["strategy"] = strategy
-        if waypoints:
-            params["waypoints"] = waypoints
-        if avoidpolygons:
-            params["avoidpolygons"] = avoidpolygons
-        if avoidroad:
-            params["avoidroad"] = avoidroad
-
-        response = await client.get(
-            f"{AMAP_BASE_URL}/direction/driving",
-            params=params
-        )
-        data = response.json()
-        if data["status"] == "1":
-            return data["route"]
-        else:
-            raise Exception(f"Driving direction failed: {data['info']}")
+    params = {
+        "origin": origin,
+        "destination": destination,
+        "extensions": extensions,
+        "output": output
+    }
+    if strategy:
+        params["strategy"] = strategy
+    if waypoints:
+        params["waypoints"] = waypoints
+    if avoidpolygons:
+        params["avoidpolygons"] = avoidpolygons
+    if avoidroad:
+        params["avoidroad"] = avoidroad
+
+    data = await amap_get("/direction/driving", params, tool="driving_direction")
+    if data["status"] == "1":
+        return data["route"]
+    else:
+        raise Exception(f"Driving direction failed: {data['info']}")
 
 @app.tool()
 async def district_query(keywords: str, subdistrict: str = "0", page: str = "1", offset: str = "", extensions: str = "base", filter: str = "", output: str = "json") -> dict:
@@ -263,29 +961,23 @@ async def district_query(keywords: str, subdistrict: str = "0", page: str = "1",
     Returns:
         行政区域查询结果，包括行政区列表和详细信息
     """
-    async with httpx.AsyncClient() as client:
-        params = {
-            "key": AMAP_KEY,
-            "keywords": keywords,
-            "subdistrict": subdistrict,
-            "page": page,
-            "extensions": extensions,
-            "output": output
-        }
-        if offset:
-            params["offset"] = offset
-        if filter:
-            params["filter"] = filter
-
-        response = await client.get(
-            f"{AMAP_BASE_URL}/config/district",
-            params=params
-        )
-        data = response.json()
-        if data["status"] == "1":
-            return data["districts"]
-        else:
-            raise Exception(f"District query failed: {data['info']}")
+    params = {
+        "keywords": keywords,
+        "subdistrict": subdistrict,
+        "page": page,
+        "extensions": extensions,
+        "output": output
+    }
+    if offset:
+        params["offset"] = offset
+    if filter:
+        params["filter"] = filter
+
+    data = await amap_get("/config/district", params, tool="district_query")
+    if data["status"] == "1":
+        return data["districts"]
+    else:
+        raise Exception(f"District query failed: {data['info']}")
 
 @app.tool()
 async def keyword_search(keywords: str, types: str, city: str = "", citylimit: str = "false", children: str = "0", offset: str = "20", page: str = "1", extensions: str = "base", output: str = "json") -> dict:
@@ -306,32 +998,26 @@ async def keyword_search(keywords: str, types: str, city: str = "", citylimit: s
     Returns:
         关键字搜索结果，包括POI信息列表
     """
-    async with httpx.AsyncClient() as client:
-        params = {
-            "key": AMAP_KEY,
-            "keywords": keywords,
-            "types": types,
-            "offset": offset,
-            "page": page,
-            "extensions": extensions,
-            "output": output
-        }
-        if city:
-            params["city"] = city
-        if citylimit:
-            params["citylimit"] = citylimit
-        if children:
-            params["children"] = children
-
-        response = await client.get(
-            f"{AMAP_BASE_URL}/place/text",
-            params=params
-        )
-        data = response.json()
-        if data["status"] == "1":
-            return data["pois"]
-        else:
-            raise Exception(f"Keyword search failed: {data['info']}")
+    params = {
+        "keywords": keywords,
+        "types": types,
+        "offset": offset,
+        "page": page,
+        "extensions": extensions,
+        "output": output
+    }
+    if city:
+        params["city"] = city
+    if citylimit:
+        params["citylimit"] = citylimit
+    if children:
+        params["children"] = children
+
+    data = await amap_get("/place/text", params, tool="keyword_search")
+    if data["status"] == "1":
+        return data["pois"]
+    else:
+        raise Exception(f"Keyword search failed: {data['info']}")
 
 @app.tool()
 async def around_search(location: str, types: str, keywords: str = "", radius: str = "1000", sortrule: str = "distance", offset: str = "20", page: str = "1", extensions: str = "base", output: str = "json") -> dict:
@@ -352,30 +1038,24 @@ async def around_search(location: str, types: str, keywords: str = "", radius: s
     Returns:
         周边搜索结果，包括POI信息列表
     """
-    async with httpx.AsyncClient() as client:
-        params = {
-            "key": AMAP_KEY,
-            "location": location,
-            "types": types,
-            "radius": radius,
-            "sortrule": sortrule,
-            "offset": offset,
-            "page": page,
-            "extensions": extensions,
-            "output": output
-        }
-        if keywords:
-            params["keywords"] = keywords
+    params = {
+        "location": location,
+        "types": types,
+        "radius": radius,
+        "sortrule": sortrule,
+        "offset": offset,
+        "page": page,
+        "extensions": extensions,
+        "output": output
+    }
+    if keywords:
+        params["keywords"] = keywords
 
-        response = await client.get(
-            f"{AMAP_BASE_URL}/place/around",
-            params=params
-        )
-        data = response.json()
-        if data["status"] == "1":
-            return data["pois"]
-        else:
-            raise Exception(f"Around search failed: {data['info']}")
+    data = await amap_get("/place/around", params, tool="around_search")
+    if data["status"] == "1":
+        return data["pois"]
+    else:
+        raise Exception(f"Around search failed: {data['info']}")
 
 @app.tool()
 async def polygon_search(polygon: str, types: str, keywords: str = "", offset: str = "20", page: str = "1", extensions: str = "base", output: str = "json") -> dict:
@@ -394,28 +1074,22 @@ async def polygon_search(polygon: str, types: str, keywords: str = "", offset: s
     Returns:
         多边形搜索结果，包括POI信息列表
     """
-    async with httpx.AsyncClient() as client:
-        params = {
-            "key": AMAP_KEY,
-            "polygon": polygon,
-            "types": types,
-            "offset": offset,
-            "page": page,
-            "extensions": extensions,
-            "output": output
-        }
-        if keywords:
-            params["keywords"] = keywords
+    params = {
+        "polygon": polygon,
+        "types": types,
+        "offset": offset,
+        "page": page,
+        "extensions": extensions,
+        "output": output
+    }
+    if keywords:
+        params["keywords"] = keywords
 
-        response = await client.get(
-            f"{AMAP_BASE_URL}/place/polygon",
-            params=params
-        )
-        data = response.json()
-        if data["status"] == "1":
-            return data["pois"]
-        else:
-            raise Exception(f"Polygon search failed: {data['info']}")
+    data = await amap_get("/place/polygon", params, tool="polygon_search")
+    if data["status"] == "1":
+        return data["pois"]
+    else:
+        raise Exception(f"Polygon search failed: {data['info']}")
 
 @app.tool()
 async def id_query(id: str, sig: str = "", callback: str = "", output: str = "json") -> dict:
@@ -431,26 +1105,20 @@ async def id_query(id: str, sig: str = "", callback: str = "", output: str = "js
     Returns:
         ID查询结果，包括POI详细信息
     """
-    async with httpx.AsyncClient() as client:
-        params = {
-            "key": AMAP_KEY,
-            "id": id,
-            "output": output
-        }
-        if sig:
-            params["sig"] = sig
-        if callback:
-            params["callback"] = callback
-
-        response = await client.get(
-            f"{AMAP_BASE_URL}/place/detail",
-            params=params
-        )
-        data = response.json()
-        if data["status"] == "1":
-            return data["pois"]
-        else:
-            raise Exception(f"ID query failed: {data['info']}")
+    params = {
+        "id": id,
+        "output": output
+    }
+    if sig:
+        params["sig"] = sig
+    if callback:
+        params["callback"] = callback
+
+    data = await amap_get("/place/detail", params, tool="id_query")
+    if data["status"] == "1":
+        return data["pois"]
+    else:
+        raise Exception(f"ID query failed: {data['info']}")
 
 @app.tool()
 async def traffic_event_query(adcode: str, client_key: str, timestamp: str, digest: str, event_type: str, is_expressway: str, output: str = "json") -> dict:
@@ -469,27 +1137,21 @@ async def traffic_event_query(adcode: str, client_key: str, timestamp: str, dige
     Returns:
         交通事件查询结果，包括事件详细信息列表
     """
-    async with httpx.AsyncClient() as client:
-        params = {
-            "key": AMAP_KEY,
-            "adcode": adcode,
-            "clientKey": client_key,
-            "timestamp": timestamp,
-            "digest": digest,
-            "eventType": event_type,
-            "isExpressway": is_expressway,
-            "output": output
-        }
+    params = {
+        "adcode": adcode,
+        "clientKey": client_key,
+        "timestamp": timestamp,
+        "digest": digest,
+        "eventType": event_type,
+        "isExpressway": is_expressway,
+        "output": output
+    }
 
-        response = await client.get(
-            f"{AMAP_BASE_URL}/event/queryByAdcode",
-            params=params
-        )
-        data = response.json()
-        if data["code"] == 1:
-            return data["data"]
-        else:
-            raise Exception(f"Traffic event query failed: {data['msg']}")
+    data = await amap_get("/event/queryByAdcode", params, tool="traffic_event_query")
+    if data["code"] == 1:
+        return data["data"]
+    else:
+        raise Exception(f"Traffic event query failed: {data['msg']}")
 
 @app.tool()
 async def ip_location(ip: str = "", sig: str = "", output: str = "json") -> dict:
@@ -504,30 +1166,24 @@ async def ip_location(ip: str = "", sig: str = "", output: str = "json") -> dict
     Returns:
         IP定位结果，包括省份名称、城市名称、adcode编码和所在城市矩形区域范围
     """
-    async with httpx.AsyncClient() as client:
-        params = {
-            "key": AMAP_KEY,
-            "output": output
+    params = {
+        "output": output
+    }
+    if ip:
+        params["ip"] = ip
+    if sig:
+        params["sig"] = sig
+
+    data = await amap_get("/ip", params, tool="ip_location")
+    if data["status"] == "1":
+        return {
+            "province": data["province"],
+            "city": data["city"],
+            "adcode": data["adcode"],
+            "rectangle": data["rectangle"]
         }
-        if ip:
-            params["ip"] = ip
-        if sig:
-            params["sig"] = sig
-
-        response = await client.get(
-            f"{AMAP_BASE_URL}/ip",
-            params=params
-        )
-        data = response.json()
-        if data["status"] == "1":
-            return {
-                "province": data["province"],
-                "city": data["city"],
-                "adcode": data["adcode"],
-                "rectangle": data["rectangle"]
-            }
-        else:
-            raise Exception(f"IP location failed: {data['info']}")
+    else:
+        raise Exception(f"IP location failed: {data['info']}")
 
 @app.tool()
 async def weather_query(city: str, extensions: str = "base", output: str = "json") -> dict:
@@ -542,23 +1198,17 @@ async def weather_query(city: str, extensions: str = "base", output: str = "json
     Returns:
         天气查询结果，包括实况或预报天气信息
     """
-    async with httpx.AsyncClient() as client:
-        params = {
-            "key": AMAP_KEY,
-            "city": city,
-            "extensions": extensions,
-            "output": output
-        }
+    params = {
+        "city": city,
+        "extensions": extensions,
+        "output": output
+    }
 
-        response = await client.get(
-            f"{AMAP_BASE_URL}/weather/weatherInfo",
-            params=params
-        )
-        data = response.json()
-        if data["status"] == "1":
-            return data.get("lives", []) if extensions == "base" else data.get("forecasts", [])
-        else:
-            raise Exception(f"Weather query failed: {data['info']}")
+    data = await amap_get("/weather/weatherInfo", params, tool="weather_query")
+    if data["status"] == "1":
+        return data.get("lives", []) if extensions == "base" else data.get("forecasts", [])
+    else:
+        raise Exception(f"Weather query failed: {data['info']}")
 
 @app.tool()
 async def input_tips(keywords: str, type: str = "", location: str = "", city: str = "", citylimit: str = "false", datatype: str = "all", sig: str = "", output: str = "json", callback: str = "") -> dict:
@@ -579,35 +1229,30 @@ async def input_tips(keywords: str, type: str = "", location: str = "", city: st
     Returns:
         输入提示结果，包括建议提示列表
     """
-    async with httpx.AsyncClient() as client:
-        params = {
-            "key": AMAP_KEY,
-            "keywords": keywords,
-            "datatype": datatype,
-            "output": output
-        }
-        if type:
-            params["type"] = type
-        if location:
-            params["location"] = location
-        if city:
-            params["city"] = city
-        if citylimit:
-            params["citylimit"] = citylimit
-        if sig:
-            params["sig"] = sig
-        if callback and output == "json":
-            params["callback"] = callback
-
-        response = await client.get(
-            f"{AMAP_BASE_URL}/assistant/inputtips",
-            params=params
-        )
-        data = response.json()
-        if data["status"] == "1":
-            return data["tips"]
-        else:
-            raise Exception(f"Input tips failed: {data['info']}")
+    params = {
+        "keywords": keywords,
+        "datatype": datatype,
+        "output": output
+    }
+    if type:
+        params["type"] = type
+    if location:
+        params["location"] = location
+    if city:
+        params["city"] = city
+    if citylimit:
+        params["citylimit"] = citylimit
+    if sig:
+        params["sig"] = sig
+    if callback and output == "json":
+        params["callback"] = callback
+
+    data = await amap_get("/assistant/inputtips", params, tool="input_tips")
+    if data["status"] == "1":
+        return data["tips"]
+    else:
+        raise Exception(f"Input tips failed: {data['info']}")
 
 if __name__ == "__main__":
-    app.run(transport="sse")
+    import uvicorn
+    uvicorn.run(create_sse_app(), host=app.settings.host, port=app.settings.port)
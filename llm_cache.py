@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Optional, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.outputs import Generation
+
+logger = logging.getLogger(__name__)
+
+# 为 True 时当前请求不读写缓存，用于按请求绕过缓存
+llm_cache_bypass: ContextVar[bool] = ContextVar("llm_cache_bypass", default=False)
+
+def canonical_prompt(prompt: str) -> str:
+    """把序列化的消息列表转为只含角色、内容、工具调用名称与参数的形式
+
+    聊天模型传给缓存的 prompt 是 dumps(messages)，其中的消息 id、tool_call_id、工具调用 id
+    以及 response_metadata 等每次运行都不同（create_react_agent 为每条消息生成新的 uuid），
+    直接哈希会导致同样的对话永远无法命中。无法解析为消息列表时原样返回。
+    """
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        return prompt
+    if not isinstance(messages, list):
+        return prompt
+    canonical = []
+    for message in messages:
+        if not isinstance(message, dict) or "kwargs" not in message:
+            canonical.append(message)
+            continue
+        kwargs = message["kwargs"]
+        entry = {"role": kwargs.get("type") or message.get("id", [""])[-1], "content": kwargs.get("content")}
+        if kwargs.get("tool_calls"):
+            entry["tool_calls"] = [{"name": call.get("name"), "args": call.get("args")} for call in kwargs["tool_calls"]]
+        if entry["role"] == "tool":
+            entry["name"] = kwargs.get("name")
+            entry["status"] = kwargs.get("status", "success")
+        canonical.append(entry)
+    return json.dumps(canonical, ensure_ascii=False, sort_keys=True)
+
+class SQLiteLLMCache(BaseCache):
+    """基于 SQLite 的 LLM 响应缓存
+
+    缓存键为模型配置（部署名、参数、绑定的工具）与规范化后的完整消息列表
+    （含工具调用结果，去掉每次运行都不同的 id，见 canonical_prompt）的哈希；
+    条目按 TTL 过期，超过数量上限时淘汰最久未访问的条目。
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, tokens INTEGER NOT NULL, "
+            "expires REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed)")
+        self._db.commit()
+        self.counters = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "bypassed": 0, "tokens_saved": 0}
+
+    @staticmethod
+    def make_key(prompt: str, llm_string: str) -> str:
+        """按规范化的消息列表计算缓存键，合并连续空白，避免提示词缩进差异导致未命中"""
+        normalized = re.sub(r"\s+", " ", canonical_prompt(prompt)).strip()
+        return hashlib.sha256(f"{llm_string}\n{normalized}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _count_tokens(generations: Sequence[Generation]) -> int:
+        total = 0
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                total += usage.get("total_tokens", 0)
+        return total
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        if llm_cache_bypass.get():
+            self.counters["bypassed"] += 1
+            return None
+        key = self.make_key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, tokens, expires FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or row[2] <= now:
+                if row is not None:
+                    self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._db.commit()
+                self.counters["misses"] += 1
+                return None
+            self._db.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        self.counters["hits"] += 1
+        self.counters["tokens_saved"] += row[1]
+        try:
+            return loads(row[0])
+        except Exception as e:
+            logger.warning(f"LLM 缓存条目解析失败: {e}")
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        if llm_cache_bypass.get():
+            return
+        key = self.make_key(prompt, llm_string)
+        now = time.time()
+        value = dumps(list(return_val))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, tokens, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, self._count_tokens(return_val), now + self.ttl, now),
+            )
+            self._db.execute("DELETE FROM llm_cache WHERE expires <= ?", (now,))
+            count = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if count > self.max_entries:
+                evicted = count - self.max_entries
+                self._db.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed LIMIT ?)",
+                    (evicted,),
+                )
+                self.counters["evictions"] += evicted
+            self._db.commit()
+        self.counters["writes"] += 1
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM llm_cache")
+            self._db.commit()
+
+    # 异步接口在线程中执行 SQLite 操作；先在当前上下文检查绕过标记
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        if llm_cache_bypass.get():
+            self.counters["bypassed"] += 1
+            return None
+        return await asyncio.to_thread(self.lookup, prompt, llm_string)
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        if llm_cache_bypass.get():
+            return
+        await asyncio.to_thread(self.update, prompt, llm_string, return_val)
+
+    async def aclear(self, **kwargs: Any) -> None:
+        await asyncio.to_thread(self.clear)
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {
+            **self.counters,
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+        }
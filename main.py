@@ -1,32 +1,67 @@
 import asyncio
 import json
+import os
 import re
-from typing import Optional
-from fastapi import FastAPI, HTTPException
+import uuid
+from collections import OrderedDict
+from contextlib import aclosing, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 import logging
+import anyio
+import httpx
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
 from langchain_mcp_adapters.client import MultiServerMCPClient
+from langgraph.errors import GraphRecursionError
 from langgraph.prebuilt import create_react_agent
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, SystemMessage
+from langchain_core.tools import ToolException
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from mcp.types import CallToolRequest, CallToolRequestParams, CallToolResult, ClientRequest, RequestParams, TextContent
 from langchain_openai import AzureChatOpenAI
-from functools import lru_cache
+from functools import lru_cache, partial
 import time
+from stage_graph import Stage, StageFailed, run_stage_graph
+from llm_cache import SQLiteLLMCache, llm_cache_bypass
+from admission import AdmissionController, AdmissionRejected, Ticket
+from token_estimate import estimate_tokens
+import tracing
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+tracing.set_service_name("travel-planner")
 
-# 初始化 FastAPI 应用
-app = FastAPI()
-
-# 初始化语言模型
-model = AzureChatOpenAI(
-    openai_api_version="2024-12-01-preview",
-    deployment_name="gpt-4o",
-    azure_endpoint="https://ai-14911520644664ai275106389756.openai.azure.com/",
-    api_key="5YzhcN3wCRnFORXYl9SPWpzb7RIPRQmew0V71y0chvR6g6j8hcFOJQQJ99BDACHYHv6XJ3w3AAAAACOGFi3L",
-    max_tokens=2048,
-)
+# LLM 响应缓存（可选）：设置 LLM_CACHE_PATH 后启用
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")
+llm_cache = SQLiteLLMCache(
+    LLM_CACHE_PATH,
+    ttl=float(os.getenv("LLM_CACHE_TTL", "86400")),
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000")),
+) if LLM_CACHE_PATH else None
+
+# 初始化语言模型：LLM_BACKEND=fake 时使用按脚本回复的假模型（见 fake_llm.py），用于离线基准测试
+LLM_BACKEND = os.getenv("LLM_BACKEND", "azure")
+if LLM_BACKEND == "fake":
+    from fake_llm import FakeChatModel
+    model = FakeChatModel.from_env().model_copy(update={"cache": llm_cache})
+else:
+    model = AzureChatOpenAI(
+        openai_api_version="2024-12-01-preview",
+        deployment_name="gpt-4o",
+        azure_endpoint="https://ai-14911520644664ai275106389756.openai.azure.com/",
+        api_key="5YzhcN3wCRnFORXYl9SPWpzb7RIPRQmew0V71y0chvR6g6j8hcFOJQQJ99BDACHYHv6XJ3w3AAAAACOGFi3L",
+        max_tokens=2048,
+        # 流式输出，面向用户的阶段（草稿、总结）可以逐 token 推送给前端
+        streaming=True,
+        stream_usage=True,
+        cache=llm_cache,
+    )
 
 # 定义请求数据模型
 class PlanRequest(BaseModel):
@@ -35,26 +70,632 @@ class PlanRequest(BaseModel):
     days: Optional[int] = None
     user_input: str
     selected_draft: Optional[str] = None
+    context_token: Optional[str] = None
+    bypass_llm_cache: bool = False
+    # 总结方式："agent" 总结 Agent；"budget" 每部分只发送一次并限制输入长度；"fast" 直接拼接，不调用 LLM
+    summary_mode: str = "agent"
+    # 整个规划的截止时间（秒），为空时使用服务端默认值
+    deadline_seconds: Optional[float] = None
+
+# 高德 MCP 服务配置
+MCP_SERVERS = {
+    "gaode": {
+        "url": os.getenv("GAODE_MCP_URL", "http://localhost:8000/sse"),
+        "transport": "sse",
+    }
+}
+MCP_HEALTH_CHECK_INTERVAL = float(os.getenv("MCP_HEALTH_CHECK_INTERVAL", "30"))
+MCP_CONNECT_TIMEOUT = float(os.getenv("MCP_CONNECT_TIMEOUT", "10"))
+
+# 说明 MCP 连接已断开的异常：出现时立即请求重连，不必等下一次健康检查
+MCP_TRANSPORT_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream, httpx.TransportError)
+
+def tool_result_content(result: CallToolResult) -> tuple:
+    """把 MCP 工具结果转换为 (内容, 附件)，与 langchain_mcp_adapters 的工具返回格式一致"""
+    text = [content.text for content in result.content if isinstance(content, TextContent)]
+    artifacts = [content for content in result.content if not isinstance(content, TextContent)]
+    output = text[0] if len(text) == 1 else text
+    if result.isError:
+        raise ToolException(output)
+    return output, artifacts or None
+
+def instrument_tool(tool, session, on_transport_error: Optional[Callable[[], None]] = None):
+    """包装 MCP 工具，按工具名和结果记录调用次数与耗时
+
+    直接通过会话发送 tools/call 请求，在请求的 _meta 中附带 traceparent，
+    MCP 服务端据此把它的 span 接到本次规划的追踪中。连接断开（MCP_TRANSPORT_ERRORS）时
+    调用 on_transport_error，由会话管理器重建连接。
+    """
+
+    async def coroutine(**arguments):
+        start = time.monotonic()
+        outcome = "error"
+        with tracing.span(f"mcp {tool.name}", kind="client", tool=tool.name):
+            try:
+                params = CallToolRequestParams(
+                    name=tool.name, arguments=arguments, _meta=RequestParams.Meta(traceparent=tracing.traceparent())
+                )
+                result = await session.send_request(
+                    ClientRequest(CallToolRequest(method="tools/call", params=params)), CallToolResult
+                )
+                content = tool_result_content(result)
+                outcome = "ok"
+                return content
+            except asyncio.CancelledError:
+                outcome = "cancelled"
+                raise
+            except MCP_TRANSPORT_ERRORS as e:
+                logger.warning(f"MCP 工具调用连接异常（{tool.name}）: {e!r}")
+                if on_transport_error:
+                    on_transport_error()
+                raise
+            finally:
+                MCP_TOOL_CALLS.labels(tool.name, outcome).inc()
+                MCP_TOOL_DURATION.labels(tool.name).observe(time.monotonic() - start)
+
+    return tool.model_copy(update={"coroutine": coroutine})
+
+class MCPSessionManager:
+    """持有与 MCP 服务的长连接，供所有请求和 Agent 共享
+
+    连接的建立和关闭都在同一个后台任务中完成（SSE 客户端要求在同一任务内进出上下文），
+    该任务定期 ping 服务端，连接异常或收到重连请求时自动重建会话。
+    """
+
+    def __init__(self, servers: dict, health_check_interval: float):
+        self._servers = servers
+        self._health_check_interval = health_check_interval
+        self._tools = []
+        self._connected = asyncio.Event()
+        self._reconnect_requested = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # 会话代数，旧会话上的工具调用失败不会触发对新会话的重连
+        self._generation = 0
+        self.reconnects = 0
+
+    async def start(self):
+        """启动后台连接任务并等待首次连接（失败时不阻止应用启动，由后台任务继续重试）"""
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._connected.wait(), MCP_CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error("MCP 客户端初始化超时，将在后台继续重试")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def get_tools(self):
+        """返回当前会话的工具列表，连接未就绪时等待重连"""
+        try:
+            await asyncio.wait_for(self._connected.wait(), MCP_CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error("MCP 客户端初始化失败: 连接超时")
+            raise Exception("MCP 客户端初始化失败: 连接超时")
+        return self._tools
+
+    def request_reconnect(self):
+        """请求后台任务重建会话"""
+        self._reconnect_requested.set()
+
+    def _on_transport_error(self, generation: int):
+        """工具调用遇到连接断开时调用，仅当出错的仍是当前会话时请求重连"""
+        if generation == self._generation and self._connected.is_set():
+            self.request_reconnect()
+
+    async def _run(self):
+        backoff = 1
+        while True:
+            try:
+                async with MultiServerMCPClient(self._servers) as client:
+                    self._generation += 1
+                    on_transport_error = partial(self._on_transport_error, self._generation)
+                    self._tools = [
+                        instrument_tool(tool, client.sessions[name], on_transport_error)
+                        for name, tools in client.server_name_to_tools.items()
+                        for tool in tools
+                    ]
+                    self._reconnect_requested.clear()
+                    self._connected.set()
+                    backoff = 1
+                    logger.info(f"MCP 会话已建立，工具数量: {len(self._tools)}")
+                    await self._monitor(client)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"MCP 会话异常: {e}")
+            finally:
+                self._connected.clear()
+                self._tools = []
+            self.reconnects += 1
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
 
-async def init_mcp_client():
-    """异步初始化 MCP 客户端并返回工具"""
+    async def _monitor(self, client):
+        """定期健康检查，检查失败或收到重连请求时返回，由 _run 重建会话"""
+        while True:
+            try:
+                await asyncio.wait_for(self._reconnect_requested.wait(), self._health_check_interval)
+                self._reconnect_requested.clear()
+                logger.info("收到 MCP 重连请求")
+                return
+            except asyncio.TimeoutError:
+                pass
+            for name, session in client.sessions.items():
+                await asyncio.wait_for(session.send_ping(), MCP_CONNECT_TIMEOUT)
+
+mcp_manager = MCPSessionManager(MCP_SERVERS, MCP_HEALTH_CHECK_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用启动时建立 MCP 长连接，关闭时释放"""
+    await mcp_manager.start()
+    yield
+    await job_manager.shutdown()
+    await mcp_manager.stop()
+
+# 初始化 FastAPI 应用
+app = FastAPI(lifespan=lifespan)
+
+# 规划上下文保存时间（秒）与最大数量，用于草稿阶段与详细规划阶段之间复用中间结果
+PLANNING_CONTEXT_TTL = float(os.getenv("PLANNING_CONTEXT_TTL", "1800"))
+PLANNING_CONTEXT_MAX = int(os.getenv("PLANNING_CONTEXT_MAX", "1000"))
+
+@dataclass
+class PlanningContext:
+    """一次规划过程中可复用的中间结果"""
+    city: str
+    days: int
+    weather: Optional[str] = None
+    adcode: Optional[str] = None
+    drafts: list = field(default_factory=list)
+    created: float = field(default_factory=time.time)
+
+planning_contexts: "OrderedDict[str, PlanningContext]" = OrderedDict()
+
+def save_planning_context(context: PlanningContext) -> str:
+    """保存规划上下文并返回令牌，超出数量上限时淘汰最早的上下文"""
+    token = uuid.uuid4().hex
+    planning_contexts[token] = context
+    while len(planning_contexts) > PLANNING_CONTEXT_MAX:
+        planning_contexts.popitem(last=False)
+    return token
+
+def load_planning_context(token: Optional[str], city_name: str, days: int) -> Optional[PlanningContext]:
+    """按令牌取回规划上下文，过期或城市、天数不一致时返回 None"""
+    if not token:
+        return None
+    context = planning_contexts.get(token)
+    if context is None:
+        return None
+    if time.time() - context.created > PLANNING_CONTEXT_TTL:
+        planning_contexts.pop(token, None)
+        return None
+    if context.city != city_name or context.days != days:
+        return None
+    return context
+
+# 异步规划任务：已完成任务结果的保留时间（秒）
+PLAN_JOB_TTL = float(os.getenv("PLAN_JOB_TTL", "3600"))
+
+# 准入控制：同时执行的规划请求数（含异步任务）、等待队列长度、单个客户端最多排队的请求数，
+# 以及还没有执行时长样本时建议的重试等待秒数
+PLAN_MAX_ACTIVE = int(os.getenv("PLAN_MAX_ACTIVE", "4"))
+PLAN_MAX_QUEUE = int(os.getenv("PLAN_MAX_QUEUE", "20"))
+PLAN_MAX_QUEUE_PER_CLIENT = int(os.getenv("PLAN_MAX_QUEUE_PER_CLIENT", "3"))
+PLAN_RETRY_AFTER = float(os.getenv("PLAN_RETRY_AFTER", "30"))
+
+admission = AdmissionController(PLAN_MAX_ACTIVE, PLAN_MAX_QUEUE, PLAN_MAX_QUEUE_PER_CLIENT, PLAN_RETRY_AFTER)
+
+def client_id_of(http_request: Request) -> str:
+    """按 X-Client-Id 请求头区分客户端（前端每个会话一个），没有时使用客户端地址"""
+    client_id = http_request.headers.get("X-Client-Id")
+    if client_id:
+        return client_id
+    return http_request.client.host if http_request.client else "unknown"
+
+def reserve_plan_slot(http_request: Request) -> Ticket:
+    """为规划请求登记准入，队列已满时返回 429 及建议的重试时间"""
     try:
-        async with MultiServerMCPClient(
-            {
-                "gaode": {
-                    "url": "http://localhost:8000/sse",
-                    "transport": "sse",
-                }
-            }
-        ) as client:
-            return client.get_tools()
-    except Exception as e:
-        logger.error(f"MCP 客户端初始化失败: {e}")
-        raise Exception(f"MCP 客户端初始化失败: {str(e)}")
+        return admission.reserve(client_id_of(http_request))
+    except AdmissionRejected as e:
+        logger.warning(f"拒绝规划请求: {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
-async def generate_drafts(agent, city_name: str, days: int, user_input: str, num_drafts: int = 3):
-    """为单个城市生成多个草稿行程，分别偏向运动、文化和美食"""
-    # 查询天气信息（与 single_city_plan 对齐）
+# /plan 检查客户端是否已断开的间隔（秒）
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "1"))
+
+# 因客户端断开而取消的规划请求数，按接口统计
+cancellation_stats = {"plan": 0, "plan_stream": 0}
+
+# Prometheus 指标，由 /metrics 暴露
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 90, 120, 180, 300, 600)
+PLAN_DURATION = Histogram(
+    "plan_duration_seconds", "整个规划请求的耗时", ["mode", "outcome"], buckets=LATENCY_BUCKETS
+)
+STAGE_DURATION = Histogram(
+    "plan_stage_duration_seconds", "各规划阶段的耗时，status 为 ok/fallback/timeout/failed/cancelled",
+    ["stage", "status"], buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter("llm_tokens_total", "LLM 消耗的 token 数", ["stage", "kind"])
+REACT_STEPS = Counter("react_steps_total", "Agent 的模型调用（ReAct 步）次数", ["stage"])
+MCP_TOOL_CALLS = Counter("mcp_tool_calls_total", "MCP 工具调用次数，outcome 为 ok/error/cancelled", ["tool", "outcome"])
+MCP_TOOL_DURATION = Histogram(
+    "mcp_tool_call_duration_seconds", "MCP 工具调用耗时", ["tool"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+
+@contextmanager
+def observe_stage(stage: str):
+    """记录不经过阶段图执行的阶段（草稿、多城市交通等）的耗时，并为其记录 span"""
+    start = time.monotonic()
+    status = "ok"
+    try:
+        with tracing.span(f"stage {stage}", stage=stage):
+            yield
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    except Exception:
+        status = "failed"
+        raise
+    finally:
+        STAGE_DURATION.labels(stage, status).observe(time.monotonic() - start)
+
+def traced_stage(stage: Stage) -> Stage:
+    """为阶段图中的阶段记录 span，阶段内的 Agent 和工具调用都在该 span 之下"""
+    func = stage.func
+
+    async def run(**inputs):
+        with tracing.span(f"stage {stage.name}", stage=stage.name):
+            return await func(**inputs)
+
+    stage.func = run
+    return stage
+
+def observe_stage_timing(stage: str, timing: dict):
+    """记录阶段图中一个阶段的耗时和状态"""
+    STAGE_DURATION.labels(stage, timing["status"]).observe(timing["duration"])
+
+# 进度事件回调：流式接口通过它在各阶段完成时推送结果
+EmitFn = Callable[[dict], None]
+
+def emit_event(emit: Optional[EmitFn], event: str, **fields):
+    """推送一个进度事件，未提供回调时忽略"""
+    if emit:
+        emit({"event": event, **fields})
+
+# 整个规划请求的默认截止时间（秒），同步接口与异步任务分别设置，请求可通过 deadline_seconds 覆盖
+PLAN_DEADLINE_SECONDS = float(os.getenv("PLAN_DEADLINE_SECONDS", "300"))
+PLAN_JOB_DEADLINE_SECONDS = float(os.getenv("PLAN_JOB_DEADLINE_SECONDS", "900"))
+# Agent 在阶段超时或请求截止前预留的秒数，用于整理并返回部分结果
+DEADLINE_GRACE_SECONDS = float(os.getenv("DEADLINE_GRACE_SECONDS", "5"))
+
+# 当前请求的截止时刻（time.monotonic()），随请求内创建的任务一起传递给各阶段和 Agent
+plan_deadline: ContextVar[Optional[float]] = ContextVar("plan_deadline", default=None)
+
+# 各阶段 Agent 的预算：max_steps 为最多模型调用次数，max_tool_calls 为最多工具调用次数，未列出的阶段不限制
+STAGE_BUDGETS = {
+    "decompose": {"max_steps": 1, "max_tool_calls": 0},
+    "summary": {"max_steps": 1, "max_tool_calls": 0},
+    "parse_cities": {"max_steps": 1, "max_tool_calls": 0},
+    "weather": {"max_steps": 3, "max_tool_calls": 3},
+    "draft": {"max_steps": 4, "max_tool_calls": 4},
+    "view": {"max_steps": 6, "max_tool_calls": 8},
+    "food": {"max_steps": 6, "max_tool_calls": 8},
+    "accommodation": {"max_steps": 6, "max_tool_calls": 8},
+    "traffic": {"max_steps": 8, "max_tool_calls": 12},
+    "transport": {"max_steps": 5, "max_tool_calls": 6},
+}
+
+# 预算耗尽后，剩余时间不少于该秒数时才额外调用一次模型整理已有信息，否则直接返回部分结果
+BUDGET_FINALIZE_MIN_SECONDS = float(os.getenv("BUDGET_FINALIZE_MIN_SECONDS", "15"))
+BUDGET_FINALIZE_PROMPT = "已达到本阶段的查询次数上限，请不要再调用工具，直接根据以上已查询到的信息给出最终回答。"
+
+# 进程累计的预算耗尽次数，按原因统计
+agent_budget_stats = {"step_budget": 0, "tool_budget": 0, "deadline": 0}
+
+class AgentBudgetExhausted(Exception):
+    """Agent 预算耗尽且没有任何可用的部分结果"""
+
+def remaining_seconds(deadline: Optional[float]) -> Optional[float]:
+    """距截止时间（time.monotonic() 时刻）的剩余秒数，没有截止时间时返回 None"""
+    return None if deadline is None else deadline - time.monotonic()
+
+def partial_output(new_messages) -> str:
+    """从 Agent 已产生的消息中取出最好的部分结果：最后一条非空的文本回复，否则为最近几次工具调用的结果"""
+    for message in reversed(new_messages):
+        if message.type == "ai" and not message.tool_calls and isinstance(message.content, str) and message.content.strip():
+            return message.content
+    tool_outputs = [str(message.content)[:500] for message in new_messages if message.type == "tool"]
+    if tool_outputs:
+        return "（未完成整理，以下为已查询到的信息）\n" + "\n".join(tool_outputs[-3:])
+    return ""
+
+async def finalize_answer(history) -> AIMessage:
+    """不绑定工具调用一次模型，根据已有的对话和工具结果给出最终回答"""
+    # 末尾尚未执行的工具调用没有对应的结果，发送给模型前去掉
+    while history and history[-1].type == "ai" and history[-1].tool_calls:
+        history = history[:-1]
+    return await model.ainvoke(history + [HumanMessage(BUDGET_FINALIZE_PROMPT)])
+
+async def run_agent(
+    agent,
+    messages,
+    emit: Optional[EmitFn] = None,
+    budget: Optional[dict] = None,
+    deadline: Optional[float] = None,
+    **stream_fields,
+) -> tuple[str, list[AIMessage]]:
+    """运行 Agent，返回最终回复文本和本次运行中模型的全部回复（用于统计调用次数和 token 用量）
+
+    提供 emit 时把 Agent 节点生成的 token 作为 token 事件逐个推送，
+    stream_fields 会附加到每个事件上（例如草稿序号），message_id 变化表示开始了新的一轮回复。
+    budget 限制模型调用次数（max_steps）和工具调用次数（max_tool_calls），deadline 为截止时刻；
+    超出任一限制时停止运行，改为返回已有信息整理出的部分结果。
+    """
+    budget = budget or {}
+    max_steps = budget.get("max_steps")
+    max_tool_calls = budget.get("max_tool_calls")
+    # Agent 每一步包含模型节点和工具节点两个超步；步数由下面的检查控制，递归上限只作兜底
+    config = {"recursion_limit": 2 * max_steps + 3} if max_steps else None
+    stream_mode = ["messages", "values"] if emit else ["values"]
+    latest = {"messages": messages}
+    stop_reason = None
+
+    async def consume():
+        nonlocal stop_reason
+        # 预算耗尽提前返回或超时取消时立即关闭生成器，让图中正在执行的节点随之结束，而不是留给垃圾回收
+        async with aclosing(agent.astream({"messages": messages}, config, stream_mode=stream_mode)) as stream:
+            async for mode, payload in stream:
+                if mode == "messages":
+                    chunk, metadata = payload
+                    if isinstance(chunk, AIMessageChunk) and chunk.content and metadata.get("langgraph_node") == "agent":
+                        emit_event(emit, "token", message_id=chunk.id, delta=chunk.content, **stream_fields)
+                    continue
+                latest["messages"] = payload["messages"]
+                ai_messages = [message for message in payload["messages"][len(messages):] if message.type == "ai"]
+                if not ai_messages or not ai_messages[-1].tool_calls:
+                    continue
+                # 模型仍要求调用工具时，在执行超出预算的工具调用之前停止
+                if max_tool_calls is not None and sum(len(message.tool_calls) for message in ai_messages) > max_tool_calls:
+                    stop_reason = "tool_budget"
+                    return
+                if max_steps and len(ai_messages) >= max_steps:
+                    stop_reason = "step_budget"
+                    return
+
+    remaining = remaining_seconds(deadline)
+    try:
+        if remaining is not None and remaining <= 0:
+            raise asyncio.TimeoutError
+        await asyncio.wait_for(consume(), remaining)
+    except GraphRecursionError:
+        stop_reason = "step_budget"
+    except asyncio.TimeoutError:
+        stop_reason = "deadline"
+
+    history = latest["messages"]
+    new_messages = history[len(messages):]
+    responses = [message for message in new_messages if message.type == "ai"]
+    if stop_reason is None:
+        return history[-1].content, responses
+
+    agent_budget_stats[stop_reason] += 1
+    logger.warning(f"Agent 预算耗尽（{stop_reason}），已调用模型 {len(responses)} 次，返回部分结果")
+    remaining = remaining_seconds(deadline)
+    if stop_reason != "deadline" and (remaining is None or remaining >= BUDGET_FINALIZE_MIN_SECONDS):
+        try:
+            response = await asyncio.wait_for(finalize_answer(history), remaining)
+            return response.content, responses + [response]
+        except Exception as e:
+            logger.error(f"预算耗尽后整理结果失败: {e}")
+    content = partial_output(new_messages)
+    if not content:
+        raise AgentBudgetExhausted(f"预算耗尽（{stop_reason}），没有可用的结果")
+    return content, responses
+
+# 各阶段 Agent 可使用的工具，空列表表示不绑定工具（不发送任何工具定义），未列出的阶段使用全部工具
+STAGE_TOOLS = {
+    "decompose": [],
+    "summary": [],
+    "parse_cities": [],
+    "weather": ["district_query", "weather_query"],
+    "draft": ["keyword_search", "weather_query"],
+    "view": ["keyword_search", "around_search", "id_query"],
+    "food": ["keyword_search", "around_search"],
+    "accommodation": ["keyword_search", "around_search", "geocode_batch", "distance_matrix"],
+    "traffic": [
+        "geocode", "geocode_batch", "distance_matrix",
+        "walking_direction", "transit_direction", "driving_direction", "bicycling_direction",
+    ],
+    "transport": ["geocode", "transit_direction", "driving_direction"],
+}
+
+# 进程累计的工具定义节省量估算
+tool_schema_stats = {"model_calls": 0, "tokens_saved": 0}
+
+def tool_schema_tokens(tool) -> int:
+    """估算一个工具的定义在每次模型调用时占用的提示词 token 数"""
+    return estimate_tokens(json.dumps(convert_to_openai_tool(tool), ensure_ascii=False))
+
+class StageAgents:
+    """按阶段构建只绑定所需工具的 Agent，并统计相对绑定全部工具节省的提示词 token"""
+
+    def __init__(self, tools):
+        self._tools = {tool.name: tool for tool in tools}
+        self._schema_tokens = {name: tool_schema_tokens(tool) for name, tool in self._tools.items()}
+        self._agents = {}
+        self.tokens_saved = 0
+
+    def tools_for(self, stage: str) -> list:
+        names = STAGE_TOOLS.get(stage)
+        if names is None:
+            return list(self._tools.values())
+        return [self._tools[name] for name in names if name in self._tools]
+
+    def get(self, stage: str):
+        if stage not in self._agents:
+            self._agents[stage] = create_react_agent(model, self.tools_for(stage))
+        return self._agents[stage]
+
+    async def run(self, stage: str, messages, emit: Optional[EmitFn] = None, **stream_fields) -> str:
+        """运行指定阶段的 Agent，返回最终回复文本
+
+        按阶段预算限制步数和工具调用次数；截止时间取请求截止时间与阶段超时中较早者，
+        并预留 DEADLINE_GRACE_SECONDS 秒，使 Agent 能在阶段被强制取消前返回部分结果。
+        """
+        deadline = plan_deadline.get()
+        if stage in STAGE_TIMEOUTS:
+            stage_deadline = time.monotonic() + STAGE_TIMEOUTS[stage]
+            deadline = stage_deadline if deadline is None else min(deadline, stage_deadline)
+        if deadline is not None:
+            deadline -= DEADLINE_GRACE_SECONDS
+        with tracing.span(f"agent {stage}", stage=stage) as span_attributes:
+            content, responses = await run_agent(
+                self.get(stage), messages, emit, STAGE_BUDGETS.get(stage), deadline, **stream_fields
+            )
+            model_calls = len(responses)
+            span_attributes["model_calls"] = model_calls
+        REACT_STEPS.labels(stage).inc(model_calls)
+        for response in responses:
+            usage = response.usage_metadata or {}
+            LLM_TOKENS.labels(stage, "prompt").inc(usage.get("input_tokens", 0))
+            LLM_TOKENS.labels(stage, "completion").inc(usage.get("output_tokens", 0))
+        selected = {tool.name for tool in self.tools_for(stage)}
+        saved = model_calls * sum(tokens for name, tokens in self._schema_tokens.items() if name not in selected)
+        self.tokens_saved += saved
+        tool_schema_stats["model_calls"] += model_calls
+        tool_schema_stats["tokens_saved"] += saved
+        return content
+
+# budget 总结模式下发送给总结 Agent 的各部分内容总字符数上限
+SUMMARY_MAX_INPUT_CHARS = int(os.getenv("SUMMARY_MAX_INPUT_CHARS", "6000"))
+SUMMARY_MODES = ("agent", "budget", "fast")
+
+TRUNCATION_MARKER = "……（已截断）"
+
+def truncate_to(content: str, limit: int) -> str:
+    """截断到不超过 limit 个字符（含省略标记）；额度小于标记长度时不加标记"""
+    if len(content) <= limit:
+        return content
+    if limit < len(TRUNCATION_MARKER):
+        return content[:max(limit, 0)]
+    return content[:limit - len(TRUNCATION_MARKER)] + TRUNCATION_MARKER
+
+def fit_sections_to_budget(sections: dict, budget: int) -> dict:
+    """按总字符数上限截断各部分内容
+
+    较短的部分保持完整，剩余额度平均分配给较长的部分，被截断的部分以省略标记结尾，
+    省略标记计入额度，截断后的总长度不超过 budget。
+    """
+    remaining = budget
+    limits = {}
+    pending = sorted(sections, key=lambda name: len(sections[name] or ""))
+    while pending:
+        share = remaining // len(pending)
+        name = pending[0]
+        length = len(sections[name] or "")
+        if length <= share:
+            limits[name] = length
+            remaining -= length
+            pending.pop(0)
+        else:
+            for name in pending:
+                limits[name] = share
+            break
+    return {
+        name: content if len(content or "") <= limits[name] else truncate_to(content, limits[name])
+        for name, content in sections.items()
+    }
+
+# 单城市规划各阶段超时时间（秒）
+STAGE_TIMEOUTS = {
+    "decompose": float(os.getenv("STAGE_TIMEOUT_DECOMPOSE", "60")),
+    "weather": float(os.getenv("STAGE_TIMEOUT_WEATHER", "30")),
+    "view": float(os.getenv("STAGE_TIMEOUT_VIEW", "120")),
+    "food": float(os.getenv("STAGE_TIMEOUT_FOOD", "120")),
+    "accommodation": float(os.getenv("STAGE_TIMEOUT_ACCOMMODATION", "120")),
+    "traffic": float(os.getenv("STAGE_TIMEOUT_TRAFFIC", "150")),
+    "summary": float(os.getenv("STAGE_TIMEOUT_SUMMARY", "120")),
+}
+
+# 多城市规划时同时进行的城市规划与城市间交通查询数量
+MULTI_CITY_CONCURRENCY = int(os.getenv("MULTI_CITY_CONCURRENCY", "3"))
+
+# 天气获取方式："direct" 直接调用 weather_query 工具并按模板格式化，"llm" 使用 Agent 查询
+WEATHER_MODE = os.getenv("WEATHER_MODE", "direct")
+# direct 模式失败时是否回退到 LLM Agent 查询
+WEATHER_LLM_FALLBACK = os.getenv("WEATHER_LLM_FALLBACK", "1") == "1"
+
+WEEKDAYS = {"1": "一", "2": "二", "3": "三", "4": "四", "5": "五", "6": "六", "7": "日"}
+
+def find_tool(tools, name: str):
+    """按名称查找 MCP 工具"""
+    for tool in tools:
+        if tool.name == name:
+            return tool
+    raise Exception(f"未找到工具: {name}")
+
+def parse_tool_output(raw) -> list:
+    """解析 MCP 工具返回的 JSON 文本，统一展开为列表"""
+    items = raw if isinstance(raw, list) else [raw]
+    parsed = []
+    for item in items:
+        text = item.get("text", "") if isinstance(item, dict) else item
+        try:
+            value = json.loads(text)
+        except (TypeError, json.JSONDecodeError):
+            continue
+        if isinstance(value, list):
+            parsed.extend(value)
+        else:
+            parsed.append(value)
+    return parsed
+
+async def resolve_adcode(tools, city_name: str) -> str:
+    """通过行政区域查询获取城市 adcode（天气接口需要 adcode）"""
+    districts = parse_tool_output(
+        await find_tool(tools, "district_query").ainvoke({"keywords": city_name, "subdistrict": "0"})
+    )
+    for district in districts:
+        if isinstance(district, dict) and district.get("adcode"):
+            return district["adcode"]
+    raise Exception(f"无法解析城市编码: {city_name}")
+
+def format_weather(city_name: str, forecasts: list) -> str:
+    """将高德天气预报格式化为简洁文本"""
+    lines = []
+    for forecast in forecasts:
+        lines.append(f"{forecast.get('city') or city_name}天气预报（发布时间：{forecast.get('reporttime', '未知')}）：")
+        for cast in forecast.get("casts", []):
+            weekday = WEEKDAYS.get(str(cast.get("week")), cast.get("week", ""))
+            lines.append(
+                f"- {cast.get('date')}（周{weekday}）：白天{cast.get('dayweather')}，夜间{cast.get('nightweather')}，"
+                f"气温 {cast.get('nighttemp')}~{cast.get('daytemp')}℃，"
+                f"{cast.get('daywind')}风 {cast.get('daypower')}级"
+            )
+    if len(lines) <= len(forecasts):
+        raise Exception("天气预报为空")
+    return "\n".join(lines)
+
+async def fetch_weather_direct(tools, city_name: str, context: Optional[PlanningContext] = None) -> str:
+    """直接调用天气工具获取预报，不经过 LLM"""
+    adcode = context.adcode if context and context.adcode else await resolve_adcode(tools, city_name)
+    if context:
+        context.adcode = adcode
+    forecasts = parse_tool_output(
+        await find_tool(tools, "weather_query").ainvoke({"city": adcode, "extensions": "all"})
+    )
+    return format_weather(city_name, forecasts)
+
+async def fetch_weather_llm(city_name: str) -> str:
+    """使用 Agent 查询天气并改写为文本，最多尝试 3 次"""
     messages_weather = [
         SystemMessage(
             f"使用工具查询{city_name}的当前及未来数日天气情况，并以简洁的文本形式返回。"
@@ -64,24 +705,49 @@ async def generate_drafts(agent, city_name: str, days: int, user_input: str, num
     weather_info = None
     for attempt in range(3):
         try:
-            async with MultiServerMCPClient(
-                {
-                    "gaode": {
-                        "url": "http://localhost:8000/sse",
-                        "transport": "sse",
-                    }
-                }
-            ) as client:
-                temp_agent = create_react_agent(model, client.get_tools())
-                response_weather = await temp_agent.ainvoke({"messages": messages_weather})
-                weather_info = response_weather["messages"][-1].content
-                logger.debug(f"草稿天气查询成功 (尝试 {attempt + 1})，结果: {weather_info}")
-                break
+            # 每次尝试都取最新的工具，会话重连后可立即使用
+            weather_agents = StageAgents(await mcp_manager.get_tools())
+            weather_info = await weather_agents.run("weather", messages_weather)
+            logger.debug(f"天气查询成功 (尝试 {attempt + 1})，结果: {weather_info}")
+            break
         except Exception as e:
-            logger.error(f"草稿天气查询尝试 {attempt + 1} 失败: {str(e)}，完整错误: {repr(e)}")
+            logger.error(f"天气查询尝试 {attempt + 1} 失败: {str(e)}，完整错误: {repr(e)}")
             if attempt == 2:
                 weather_info = f"天气查询失败: {str(e)}"
-            await asyncio.sleep(2 ** attempt)
+            else:
+                await asyncio.sleep(2 ** attempt)
+    return weather_info
+
+async def fetch_weather(city_name: str, context: Optional[PlanningContext] = None) -> str:
+    """获取城市天气文本，默认直接调用工具，按配置回退到 LLM 查询
+
+    提供规划上下文时优先复用其中已查询的天气，并把新结果写回上下文。
+    """
+    if context and context.weather:
+        logger.info(f"复用规划上下文中的{city_name}天气")
+        return context.weather
+    if WEATHER_MODE == "llm":
+        weather_info = await fetch_weather_llm(city_name)
+    else:
+        try:
+            weather_info = await fetch_weather_direct(await mcp_manager.get_tools(), city_name, context)
+            logger.debug(f"天气直接查询成功，结果: {weather_info}")
+        except Exception as e:
+            logger.error(f"天气直接查询失败: {str(e)}，完整错误: {repr(e)}")
+            if WEATHER_LLM_FALLBACK:
+                weather_info = await fetch_weather_llm(city_name)
+            else:
+                weather_info = f"天气查询失败: {str(e)}"
+    if context and not weather_info.startswith("天气查询失败"):
+        context.weather = weather_info
+    return weather_info
+
+async def generate_drafts(agents: "StageAgents", city_name: str, days: int, user_input: str, num_drafts: int = 3, context: Optional[PlanningContext] = None, emit: Optional[EmitFn] = None):
+    """为单个城市生成多个草稿行程，分别偏向运动、文化和美食"""
+    # 查询天气信息（与 single_city_plan 对齐），结果写入规划上下文供详细规划复用
+    with observe_stage("weather"):
+        weather_info = await fetch_weather(city_name, context)
+    emit_event(emit, "section", city=city_name, section="weather", content=weather_info)
 
     drafts = []
     draft_prompts = [
@@ -101,91 +767,65 @@ async def generate_drafts(agent, city_name: str, days: int, user_input: str, num
             HumanMessage(f"草稿 {draft_num}：{city_name}，{days}天，偏好：{user_input}"),
         ]
         try:
-            response = await agent.ainvoke({"messages": messages})
-            return response["messages"][-1].content
+            with observe_stage("draft"):
+                draft = await agents.run("draft", messages, emit, stream="draft", city=city_name, index=draft_num)
         except Exception as e:
             logger.error(f"生成草稿 {draft_num} 失败: {e}")
-            return f"草稿 {draft_num} 生成失败: {str(e)}"
+            draft = f"草稿 {draft_num} 生成失败: {str(e)}"
+        emit_event(emit, "draft", city=city_name, index=draft_num, content=draft)
+        return draft
 
     # 并行生成草稿
     draft_tasks = [run_draft_agent(prompt, i + 1) for i, prompt in enumerate(draft_prompts)]
     drafts = await asyncio.gather(*draft_tasks, return_exceptions=True)
+    if context:
+        context.drafts = list(drafts)
     return drafts
 
-async def single_city_plan(agent, city_name: str, days: int, preferences: str, selected_draft: Optional[str] = None, drafts: Optional[list] = None):
-    """为单个城市生成行程规划，遵循 main_langchain(5).py 的逻辑"""
+async def single_city_plan(agents: "StageAgents", city_name: str, days: int, preferences: str, selected_draft: Optional[str] = None, drafts: Optional[list] = None, context: Optional[PlanningContext] = None, emit: Optional[EmitFn] = None, summary_mode: str = "agent"):
+    """为单个城市生成行程规划，遵循 main_langchain(5).py 的逻辑
+
+    各阶段按依赖关系组成阶段图并发执行：天气与任务拆分互不依赖，餐饮不依赖景点，
+    总耗时取决于最长的依赖链而不是所有阶段之和。
+    """
     start_time = time.time()
     logger.info(f"开始规划 {city_name} {days}天行程")
 
     # 任务拆分，匹配 main_langchain(5).py 的字段名称
-    messages = [
-        SystemMessage(
-            f"""将用户对{city_name}的旅游需求（{preferences}）拆分为景区、住宿、餐饮、出行四个方面的详细要求，适合{days}天行程。
-            参考选定的草稿：{selected_draft or '无'}。
-            仅输出有效的 JSON 字符串，格式如下：
-            {{"景区": "...", "住宿": "...", "餐饮": "...", "出行": "..."}}"""
-        ),
-        HumanMessage(f"{preferences} 用户希望的行程风格大致如下：{selected_draft or '无'}"),
-    ]
-    try:
-        response = await agent.ainvoke({"messages": messages})
-        core_content = response["messages"][-1].content
-        tasks = json.loads(re.sub(r"```json\n|```", "", core_content).strip())
-    except (json.JSONDecodeError, ValueError) as e:
-        logger.error(f"任务拆分失败: {e}")
-        return {"error": f"任务拆分失败: {str(e)}"}
+    async def decompose():
+        messages = [
+            SystemMessage(
+                f"""将用户对{city_name}的旅游需求（{preferences}）拆分为景区、住宿、餐饮、出行四个方面的详细要求，适合{days}天行程。
+                参考选定的草稿：{selected_draft or '无'}。
+                仅输出有效的 JSON 字符串，格式如下：
+                {{"景区": "...", "住宿": "...", "餐饮": "...", "出行": "..."}}"""
+            ),
+            HumanMessage(f"{preferences} 用户希望的行程风格大致如下：{selected_draft or '无'}"),
+        ]
+        core_content = await agents.run("decompose", messages)
+        return json.loads(re.sub(r"```json\n|```", "", core_content).strip())
 
-    view = tasks.get("景区", "")
-    accommodation = tasks.get("住宿", "")
-    food = tasks.get("餐饮", "")
-    traffic = tasks.get("出行", "")
-
-    # 独立查询天气信息（提前执行，完全对齐 backend.py）
-    messages_weather = [
-        SystemMessage(
-            f"使用工具查询{city_name}的当前及未来数日天气情况，并以简洁的文本形式返回。"
-        ),
-        HumanMessage(f"查询{city_name}的天气"),
-    ]
-    weather_info = None
-    for attempt in range(3):
-        try:
-            async with MultiServerMCPClient(
-                {
-                    "gaode": {
-                        "url": "http://localhost:8000/sse",
-                        "transport": "sse",
-                    }
-                }
-            ) as client:
-                # 重新创建代理以确保工具可用
-                temp_agent = create_react_agent(model, client.get_tools())
-                response_weather = await temp_agent.ainvoke({"messages": messages_weather})
-                weather_info = response_weather["messages"][-1].content
-                logger.debug(f"天气查询成功 (尝试 {attempt + 1})，结果: {weather_info}")
-                break
-        except Exception as e:
-            logger.error(f"天气查询尝试 {attempt + 1} 失败: {str(e)}，完整错误: {repr(e)}")
-            if attempt == 2:
-                weather_info = f"天气查询失败: {str(e)}"
-            await asyncio.sleep(2 ** attempt)
+    # 独立查询天气信息（与任务拆分并行），草稿阶段已查询时直接复用
+    async def query_weather():
+        return await fetch_weather(city_name, context)
 
     # 定义查询函数，匹配 main_langchain(5).py 的提示词
-    async def query_view():
+    async def query_view(decompose, weather):
+        view = decompose.get("景区", "")
         messages = [
             SystemMessage(
-                f"""根据以下天气情况：{weather_info}，参考旅游攻略意见（{view}），为用户提出适合{city_name}未来{days}天的游玩景点。
+                f"""根据以下天气情况：{weather}，参考旅游攻略意见（{view}），为用户提出适合{city_name}未来{days}天的游玩景点。
                 输出清晰的文本，列出景点名称、简介、开放时间、门票价格（如果适用）以及适合游览的理由（考虑天气影响）。"""
             ),
             HumanMessage(f"{city_name} {days}天景点推荐，偏好：{view}"),
         ]
         try:
-            response = await agent.ainvoke({"messages": messages})
-            return response["messages"][-1].content
+            return await agents.run("view", messages)
         except Exception as e:
             return f"景点规划失败: {str(e)}"
 
-    async def query_food():
+    async def query_food(decompose):
+        food = decompose.get("餐饮", "")
         messages = [
             SystemMessage(
                 f"""你是一个精确的旅游路线规划者，善于将景点规划与当地美食位置结合，为用户提供交通方便、口碑好的宝藏美食。
@@ -195,108 +835,153 @@ async def single_city_plan(agent, city_name: str, days: int, preferences: str, s
             HumanMessage(f"{city_name}餐饮推荐，偏好：{food}"),
         ]
         try:
-            response = await agent.ainvoke({"messages": messages})
-            return response["messages"][-1].content
+            return await agents.run("food", messages)
         except Exception as e:
             return f"餐饮规划失败: {str(e)}"
 
-    async def query_accommodation(view_plan):
+    async def query_accommodation(decompose, view):
+        accommodation = decompose.get("住宿", "")
         messages = [
             SystemMessage(
                 f"""你是一个精确的旅游路线规划者，善于将景点规划与酒店住宿结合起来，为用户提供交通方便、靠近景区的住宿地点。
-                参考旅游景点规划：{view_plan}，借鉴旅游攻略意见（{accommodation}），结合交通便利程度，为用户推荐合适的酒店住宿。
+                参考旅游景点规划：{view}，借鉴旅游攻略意见（{accommodation}），结合交通便利程度，为用户推荐合适的酒店住宿。
+                需要查询多个地点的坐标时，使用 geocode_batch 一次性批量查询，不要逐个调用 geocode。
                 输出清晰的文本，列出酒店名称、地址、房型、价格范围（如果适用）。"""
             ),
             HumanMessage(f"{city_name}住宿推荐，偏好：{accommodation}"),
         ]
         try:
-            response = await agent.ainvoke({"messages": messages})
-            return response["messages"][-1].content
+            return await agents.run("accommodation", messages)
         except Exception as e:
             return f"住宿规划失败: {str(e)}"
 
-    async def query_traffic(view_plan, accommodation_plan):
+    async def query_traffic(decompose, weather, view, accommodation):
+        traffic = decompose.get("出行", "")
         messages = [
             SystemMessage(
                 f"""你是一个精确的旅游路线规划者，善于将景点规划、住宿安排中涉及的位置用合理的方式联系起来，为用户提供精确详细的出行方案。
-                根据以下天气情况：{weather_info}，参考旅游景点规划：{view_plan}以及住宿安排：{accommodation_plan}，借鉴旅游攻略意见（{traffic}），提供{city_name}未来{days}天的合理详细出行路线规划。
+                根据以下天气情况：{weather}，参考旅游景点规划：{view}以及住宿安排：{accommodation}，借鉴旅游攻略意见（{traffic}），提供{city_name}未来{days}天的合理详细出行路线规划。
+                需要查询多个地点的坐标时，使用 geocode_batch 一次性批量查询，不要逐个调用 geocode。
+                比较多个地点之间的距离和时间时，使用 distance_matrix 一次性计算，再对选定的路线查询详细方案。
                 输出清晰的文本，包含每段路线的起点、终点、交通方式、预计时间和费用（如果适用），考虑天气对交通的影响。"""
             ),
             HumanMessage(f"{city_name}交通规划，偏好：{traffic}"),
         ]
         try:
-            response = await agent.ainvoke({"messages": messages})
-            return response["messages"][-1].content
+            return await agents.run("traffic", messages)
         except Exception as e:
             return f"交通规划失败: {str(e)}"
 
-    # 执行景点查询（基于 weather_info）
-    view_plan = await query_view()
-
-    # 顺序执行餐饮、住宿、交通查询，确保依赖关系
-    food_plan = await query_food()
-    accommodation_plan = await query_accommodation(view_plan)
-    traffic_plan = await query_traffic(view_plan, accommodation_plan)
-
-    logger.info(f"分步规划耗时: {time.time() - start_time:.2f}秒")
-
-    # 总结行程，使用总结 Agent
-    summary_source = "agent"
-    messages_summary = [
-        SystemMessage(
-            f"""整理以下内容，为用户撰写详细完整的{city_name} {days}天旅游计划，内容需包含景点、餐饮、住宿、出行和天气信息：
-            - 景区安排：{view_plan}
-            - 餐饮安排：{food_plan}
-            - 住宿安排：{accommodation_plan}
-            - 出行安排：{traffic_plan}
-            - 天气信息：{weather_info}
-            输出格式为清晰的文本，按以下结构组织：
-            详细行程规划：
-            景区安排：
-            {view_plan}
-            餐饮安排：
-            {food_plan}
-            住宿安排：
-            {accommodation_plan}
-            出行安排：
-            {traffic_plan}
-            天气信息：
-            {weather_info}
-            确保输出内容忠实反映输入的各部分规划，并包含天气信息。"""
-        ),
-        HumanMessage(f"{city_name} {days}天行程规划，偏好：{preferences}"),
-    ]
-    try:
-        response_summary = await agent.ainvoke({"messages": messages_summary})
-        summary = response_summary["messages"][-1].content
-    except Exception as e:
-        logger.error(f"总结行程失败: {e}")
-        summary_source = "fallback"
-        summary = f"""详细行程规划：
+    def fallback_summary(view, food, accommodation, traffic, weather):
+        return f"""详细行程规划：
 景区安排：
-{view_plan}
+{view}
 餐饮安排：
-{food_plan}
+{food}
 住宿安排：
-{accommodation_plan}
+{accommodation}
 出行安排：
-{traffic_plan}
+{traffic}
 天气信息：
-{weather_info}"""
+{weather}"""
+
+    # 总结行程：fast 模式直接拼接，budget 模式每部分只发送一次并限制输入长度，默认使用总结 Agent
+    async def summarize(view, food, accommodation, traffic, weather):
+        logger.info(f"分步规划耗时: {time.time() - start_time:.2f}秒")
+        if summary_mode == "fast":
+            return {"summary": fallback_summary(view, food, accommodation, traffic, weather), "summary_source": "fast"}
+        if summary_mode == "budget":
+            sections = fit_sections_to_budget(
+                {"景区安排": view, "餐饮安排": food, "住宿安排": accommodation, "出行安排": traffic, "天气信息": weather},
+                SUMMARY_MAX_INPUT_CHARS,
+            )
+            section_text = "\n".join(f"{name}：\n{content}" for name, content in sections.items())
+            messages_summary = [
+                SystemMessage(
+                    f"""整理以下内容，为用户撰写详细完整的{city_name} {days}天旅游计划，内容需包含景点、餐饮、住宿、出行和天气信息：
+{section_text}
+                    输出格式为清晰的文本，以“详细行程规划：”开头，依次包含景区安排、餐饮安排、住宿安排、出行安排、天气信息五个部分。
+                    确保输出内容忠实反映输入的各部分规划，并包含天气信息。"""
+                ),
+                HumanMessage(f"{city_name} {days}天行程规划，偏好：{preferences}"),
+            ]
+            summary = await agents.run("summary", messages_summary, emit, stream="summary", city=city_name)
+            return {"summary": summary, "summary_source": "budget"}
+        messages_summary = [
+            SystemMessage(
+                f"""整理以下内容，为用户撰写详细完整的{city_name} {days}天旅游计划，内容需包含景点、餐饮、住宿、出行和天气信息：
+                - 景区安排：{view}
+                - 餐饮安排：{food}
+                - 住宿安排：{accommodation}
+                - 出行安排：{traffic}
+                - 天气信息：{weather}
+                输出格式为清晰的文本，按以下结构组织：
+                详细行程规划：
+                景区安排：
+                {view}
+                餐饮安排：
+                {food}
+                住宿安排：
+                {accommodation}
+                出行安排：
+                {traffic}
+                天气信息：
+                {weather}
+                确保输出内容忠实反映输入的各部分规划，并包含天气信息。"""
+            ),
+            HumanMessage(f"{city_name} {days}天行程规划，偏好：{preferences}"),
+        ]
+        summary = await agents.run("summary", messages_summary, emit, stream="summary", city=city_name)
+        return {"summary": summary, "summary_source": "agent"}
+
+    def summary_on_error(error, **sections):
+        logger.error(f"总结行程失败: {error}")
+        return {"summary": fallback_summary(**sections), "summary_source": "fallback"}
+
+    stages = [
+        Stage("decompose", decompose, timeout=STAGE_TIMEOUTS["decompose"]),
+        Stage("weather", query_weather, timeout=STAGE_TIMEOUTS["weather"],
+              fallback=lambda e: f"天气查询失败: {str(e)}"),
+        Stage("view", query_view, ("decompose", "weather"), STAGE_TIMEOUTS["view"],
+              lambda e, **_: f"景点规划失败: {str(e)}"),
+        Stage("food", query_food, ("decompose",), STAGE_TIMEOUTS["food"],
+              lambda e, **_: f"餐饮规划失败: {str(e)}"),
+        Stage("accommodation", query_accommodation, ("decompose", "view"), STAGE_TIMEOUTS["accommodation"],
+              lambda e, **_: f"住宿规划失败: {str(e)}"),
+        Stage("traffic", query_traffic, ("decompose", "weather", "view", "accommodation"), STAGE_TIMEOUTS["traffic"],
+              lambda e, **_: f"交通规划失败: {str(e)}"),
+        Stage("summary", summarize, ("view", "food", "accommodation", "traffic", "weather"), STAGE_TIMEOUTS["summary"],
+              summary_on_error),
+    ]
+    def on_stage_complete(name, result):
+        if name == "summary":
+            emit_event(emit, "section", city=city_name, section="summary",
+                       content=result["summary"], summary_source=result["summary_source"])
+        elif name != "decompose":
+            emit_event(emit, "section", city=city_name, section=name, content=result)
+
+    try:
+        results, timings = await run_stage_graph(
+            [traced_stage(stage) for stage in stages], on_stage_complete, plan_deadline.get(), observe_stage_timing
+        )
+    except StageFailed as e:
+        logger.error(f"任务拆分失败: {e.cause}")
+        return {"error": f"任务拆分失败: {str(e.cause)}"}
 
     logger.info(f"总查询耗时: {time.time() - start_time:.2f}秒")
 
     return {
-        "summary": summary,
-        "summary_source": summary_source,
-        "view": view_plan,
-        "food": food_plan,
-        "accommodation": accommodation_plan,
-        "traffic": traffic_plan,
-        "weather": weather_info  # 新增 weather 字段，便于前端直接访问
+        "summary": results["summary"]["summary"],
+        "summary_source": results["summary"]["summary_source"],
+        "view": results["view"],
+        "food": results["food"],
+        "accommodation": results["accommodation"],
+        "traffic": results["traffic"],
+        "weather": results["weather"],  # 新增 weather 字段，便于前端直接访问
+        "timings": timings,
     }
 
-async def parse_multi_city_input(agent, user_input: str):
+async def parse_multi_city_input(agents: "StageAgents", user_input: str):
     """解析多城市输入，生成城市列表，包含城市名称、天数和偏好"""
     system_prompt = """
 you是一个行程规划助手，任务是分析用户的多城市旅行需求，生成一个包含城市名称、停留天数和具体偏好的 JSON 列表。
@@ -313,8 +998,8 @@ you是一个行程规划助手，任务是分析用户的多城市旅行需求
         HumanMessage(user_input),
     ]
     try:
-        response = await agent.ainvoke({"messages": messages})
-        raw_content = response["messages"][-1].content.strip()
+        with observe_stage("parse_cities"):
+            raw_content = (await agents.run("parse_cities", messages)).strip()
         cleaned_content = re.sub(r"```json\n|```|\n|\t", "", raw_content).strip()
         cities = json.loads(cleaned_content)
         if not isinstance(cities, list):
@@ -329,89 +1014,371 @@ you是一个行程规划助手，任务是分析用户的多城市旅行需求
         logger.error(f"解析多城市输入失败: {e}")
         return []
 
-async def plan_multi_city(agent, cities):
-    """为多个城市生成综合行程规划，包括城市间交通"""
-    complete_plan = []
-    previous_city = None
+async def plan_multi_city(agents: "StageAgents", cities, emit: Optional[EmitFn] = None, summary_mode: str = "agent"):
+    """为多个城市生成综合行程规划，包括城市间交通
 
-    for city in cities:
+    各城市规划与相邻城市间的交通查询并发执行，并发数受 MULTI_CITY_CONCURRENCY 限制，
+    输出顺序与串行执行时一致：城市计划之间穿插对应的交通安排。
+    """
+    semaphore = asyncio.Semaphore(MULTI_CITY_CONCURRENCY)
+
+    async def plan_city(city):
         city_name = city["name"]
         days = city["days"]
         preferences = city["preferences"]
-        logger.info(f"规划 {city_name} {days}天行程，偏好：{preferences}")
-
-        # 生成单城市计划
-        city_plan = await single_city_plan(agent, city_name, days, preferences)
+        async with semaphore:
+            logger.info(f"规划 {city_name} {days}天行程，偏好：{preferences}")
+            # 生成单城市计划
+            city_plan = await single_city_plan(agents, city_name, days, preferences, emit=emit, summary_mode=summary_mode)
         if "error" in city_plan:
-            complete_plan.append({"city": city_name, "days": days, "error": city_plan["error"]})
+            entry = {"city": city_name, "days": days, "error": city_plan["error"]}
         else:
-            complete_plan.append({"city": city_name, "days": days, "plan": city_plan})
+            entry = {"city": city_name, "days": days, "plan": city_plan}
+        emit_event(emit, "city", **entry)
+        return entry
 
-        # 规划城市间交通
-        if previous_city:
-            messages = [
-                SystemMessage(
-                    f"""使用工具查询从{previous_city}到{city_name}的交通方式（飞机、高铁、汽车等）。
-                    输出清晰的文本，包含推荐的交通方式、预计时间、费用（如果适用）以及预订建议。"""
-                ),
-                HumanMessage(f"从{previous_city}到{city_name}的交通方式"),
-            ]
+    # 规划城市间交通
+    async def plan_transport(previous_city, city_name):
+        messages = [
+            SystemMessage(
+                f"""使用工具查询从{previous_city}到{city_name}的交通方式（飞机、高铁、汽车等）。
+                输出清晰的文本，包含推荐的交通方式、预计时间、费用（如果适用）以及预订建议。"""
+            ),
+            HumanMessage(f"从{previous_city}到{city_name}的交通方式"),
+        ]
+        async with semaphore:
             try:
-                response = await agent.ainvoke({"messages": messages})
-                transport_plan = response["messages"][-1].content
-                complete_plan.append({"transport": f"从{previous_city}到{city_name}", "details": transport_plan})
+                with observe_stage("transport"):
+                    transport_plan = await agents.run("transport", messages)
+                entry = {"transport": f"从{previous_city}到{city_name}", "details": transport_plan}
             except Exception as e:
-                complete_plan.append({"transport": f"从{previous_city}到{city_name}", "error": f"交通查询失败: {str(e)}"})
-        previous_city = city_name
+                entry = {"transport": f"从{previous_city}到{city_name}", "error": f"交通查询失败: {str(e)}"}
+        emit_event(emit, "transport", **entry)
+        return entry
 
-    return complete_plan
+    tasks = []
+    previous_city = None
+    for city in cities:
+        tasks.append(plan_city(city))
+        if previous_city:
+            tasks.append(plan_transport(previous_city, city["name"]))
+        previous_city = city["name"]
 
-@app.post("/plan")
-async def plan(request: PlanRequest):
-    """处理前端发送的行程规划请求"""
+    # gather 按提交顺序返回结果，与原有的城市/交通交替顺序一致
+    complete_plan = await asyncio.gather(*tasks)
+    return list(complete_plan)
+
+async def execute_plan(
+    request: PlanRequest,
+    emit: Optional[EmitFn] = None,
+    default_deadline: float = PLAN_DEADLINE_SECONDS,
+) -> dict:
+    """执行一次行程规划请求，返回与 /plan 相同的响应体
+
+    提供 emit 时，天气、各草稿、各分项安排和总结会在完成时立即作为事件推送。
+    请求未指定 deadline_seconds 时使用 default_deadline 作为整个规划的截止时间。
+    """
+    validate_plan_request(request)
+    # 上下文变量会随之后创建的任务一起复制，本次请求内的所有 LLM 调用都按此设置读写缓存
+    llm_cache_bypass.set(request.bypass_llm_cache)
+    plan_deadline.set(time.monotonic() + (request.deadline_seconds or default_deadline))
+    tools = await mcp_manager.get_tools()
+    agents = StageAgents(tools)
+    logger.info(f"收到请求：mode={request.mode}, city={request.city}, days={request.days}, user_input={request.user_input[:50]}..., trace_id={tracing.trace_id()}")
+    start = time.monotonic()
+    outcome = "error"
     try:
-        tools = await init_mcp_client()
-        agent = create_react_agent(model, tools)
-        logger.info(f"收到请求：mode={request.mode}, city={request.city}, days={request.days}, user_input={request.user_input[:50]}...")
-
-        if request.mode == "单城市":
-            if not request.city or not request.days or request.days <= 0:
-                raise HTTPException(status_code=400, detail="单城市模式需要提供城市名称和有效天数")
-
-            if request.selected_draft:
-                # 根据选定的草稿生成详细计划
-                final_plan = await single_city_plan(
-                    agent, request.city, request.days,
-                    f"{request.user_input}。选定的草稿：{request.selected_draft}",
-                    request.selected_draft
-                )
-                if "error" in final_plan:
-                    raise HTTPException(status_code=500, detail=final_plan["error"])
-                return {"final_plan": final_plan}
-            else:
-                # 生成草稿行程
-                drafts = await generate_drafts(agent, request.city, request.days, request.user_input)
-                return {"drafts": drafts}
+        with tracing.span("plan", mode=request.mode, city=request.city, days=request.days):
+            result = await plan_by_mode(request, agents, emit)
+        outcome = "ok"
+        return result
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        PLAN_DURATION.labels(request.mode, outcome).observe(time.monotonic() - start)
+        logger.info(f"按阶段精简工具定义，本次规划约节省 {agents.tokens_saved} 个提示词 token")
 
-        elif request.mode == "多城市":
-            # 解析多城市输入
-            cities = await parse_multi_city_input(agent, request.user_input)
-            if not cities:
-                raise HTTPException(status_code=400, detail="无法解析多城市输入，请明确指定城市、天数和偏好")
+def validate_plan_request(request: PlanRequest):
+    """检查请求参数，无效时返回 400
 
-            # 生成多城市计划
-            city_plans = await plan_multi_city(agent, cities)
-            return {"cities": city_plans}
+    各接口在登记准入之前调用，无效请求不会占用排队名额，也不会在高负载时被 429 掩盖真正的错误。
+    """
+    if request.mode not in ("单城市", "多城市"):
+        raise HTTPException(status_code=400, detail="无效的模式，仅支持 '单城市' 或 '多城市'")
+    if request.mode == "单城市" and (not request.city or not request.days or request.days <= 0):
+        raise HTTPException(status_code=400, detail="单城市模式需要提供城市名称和有效天数")
+    if request.summary_mode not in SUMMARY_MODES:
+        raise HTTPException(status_code=400, detail=f"无效的总结方式，仅支持 {', '.join(SUMMARY_MODES)}")
+    if request.deadline_seconds is not None and request.deadline_seconds <= 0:
+        raise HTTPException(status_code=400, detail="deadline_seconds 必须为正数")
 
+async def plan_by_mode(request: PlanRequest, agents: StageAgents, emit: Optional[EmitFn] = None) -> dict:
+    """按单城市/多城市模式分派规划请求"""
+    if request.mode == "单城市":
+        if request.selected_draft:
+            # 根据选定的草稿生成详细计划，优先复用草稿阶段保存的上下文
+            context = load_planning_context(request.context_token, request.city, request.days)
+            final_plan = await single_city_plan(
+                agents, request.city, request.days,
+                f"{request.user_input}。选定的草稿：{request.selected_draft}",
+                request.selected_draft,
+                drafts=context.drafts if context else None,
+                context=context or PlanningContext(request.city, request.days),
+                emit=emit,
+                summary_mode=request.summary_mode,
+            )
+            if "error" in final_plan:
+                raise HTTPException(status_code=500, detail=final_plan["error"])
+            return {"final_plan": final_plan}
         else:
-            raise HTTPException(status_code=400, detail="无效的模式，仅支持 '单城市' 或 '多城市'")
+            # 生成草稿行程，并返回可供详细规划复用的上下文令牌
+            context = PlanningContext(request.city, request.days)
+            drafts = await generate_drafts(agents, request.city, request.days, request.user_input, context=context, emit=emit)
+            return {"drafts": drafts, "context_token": save_planning_context(context)}
+
+    elif request.mode == "多城市":
+        # 解析多城市输入
+        cities = await parse_multi_city_input(agents, request.user_input)
+        if not cities:
+            raise HTTPException(status_code=400, detail="无法解析多城市输入，请明确指定城市、天数和偏好")
+        emit_event(emit, "cities", cities=cities)
+
+        # 生成多城市计划
+        city_plans = await plan_multi_city(agents, cities, emit, request.summary_mode)
+        return {"cities": city_plans}
+
+    else:
+        raise HTTPException(status_code=400, detail="无效的模式，仅支持 '单城市' 或 '多城市'")
+
+async def run_until_disconnected(http_request: Request, coro):
+    """在后台任务中执行规划，客户端断开时取消该任务
+
+    取消会传递到正在执行的各阶段任务、Agent 和工具调用，避免为已放弃的请求继续消耗 LLM 和高德配额。
+    返回 None 表示客户端已断开、规划已取消。
+    """
+    task = asyncio.create_task(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                cancellation_stats["plan"] += 1
+                logger.warning("客户端已断开，取消正在执行的规划")
+                return None
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
 
+async def execute_admitted_plan(
+    ticket: Ticket,
+    request: PlanRequest,
+    emit: Optional[EmitFn] = None,
+    default_deadline: float = PLAN_DEADLINE_SECONDS,
+) -> dict:
+    """排队等待准入后执行规划，排队期间以 queued 事件推送排队位置，结束后释放执行名额"""
+    try:
+        await admission.wait(ticket, lambda position: emit_event(emit, "queued", position=position))
+        return await execute_plan(request, emit, default_deadline)
+    finally:
+        admission.release(ticket)
+
+@app.post("/plan")
+async def plan(request: PlanRequest, http_request: Request):
+    """处理前端发送的行程规划请求，客户端断开时取消规划"""
+    validate_plan_request(request)
+    ticket = reserve_plan_slot(http_request)
+    parent = tracing.parse_traceparent(http_request.headers.get("traceparent"))
+    try:
+        with tracing.span("POST /plan", parent, kind="server"):
+            result = await run_until_disconnected(http_request, execute_admitted_plan(ticket, request))
+        if result is None:
+            # 客户端已收不到响应，沿用 nginx 的 499 表示客户端关闭了连接
+            return Response(status_code=499)
+        return result
     except HTTPException as e:
         logger.error(f"HTTP错误: {e.detail}", exc_info=True)
         raise e
     except Exception as e:
         logger.error(f"行程规划失败: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"行程规划失败: {str(e)}")
+    finally:
+        # 规划任务在开始运行前就被取消时不会自行释放
+        admission.release(ticket)
+
+@app.post("/plan/stream")
+async def plan_stream(request: PlanRequest, http_request: Request):
+    """流式行程规划接口，以 NDJSON 逐行推送各阶段结果
+
+    事件类型：queued（排队位置）、section（天气/景点/餐饮/住宿/交通/总结）、draft、cities、city、transport，
+    最后推送 result（与 /plan 响应体相同）或 error。
+    """
+    # 在开始推送之前完成参数检查和准入登记，参数无效时返回 400，队列已满时直接返回 429
+    validate_plan_request(request)
+    ticket = reserve_plan_slot(http_request)
+    parent = tracing.parse_traceparent(http_request.headers.get("traceparent"))
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce():
+        try:
+            with tracing.span("POST /plan/stream", parent, kind="server"):
+                result = await execute_admitted_plan(ticket, request, queue.put_nowait)
+            queue.put_nowait({"event": "result", "data": result})
+        except HTTPException as e:
+            logger.error(f"HTTP错误: {e.detail}")
+            queue.put_nowait({"event": "error", "status": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.error(f"行程规划失败: {str(e)}", exc_info=True)
+            queue.put_nowait({"event": "error", "status": 500, "detail": f"行程规划失败: {str(e)}"})
+        finally:
+            queue.put_nowait(None)
+
+    async def stream():
+        task = asyncio.create_task(produce())
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端断开时停止生成
+            if not task.done():
+                cancellation_stats["plan_stream"] += 1
+                logger.warning("客户端已断开，取消正在执行的流式规划")
+                task.cancel()
+
+    # 响应结束后兜底释放准入登记，覆盖推送开始之前客户端就已断开的情况
+    return StreamingResponse(stream(), media_type="application/x-ndjson", background=BackgroundTask(admission.release, ticket))
+
+@dataclass
+class PlanJob:
+    """一个异步规划任务的状态与结果"""
+    id: str
+    request: PlanRequest
+    ticket: Ticket
+    # 提交任务的请求所在的追踪，任务执行的 span 接在其下
+    trace_parent: Optional[tracing.SpanContext] = None
+    status: str = "queued"  # queued / running / succeeded / failed
+    sections: list = field(default_factory=list)
+    result: Optional[dict] = None
+    error: Optional[dict] = None
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+
+class PlanJobManager:
+    """异步规划任务管理
+
+    任务在后台执行，不依赖发起请求的连接，客户端断开或刷新页面后仍可按任务 ID 查询；
+    任务与同步请求共用准入控制排队，已完成的任务在 ttl 秒后清理。
+    """
+
+    def __init__(self, ttl: float):
+        self.jobs: dict[str, PlanJob] = {}
+        self.ttl = ttl
+        self._tasks: set = set()
+
+    def submit(self, request: PlanRequest, ticket: Ticket, trace_parent: Optional[tracing.SpanContext] = None) -> PlanJob:
+        self._purge()
+        job = PlanJob(uuid.uuid4().hex, request, ticket, trace_parent)
+        self.jobs[job.id] = job
+        task = asyncio.create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, job_id: str) -> Optional[PlanJob]:
+        self._purge()
+        return self.jobs.get(job_id)
+
+    async def shutdown(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _record(self, job: PlanJob, event: dict):
+        # token 事件数量太多，任务只保留已完成的阶段
+        if event["event"] != "token":
+            job.sections.append(event)
+
+    async def _run(self, job: PlanJob):
+        try:
+            await admission.wait(job.ticket)
+            job.status = "running"
+            job.started = time.time()
+            with tracing.span("plan job", job.trace_parent, job_id=job.id):
+                job.result = await execute_plan(
+                    job.request, lambda event: self._record(job, event), PLAN_JOB_DEADLINE_SECONDS
+                )
+            job.status = "succeeded"
+        except HTTPException as e:
+            logger.error(f"规划任务 {job.id} 失败: {e.detail}")
+            job.status = "failed"
+            job.error = {"status": e.status_code, "detail": e.detail}
+        except Exception as e:
+            logger.error(f"规划任务 {job.id} 失败: {str(e)}", exc_info=True)
+            job.status = "failed"
+            job.error = {"status": 500, "detail": f"行程规划失败: {str(e)}"}
+        finally:
+            admission.release(job.ticket)
+            job.finished = time.time()
+
+    def _purge(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items() if job.finished and now - job.finished > self.ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+job_manager = PlanJobManager(PLAN_JOB_TTL)
+
+@app.get("/stats")
+async def stats():
+    """运行统计信息"""
+    return {
+        "llm_cache": llm_cache.stats() if llm_cache else None,
+        "tool_schema": tool_schema_stats,
+        "agent_budget": agent_budget_stats,
+        "cancelled_requests": cancellation_stats,
+        "admission": admission.stats(),
+        "mcp_reconnects": mcp_manager.reconnects,
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指标"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.post("/plan/jobs", status_code=202)
+async def create_plan_job(request: PlanRequest, http_request: Request):
+    """提交异步规划任务，立即返回任务 ID；参数无效时返回 400，等待队列已满时返回 429"""
+    validate_plan_request(request)
+    job = job_manager.submit(
+        request, reserve_plan_slot(http_request), tracing.parse_traceparent(http_request.headers.get("traceparent"))
+    )
+    logger.info(f"创建规划任务 {job.id}：mode={request.mode}, city={request.city}, days={request.days}")
+    return {"job_id": job.id, "status": job.status, "queue_position": admission.position(job.ticket)}
+
+@app.get("/plan/jobs/{job_id}")
+async def get_plan_job(job_id: str):
+    """查询异步规划任务的状态、已完成的阶段和最终结果"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="规划任务不存在或已过期")
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        # 排队中的任务前面还有多少个请求
+        "queue_position": admission.position(job.ticket) if job.status == "queued" else None,
+        "sections": job.sections,
+        "result": job.result,
+        "error": job.error,
+        "created": job.created,
+        "started": job.started,
+        "finished": job.finished,
+    }
 
 if __name__ == "__main__":
     import uvicorn
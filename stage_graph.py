@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Stage:
+    """规划流程中的一个阶段
+
+    func 以关键字参数接收其依赖阶段的结果（参数名即依赖阶段名）；
+    fallback 以异常和同样的依赖结果为参数，返回阶段失败或超时时的替代结果，
+    未提供 fallback 时阶段失败会终止整个流程。
+    """
+    name: str
+    func: Callable[..., Awaitable[Any]]
+    deps: tuple = ()
+    timeout: Optional[float] = None
+    fallback: Optional[Callable[..., Any]] = None
+
+class StageTimeout(Exception):
+    """阶段执行超时"""
+
+class StageFailed(Exception):
+    """没有 fallback 的阶段执行失败"""
+
+    def __init__(self, stage: str, cause: BaseException):
+        super().__init__(f"{stage}: {cause}")
+        self.stage = stage
+        self.cause = cause
+
+def validate_stages(stages: list[Stage]):
+    """检查阶段名唯一、依赖存在且不存在环"""
+    names = {stage.name for stage in stages}
+    if len(names) != len(stages):
+        raise ValueError("阶段名称重复")
+    deps = {stage.name: stage.deps for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in names]
+        if missing:
+            raise ValueError(f"阶段 {stage.name} 依赖不存在的阶段: {missing}")
+    visiting, done = set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"阶段依赖存在环: {name}")
+        visiting.add(name)
+        for dep in deps[name]:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+
+    for stage in stages:
+        visit(stage.name)
+
+async def run_with_timeout(name: str, coro: Awaitable[Any], timeout: Optional[float]) -> Any:
+    """执行阶段协程，只有本函数的计时到期才抛出 StageTimeout
+
+    阶段内部自己抛出的 asyncio.TimeoutError（例如 httpx 或内层 wait_for 超时）按普通异常向上传递，
+    不会被当作阶段超时。
+    """
+    if timeout is None:
+        return await coro
+    task = asyncio.ensure_future(coro)
+    try:
+        done, _ = await asyncio.wait({task}, timeout=timeout) if timeout > 0 else (set(), set())
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    if not done:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise StageTimeout(f"{name} 超时（{round(timeout, 1)}秒）")
+    return task.result()
+
+async def run_stage_graph(
+    stages: list[Stage],
+    on_complete: Optional[Callable[[str, Any], None]] = None,
+    deadline: Optional[float] = None,
+    on_timing: Optional[Callable[[str, dict], None]] = None,
+) -> tuple[dict, dict]:
+    """按依赖关系并发执行各阶段，每个阶段在其依赖全部完成后立即开始
+
+    Args:
+        stages: 阶段列表
+        on_complete: 每个阶段得到结果（含回退结果）后立即调用，参数为阶段名和结果
+        deadline: 整个流程的截止时刻（time.monotonic()），各阶段超时不会晚于该时刻
+        on_timing: 每个阶段结束（含失败和取消）时调用，参数为阶段名和该阶段的耗时记录
+
+    Returns:
+        (results, timings)：各阶段结果，以及各阶段相对开始时间、耗时和状态
+    """
+    validate_stages(stages)
+    start = time.monotonic()
+    tasks: dict[str, asyncio.Task] = {}
+    timings: dict[str, dict] = {}
+
+    async def run(stage: Stage):
+        inputs = {dep: await tasks[dep] for dep in stage.deps}
+        stage_start = time.monotonic()
+        status = "ok"
+        timeout = stage.timeout
+        if deadline is not None:
+            remaining = max(deadline - stage_start, 0)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        try:
+            result = await run_with_timeout(stage.name, stage.func(**inputs), timeout)
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except Exception as e:
+            if stage.fallback is None:
+                status = "failed"
+                raise StageFailed(stage.name, e) from e
+            logger.error(f"阶段 {stage.name} 失败，使用回退结果: {e}")
+            status = "timeout" if isinstance(e, StageTimeout) else "fallback"
+            result = stage.fallback(e, **inputs)
+        finally:
+            timings[stage.name] = {
+                "start": round(stage_start - start, 3),
+                "duration": round(time.monotonic() - stage_start, 3),
+                "status": status,
+            }
+            if on_timing:
+                on_timing(stage.name, timings[stage.name])
+        if on_complete:
+            on_complete(stage.name, result)
+        return result
+
+    for stage in stages:
+        tasks[stage.name] = asyncio.ensure_future(run(stage))
+    try:
+        # 依赖失败的阶段会收到同一个 StageFailed，这里取第一个失败的阶段抛出
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    logger.info(f"阶段耗时: {timings}")
+    return {name: task.result() for name, task in tasks.items()}, timings
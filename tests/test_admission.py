@@ -0,0 +1,146 @@
+import asyncio
+
+import httpx
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+def controller(max_active=1, max_queue=10, max_queue_per_client=10):
+    return AdmissionController(max_active, max_queue, max_queue_per_client, default_retry_after=30)
+
+def test_admits_immediately_while_slots_are_free():
+    async def scenario():
+        admission = controller(max_active=2)
+        first, second = admission.reserve("a"), admission.reserve("a")
+        third = admission.reserve("a")
+        return first, second, third, admission
+
+    first, second, third, admission = asyncio.run(scenario())
+    assert first.admitted is not None and second.admitted is not None
+    assert third.admitted is None
+    assert admission.stats()["active"] == 2
+    assert admission.stats()["queued"] == 1
+
+def test_queued_requests_are_admitted_round_robin_by_client():
+    async def scenario():
+        admission = controller()
+        running = admission.reserve("busy")
+        queued = [admission.reserve(client) for client in ("busy", "busy", "busy", "a", "b")]
+        positions = [admission.position(ticket) for ticket in queued]
+        order = []
+        current = running
+        for _ in queued:
+            admission.release(current)
+            current = next(ticket for ticket in queued if ticket.admitted is not None and ticket not in order)
+            order.append(current)
+        return positions, [queued.index(ticket) for ticket in order]
+
+    positions, order = asyncio.run(scenario())
+    # busy、a、b 各放行一个后，才轮到 busy 的第二、三个请求
+    assert order == [0, 3, 4, 1, 2]
+    assert positions == [0, 3, 4, 1, 2]
+
+def test_rejects_when_queue_is_full():
+    async def scenario():
+        admission = controller(max_queue=2)
+        admission.reserve("a")
+        admission.reserve("b")
+        admission.reserve("c")
+        with pytest.raises(AdmissionRejected) as info:
+            admission.reserve("d")
+        return info.value, admission
+
+    error, admission = asyncio.run(scenario())
+    assert error.retry_after == 30
+    assert admission.stats()["rejected"] == 1
+
+def test_rejects_client_over_its_queue_share():
+    async def scenario():
+        admission = controller(max_queue_per_client=1)
+        admission.reserve("a")
+        admission.reserve("a")
+        with pytest.raises(AdmissionRejected):
+            admission.reserve("a")
+        # 其他客户端不受影响
+        return admission.reserve("b")
+
+    assert asyncio.run(scenario()).admitted is None
+
+def test_release_of_queued_ticket_leaves_queue():
+    async def scenario():
+        admission = controller()
+        running = admission.reserve("a")
+        waiting = admission.reserve("b")
+        admission.release(waiting)
+        admission.release(waiting)
+        admission.release(running)
+        return admission.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["active"] == 0
+    assert stats["queued"] == 0
+    assert stats["completed"] == 1
+
+def test_wait_reports_position_until_admitted():
+    async def scenario():
+        admission = controller()
+        running = admission.reserve("a")
+        waiting = admission.reserve("b")
+        positions = []
+        waiter = asyncio.ensure_future(admission.wait(waiting, positions.append, interval=0.01))
+        await asyncio.sleep(0.03)
+        admission.release(running)
+        await waiter
+        return positions, waiting
+
+    positions, waiting = asyncio.run(scenario())
+    assert positions == [0]
+    assert waiting.admitted is not None
+
+def test_plan_endpoint_returns_429_with_retry_after(monkeypatch):
+    import main
+
+    admission = controller(max_queue=0)
+    monkeypatch.setattr(main, "admission", admission)
+
+    async def slow_plan(request, emit=None, default_deadline=None):
+        await asyncio.sleep(0.2)
+        return {"ok": True}
+
+    monkeypatch.setattr(main, "execute_plan", slow_plan)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            body = {"mode": "单城市", "city": "杭州", "days": 2, "user_input": "杭州两日游"}
+            first = asyncio.ensure_future(client.post("/plan", json=body))
+            await asyncio.sleep(0.05)
+            rejected = await client.post("/plan", json=body)
+            return await first, rejected
+
+    first, rejected = asyncio.run(scenario())
+    assert first.status_code == 200
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == "30"
+
+def test_invalid_request_is_rejected_before_admission(monkeypatch):
+    import main
+
+    admission = controller(max_active=1, max_queue=0)
+    monkeypatch.setattr(main, "admission", admission)
+
+    async def scenario():
+        admission.reserve("other")
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            body = {"mode": "单城市", "city": "杭州", "days": 2, "user_input": "杭州两日游"}
+            return [
+                await client.post(path, json={**body, **invalid})
+                for path in ("/plan", "/plan/stream", "/plan/jobs")
+                for invalid in ({"summary_mode": "unknown"}, {"deadline_seconds": 0}, {"days": 0})
+            ]
+
+    responses = asyncio.run(scenario())
+    assert [response.status_code for response in responses] == [400] * 9
+    assert admission.stats()["rejected"] == 0
+    assert admission.stats()["queued"] == 0
@@ -0,0 +1,48 @@
+import asyncio
+import sqlite3
+
+from gaode_mcp_server import AmapResponseCache
+
+def test_concurrent_disk_access_does_not_error(tmp_path):
+    async def scenario():
+        # 内存层只保留一条，迫使读取落到磁盘层
+        cache = AmapResponseCache(1, 1024 * 1024, str(tmp_path / "amap.db"), db_purge_interval=0)
+
+        async def worker(i):
+            key = f"key-{i % 50}"
+            await cache.set(key, {"status": "1", "i": i}, 60)
+            await cache.get(key)
+
+        await asyncio.gather(*(worker(i) for i in range(1000)))
+        return cache.counters
+
+    counters = asyncio.run(scenario())
+    assert counters["disk_errors"] == 0
+    assert counters["disk_hits"] > 0
+
+def test_disk_failure_does_not_fail_the_call(tmp_path):
+    async def scenario():
+        cache = AmapResponseCache(10, 1024 * 1024, str(tmp_path / "amap.db"))
+        cache._db.close()
+        await cache.set("key", {"status": "1"}, 60)
+        cache._memory.clear()
+        return await cache.get("key"), cache.counters
+
+    value, counters = asyncio.run(scenario())
+    assert value is None
+    assert counters["disk_errors"] == 2
+
+def test_disk_tier_purges_expired_and_bounds_entries(tmp_path):
+    path = str(tmp_path / "amap.db")
+
+    async def scenario():
+        cache = AmapResponseCache(10, 1024 * 1024, path, db_max_entries=5, db_purge_interval=0)
+        await cache.set("expired", {"status": "1"}, -1)
+        for i in range(10):
+            await cache.set(f"key-{i}", {"status": "1"}, 60 + i)
+        return cache.counters
+
+    counters = asyncio.run(scenario())
+    keys = {row[0] for row in sqlite3.connect(path).execute("SELECT key FROM amap_cache")}
+    assert keys == {f"key-{i}" for i in range(5, 10)}
+    assert counters["disk_evictions"] > 0
@@ -0,0 +1,32 @@
+import asyncio
+
+import gaode_mcp_server
+from gaode_mcp_server import distance_matrix
+
+def test_failed_chunk_is_reported_per_destination(monkeypatch):
+    async def fake_amap_get(path, params, base_url=None, tool=""):
+        if params["destination"] == "bad":
+            return {"status": "0", "info": "INVALID_PARAMS"}
+        origins = params["origins"].split("|")
+        return {"status": "1", "results": [
+            {"origin_id": str(i + 1), "distance": "100", "duration": "60"} for i in range(len(origins))
+        ]}
+
+    monkeypatch.setattr(gaode_mcp_server, "amap_get", fake_amap_get)
+    result = asyncio.run(distance_matrix(["1,1", "2,2"], ["3,3", "bad"]))
+
+    assert result["distances"] == [[100, None], [100, None]]
+    assert result["durations"] == [[60, None], [60, None]]
+    assert result["errors"] == [{"destination": "bad", "origins": ["1,1", "2,2"], "error": "Distance matrix failed: INVALID_PARAMS"}]
+
+def test_request_exception_does_not_fail_the_matrix(monkeypatch):
+    async def fake_amap_get(path, params, base_url=None, tool=""):
+        if params["destination"] == "bad":
+            raise RuntimeError("timeout")
+        return {"status": "1", "results": [{"origin_id": "1", "distance": "5", "duration": "1"}]}
+
+    monkeypatch.setattr(gaode_mcp_server, "amap_get", fake_amap_get)
+    result = asyncio.run(distance_matrix(["1,1"], ["bad", "3,3"]))
+
+    assert result["distances"] == [[None, 5]]
+    assert result["errors"][0]["error"] == "Distance matrix failed: timeout"
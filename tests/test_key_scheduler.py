@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import pytest
+
+from gaode_mcp_server import DAILY_COOLDOWN, AmapKeyScheduler, AmapQuotaExhausted, KeyBucket
+
+def test_bucket_wait_time_follows_qps():
+    now = time.monotonic()
+    bucket = KeyBucket("key", 4)
+    bucket.updated = now
+    assert bucket.wait_time(now) == 0
+    bucket.tokens = 0
+    assert bucket.wait_time(now) == pytest.approx(0.25)
+    bucket.refill(now + 0.25)
+    assert bucket.tokens == pytest.approx(1)
+    bucket.blocked_until = now + 2
+    assert bucket.wait_time(now) == pytest.approx(2)
+
+def test_acquire_waits_for_tokens():
+    async def scenario():
+        scheduler = AmapKeyScheduler(["a:5"], 3)
+        start = time.monotonic()
+        for _ in range(5):
+            assert await scheduler.acquire() == "a"
+        burst = time.monotonic() - start
+        await scheduler.acquire()
+        return burst, time.monotonic() - start
+
+    burst, total = asyncio.run(scenario())
+    assert burst < 0.05
+    assert 0.15 < total < 0.5
+
+def test_higher_priority_is_served_first():
+    async def scenario():
+        scheduler = AmapKeyScheduler(["a:10"], 3)
+        for _ in range(10):
+            await scheduler.acquire()
+        order = []
+
+        async def request(name, priority):
+            await scheduler.acquire(priority)
+            order.append(name)
+
+        low = asyncio.ensure_future(request("search", 2))
+        await asyncio.sleep(0)
+        high = asyncio.ensure_future(request("weather", 0))
+        await asyncio.gather(low, high)
+        return order
+
+    assert asyncio.run(scenario()) == ["weather", "search"]
+
+def test_requests_spread_across_keys():
+    async def scenario():
+        scheduler = AmapKeyScheduler(["a:2", "b:2"], 3)
+        return [await scheduler.acquire() for _ in range(4)]
+
+    assert sorted(asyncio.run(scenario())) == ["a", "a", "b", "b"]
+
+def test_penalized_key_is_skipped():
+    async def scenario():
+        scheduler = AmapKeyScheduler(["a:5", "b:5"], 3)
+        scheduler.penalize("a", 60)
+        return {await scheduler.acquire() for _ in range(3)}
+
+    assert asyncio.run(scenario()) == {"b"}
+
+def test_invalid_qps_keys_are_skipped():
+    scheduler = AmapKeyScheduler(["a:0", "b:abc", "c:-1", "d:2", "e"], 3)
+    assert [(bucket.key, bucket.qps) for bucket in scheduler.buckets] == [("d", 2), ("e", 3)]
+    with pytest.raises(ValueError):
+        AmapKeyScheduler(["a:0"], 3)
+
+def test_acquire_fails_fast_when_every_key_is_daily_blocked():
+    async def scenario():
+        scheduler = AmapKeyScheduler(["a:5", "b:5"], 3)
+        scheduler.penalize("a", DAILY_COOLDOWN)
+        scheduler.penalize("b", DAILY_COOLDOWN)
+        with pytest.raises(AmapQuotaExhausted) as info:
+            await asyncio.wait_for(scheduler.acquire(), 1)
+        return info.value
+
+    error = asyncio.run(scenario())
+    assert error.retry_after > DAILY_COOLDOWN - 5
+
+def test_queued_requests_fail_when_last_key_becomes_daily_blocked():
+    async def scenario():
+        scheduler = AmapKeyScheduler(["a:1"], 3)
+        await scheduler.acquire()
+        waiter = asyncio.ensure_future(scheduler.acquire())
+        await asyncio.sleep(0.05)
+        scheduler.penalize("a", DAILY_COOLDOWN)
+        scheduler._wakeup.set()
+        with pytest.raises(AmapQuotaExhausted):
+            await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(scenario())
+
+def test_short_qps_cooldown_still_waits():
+    async def scenario():
+        scheduler = AmapKeyScheduler(["a:5"], 3)
+        scheduler.penalize("a", 0.1)
+        return await asyncio.wait_for(scheduler.acquire(), 1)
+
+    assert asyncio.run(scenario()) == "a"
@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.load import dumps
+from langchain_core.tools import tool
+from langgraph.prebuilt import create_react_agent
+
+from fake_llm import FakeChatModel
+from llm_cache import SQLiteLLMCache, llm_cache_bypass
+
+SCRIPT = [
+    {"name": "view", "match": ["门票价格"], "steps": [
+        {"tool_calls": [{"name": "keyword_search", "args": {"keywords": "景点", "types": "110000"}}]},
+        {"content": "景点安排：西湖"},
+    ]},
+]
+
+@tool
+def keyword_search(keywords: str, types: str) -> str:
+    """关键词搜索"""
+    return json.dumps({"pois": [{"name": "西湖"}]}, ensure_ascii=False)
+
+def run_agent(model: FakeChatModel) -> list:
+    agent = create_react_agent(model, [keyword_search])
+    result = asyncio.run(agent.ainvoke({"messages": [SystemMessage("查询门票价格"), HumanMessage("杭州")]}))
+    return result["messages"]
+
+def test_same_agent_run_twice_hits_cache(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "llm.db"), ttl=60, max_entries=100)
+    model = FakeChatModel(script=SCRIPT, cache=cache)
+
+    first = run_agent(model)
+    assert cache.counters["hits"] == 0
+    assert cache.counters["misses"] == 2
+
+    second = run_agent(model)
+    assert cache.counters["hits"] == 2
+    assert cache.counters["misses"] == 2
+    assert second[-1].content == first[-1].content == "景点安排：西湖"
+
+def test_key_ignores_per_run_ids():
+    def prompt(run: str) -> str:
+        return dumps([
+            HumanMessage("杭州", id=f"human-{run}"),
+            AIMessage("", id=f"ai-{run}", tool_calls=[{"name": "keyword_search", "args": {"keywords": "景点"}, "id": f"call_{run}"}]),
+            ToolMessage("西湖", tool_call_id=f"call_{run}", name="keyword_search", id=f"tool-{run}"),
+        ])
+
+    assert SQLiteLLMCache.make_key(prompt("a"), "llm") == SQLiteLLMCache.make_key(prompt("b"), "llm")
+
+def test_key_distinguishes_tool_output():
+    def prompt(output: str) -> str:
+        return dumps([HumanMessage("杭州"), ToolMessage(output, tool_call_id="call_1", name="keyword_search")])
+
+    assert SQLiteLLMCache.make_key(prompt("西湖"), "llm") != SQLiteLLMCache.make_key(prompt("灵隐寺"), "llm")
+
+def test_bypass_skips_cache(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "llm.db"), ttl=60, max_entries=100)
+    model = FakeChatModel(script=SCRIPT, cache=cache)
+    run_agent(model)
+    token = llm_cache_bypass.set(True)
+    try:
+        asyncio.run(model.ainvoke([HumanMessage("杭州")]))
+    finally:
+        llm_cache_bypass.reset(token)
+    assert cache.counters["bypassed"] == 1
+    assert cache.counters["hits"] == 0
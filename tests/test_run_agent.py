@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+class FakeAgent:
+    """每一步都要求调用工具的 Agent，记录 astream 生成器是否被关闭"""
+
+    def __init__(self, step_delay=0.0):
+        self.step_delay = step_delay
+        self.closed = False
+
+    async def astream(self, state, config=None, stream_mode=None):
+        messages = list(state["messages"])
+        try:
+            step = 0
+            while True:
+                step += 1
+                await asyncio.sleep(self.step_delay)
+                call = {"name": "keyword_search", "args": {"keywords": f"k{step}"}, "id": f"c{step}"}
+                messages = messages + [AIMessage(content="", tool_calls=[call])]
+                yield "values", {"messages": messages}
+        finally:
+            self.closed = True
+
+def test_budget_stop_closes_agent_stream(monkeypatch):
+    import main
+
+    async def finalize(history):
+        return AIMessage(content="部分结果")
+
+    monkeypatch.setattr(main, "finalize_answer", finalize)
+    agent = FakeAgent()
+
+    async def scenario():
+        result = await main.run_agent(agent, [HumanMessage("hi")], budget={"max_steps": 2})
+        # 在事件循环结束（统一回收未关闭的生成器）之前检查
+        return result, agent.closed
+
+    (content, responses), closed = asyncio.run(scenario())
+    assert content == "部分结果"
+    assert len(responses) == 3
+    assert closed
+
+def test_deadline_closes_agent_stream(monkeypatch):
+    import main
+
+    agent = FakeAgent(step_delay=0.05)
+    messages = [HumanMessage("hi")]
+    monkeypatch.setattr(main, "partial_output", lambda new_messages: "部分结果")
+
+    async def scenario():
+        result = await main.run_agent(agent, messages, deadline=time.monotonic() + 0.12)
+        return result, agent.closed
+
+    (content, _), closed = asyncio.run(scenario())
+    assert content == "部分结果"
+    assert closed
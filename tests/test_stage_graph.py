@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+import pytest
+
+from stage_graph import Stage, StageFailed, StageTimeout, run_stage_graph, validate_stages
+
+def run(stages, **kwargs):
+    return asyncio.run(run_stage_graph(stages, **kwargs))
+
+def test_stages_start_after_their_dependencies():
+    order = []
+
+    def stage(name, delay):
+        async def func(**inputs):
+            order.append(f"{name}:start")
+            await asyncio.sleep(delay)
+            order.append(f"{name}:end")
+            return name + "".join(sorted(inputs))
+        return func
+
+    results, timings = run([
+        Stage("summary", stage("summary", 0), deps=("view", "food")),
+        Stage("view", stage("view", 0.02), deps=("weather",)),
+        Stage("food", stage("food", 0.01)),
+        Stage("weather", stage("weather", 0.01)),
+    ])
+
+    assert results["summary"] == "summaryfoodview"
+    assert order.index("view:start") > order.index("weather:end")
+    assert order.index("summary:start") > max(order.index("view:end"), order.index("food:end"))
+    # 无依赖的阶段同时开始
+    assert order[:2] == ["food:start", "weather:start"]
+    assert all(timing["status"] == "ok" for timing in timings.values())
+
+def test_timeout_uses_fallback():
+    async def slow():
+        await asyncio.sleep(1)
+
+    results, timings = run([
+        Stage("weather", slow, timeout=0.05, fallback=lambda e: f"fallback: {type(e).__name__}"),
+    ])
+
+    assert results["weather"] == "fallback: StageTimeout"
+    assert timings["weather"]["status"] == "timeout"
+    assert timings["weather"]["duration"] < 0.5
+
+def test_inner_timeout_is_not_a_stage_timeout():
+    async def inner_timeout():
+        raise asyncio.TimeoutError
+
+    for timeout in (None, 5):
+        results, timings = run([
+            Stage("weather", inner_timeout, timeout=timeout, fallback=lambda e: type(e).__name__),
+        ])
+        assert results["weather"] == "TimeoutError"
+        assert timings["weather"]["status"] == "fallback"
+
+def test_failure_without_fallback_cancels_dependents():
+    async def boom():
+        raise ValueError("boom")
+
+    async def dependent(weather):
+        return weather
+
+    with pytest.raises(StageFailed) as info:
+        run([Stage("weather", boom), Stage("view", dependent, deps=("weather",))])
+    assert info.value.stage == "weather"
+    assert isinstance(info.value.cause, ValueError)
+
+def test_deadline_clamps_stage_timeout():
+    async def slow():
+        await asyncio.sleep(1)
+
+    start = time.monotonic()
+    results, timings = run(
+        [Stage("weather", slow, timeout=10, fallback=lambda e: isinstance(e, StageTimeout))],
+        deadline=time.monotonic() + 0.05,
+    )
+    assert results["weather"] is True
+    assert time.monotonic() - start < 0.5
+
+def test_validate_rejects_cycles_and_missing_deps():
+    async def noop(**inputs):
+        return None
+
+    with pytest.raises(ValueError):
+        validate_stages([Stage("a", noop, deps=("b",)), Stage("b", noop, deps=("a",))])
+    with pytest.raises(ValueError):
+        validate_stages([Stage("a", noop, deps=("missing",))])
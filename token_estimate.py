@@ -0,0 +1,7 @@
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：ASCII 约 4 字符一个 token，其他字符（中文）约一字一个 token
+
+    规划服务（工具定义节省量统计）和假模型（模拟 token 用量）共用，保证两边口径一致。
+    """
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return ascii_chars // 4 + (len(text) - ascii_chars)
@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# 追踪数据输出：TRACE_FILE 为本地文件（每行一条 OTLP/JSON 格式的 ExportTraceServiceRequest，
+# 与 OpenTelemetry Collector 的 file exporter 格式一致），TRACE_OTLP_ENDPOINT 为 OTLP/HTTP 接收地址
+# （例如 http://localhost:4318/v1/traces）；两者都为空时只传递追踪 ID，不记录 span
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+@dataclass(frozen=True)
+class SpanContext:
+    trace_id: str
+    span_id: str
+
+    @property
+    def traceparent(self) -> str:
+        """W3C traceparent 格式"""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+# 当前所在的 span，随 asyncio 任务一起复制，子任务中创建的 span 自动以它为父 span
+current_span: ContextVar[Optional[SpanContext]] = ContextVar("current_span", default=None)
+
+service_name = "unknown"
+
+def set_service_name(name: str):
+    """设置本进程输出 span 时使用的 service.name"""
+    global service_name
+    service_name = name
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    """解析 traceparent 请求头，格式无效时返回 None"""
+    match = TRACEPARENT_PATTERN.match((value or "").strip().lower())
+    return SpanContext(match.group(1), match.group(2)) if match else None
+
+def traceparent() -> Optional[str]:
+    """当前 span 的 traceparent，用于向下游传递"""
+    span_context = current_span.get()
+    return span_context.traceparent if span_context else None
+
+def trace_id() -> Optional[str]:
+    span_context = current_span.get()
+    return span_context.trace_id if span_context else None
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+@contextmanager
+def span(name: str, parent: Optional[SpanContext] = None, kind: str = "internal", **attributes):
+    """记录一个 span，期间它是当前 span
+
+    parent 为空时以当前 span 为父 span，当前也没有 span 时开始一条新的追踪；
+    kind 为 internal/server/client，attributes 会作为 span 属性输出。
+    返回属性字典，结束前写入的属性（例如结果来源、调用次数）会一并输出。
+    """
+    parent = parent or current_span.get()
+    span_context = SpanContext(parent.trace_id if parent else secrets.token_hex(16), secrets.token_hex(8))
+    token = current_span.set(span_context)
+    start = time.time_ns()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        current_span.reset(token)
+        if TRACE_FILE or TRACE_OTLP_ENDPOINT:
+            record = {
+                "traceId": span_context.trace_id,
+                "spanId": span_context.span_id,
+                "name": name,
+                "kind": {"internal": 1, "server": 2, "client": 3}[kind],
+                "startTimeUnixNano": str(start),
+                "endTimeUnixNano": str(time.time_ns()),
+                "attributes": [_attribute(key, value) for key, value in attributes.items() if value is not None],
+                "status": {"code": 2, "message": f"{type(error).__name__}: {error}"} if error else {"code": 1},
+            }
+            if parent:
+                record["parentSpanId"] = parent.span_id
+            _exporter.export(record)
+
+class _SpanExporter:
+    """在后台线程中把 span 写入文件或发送到 OTLP/HTTP 接收端，不阻塞事件循环"""
+
+    def __init__(self):
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, record: dict):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                    self._thread.start()
+        self._queue.put((service_name, record))
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while not self._queue.empty() and len(batch) < 512:
+                batch.append(self._queue.get())
+            by_service: dict[str, list] = {}
+            for name, record in batch:
+                by_service.setdefault(name, []).append(record)
+            payload = json.dumps({
+                "resourceSpans": [
+                    {
+                        "resource": {"attributes": [_attribute("service.name", name)]},
+                        "scopeSpans": [{"scope": {"name": "travel-planner"}, "spans": records}],
+                    }
+                    for name, records in by_service.items()
+                ]
+            }, ensure_ascii=False)
+            try:
+                if TRACE_FILE:
+                    with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                        f.write(payload + "\n")
+                if TRACE_OTLP_ENDPOINT:
+                    request = urllib.request.Request(
+                        TRACE_OTLP_ENDPOINT, payload.encode("utf-8"), {"Content-Type": "application/json"}
+                    )
+                    urllib.request.urlopen(request, timeout=5).close()
+            except Exception as e:
+                logger.warning(f"追踪数据导出失败: {e}")
+
+_exporter = _SpanExporter()